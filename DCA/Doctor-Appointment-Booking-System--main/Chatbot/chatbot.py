@@ -1,17 +1,42 @@
-def get_response(user_input):
-    user_input = user_input.lower()
+import re
+import logging
+
+from specialty_recommender import SpecialtyRecommender
+
+logger = logging.getLogger(__name__)
+
+# Built once at import; every request is a single lookup against the index.
+try:
+    recommender = SpecialtyRecommender.from_file()
+except (OSError, ValueError) as e:
+    logger.warning(f"Specialty recommender not available: {str(e)}")
+    recommender = None
 
-    if "صداع" in user_input or "وجع راس" in user_input:
-        return "أنصحك تروح لدكتور مخ وأعصاب (Neurologist)."
+GREETINGS = ("السلام عليكم", "سلام", "مرحبا", "أهلا", "اهلا", "صباح الخير", "مساء الخير", "ازيك", "هاي")
+# Whole words only, longest first, so "سلام" is not cut out of "السلامة"
+GREETINGS_PATTERN = re.compile(
+    r"(?<!\w)(?:" + "|".join(re.escape(greeting) for greeting in sorted(GREETINGS, key=len, reverse=True)) + r")(?!\w)"
+)
 
-    elif "سخونية" in user_input or "حرارة" in user_input:
-        return "ممكن تكون إنفلونزا. يفضل تروح لطبيب باطنة (Internal Medicine)."
+def strip_greetings(text):
+    """Remove greetings, leaving whatever else the message says."""
+    return GREETINGS_PATTERN.sub(" ", text).strip(" \t\n،,.!؟?")
 
-    elif "حجز" in user_input or "موعد" in user_input:
+def get_response(user_input):
+    user_input = user_input.lower()
+
+    # Intents come first: the character n-grams of a booking request or a
+    # greeting always resemble some symptom phrase.
+    if "حجز" in user_input or "موعد" in user_input:
         return "تقدر تحجز من خلال صفحة الحجز في الموقع أو التطبيق."
 
-    elif "أنف" in user_input or "أذن" in user_input:
-        return "دكتور أنف وأذن متاح بكرة الساعة 5 مساءً. تحب أحجزلك؟"
+    symptoms = strip_greetings(user_input)
+    if not symptoms:
+        return "أهلاً بك! أنا مساعد طبي ذكي بسيط، اسألني عن أعراض أو حجز مواعيد."
+
+    if recommender is not None:
+        matches = recommender.recommend(symptoms, top_k=1)
+        if matches:
+            return f"أنصحك تروح لدكتور {matches[0]['name']}."
 
-    else:
-        return "أنا مساعد طبي ذكي بسيط، اسألني عن أعراض أو حجز مواعيد."
+    return "أنا مساعد طبي ذكي بسيط، اسألني عن أعراض أو حجز مواعيد."
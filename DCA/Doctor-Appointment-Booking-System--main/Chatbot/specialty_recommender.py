@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import re
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+logger = logging.getLogger(__name__)
+
+# Export of the Specialization table (GET /api/Specializations/AllSpecializations),
+# optionally enriched with a "symptoms" list per specialization.
+DEFAULT_SPECIALIZATIONS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "specializations.json"
+)
+
+
+# Words in most symptom descriptions; their n-grams would otherwise make
+# unrelated phrases look alike.
+FILLER_WORDS = {"عندي", "عندى", "ممكن", "في", "مع", "من", "على", "عن", "انا", "جدا", "شديد", "شويه", "بقالي", "لي", "و"}
+
+
+def normalize_arabic(text):
+    """Lower-case and fold the Arabic letter variants that users mix freely."""
+    text = text.lower()
+    text = re.sub(r'[إأآا]', 'ا', text)
+    text = re.sub(r'[ىي]', 'ي', text)
+    text = re.sub(r'ة', 'ه', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def _index_text(text):
+    """Normalize a phrase or query and drop its filler words."""
+    return " ".join(word for word in normalize_arabic(text).split() if word not in FILLER_WORDS)
+
+
+def _field(item, name):
+    """Read a field from either the camelCase API export or PascalCase rows."""
+    return item.get(name, item.get(name[0].upper() + name[1:]))
+
+
+class SpecialtyRecommender:
+    """Nearest-neighbour lookup from a symptom description to doctor specializations.
+
+    Every specialization name, description and symptom phrase becomes one
+    L2-normalized row of a dense matrix. Rows are grouped by specialization so
+    a query is answered with one matrix-vector product, a max-reduce per
+    specialization and a partial sort for the top-k.
+    """
+
+    def __init__(self, specializations, min_score=0.4, min_margin=0.1):
+        """
+        Args:
+            specializations: Rows of the Specialization table
+            min_score: Lowest cosine score a recommendation may have
+            min_margin: How far the best specialization must score above the
+                runner-up; a closer call is ambiguous and gets no recommendation
+        """
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.specializations = []
+        phrases = []
+        offsets = []
+
+        for item in specializations:
+            name = _field(item, "name")
+            if not name:
+                continue
+            description = _field(item, "description") or ""
+            symptoms = _field(item, "symptoms") or []
+
+            offsets.append(len(phrases))
+            phrases.extend(_index_text(p) for p in [name, description, *symptoms] if p)
+            self.specializations.append({"id": _field(item, "id"), "name": name})
+
+        if not self.specializations:
+            raise ValueError("No specializations to index")
+
+        self.vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True)
+        matrix = self.vectorizer.fit_transform(phrases).toarray().astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = matrix / norms
+        self._offsets = np.asarray(offsets, dtype=np.intp)
+
+        # Query featurization bypasses vectorizer.transform(), whose per-call
+        # overhead dominates for a single short string.
+        self._analyzer = self.vectorizer.build_analyzer()
+        self._vocabulary = self.vectorizer.vocabulary_
+        self._idf = self.vectorizer.idf_.astype(np.float32)
+
+        logger.info(
+            f"Indexed {len(self.specializations)} specializations "
+            f"({self.matrix.shape[0]} phrases, {self.matrix.shape[1]} features)"
+        )
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_SPECIALIZATIONS_PATH, **kwargs):
+        """Build a recommender from a JSON export of the Specialization table."""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), **kwargs)
+
+    def _vectorize(self, text):
+        """Return the (feature indices, weights) of a normalized query vector."""
+        counts = {}
+        for gram in self._analyzer(_index_text(text)):
+            index = self._vocabulary.get(gram)
+            if index is not None:
+                counts[index] = counts.get(index, 0) + 1
+
+        if not counts:
+            return None, None
+
+        indices = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        weights = (1.0 + np.log(tf)) * self._idf[indices]
+        return indices, weights / np.linalg.norm(weights)
+
+    def recommend(self, text, top_k=3):
+        """Return up to top_k specializations for the text, best first.
+
+        Each result is a dict with the specialization id, name and cosine score.
+        Specializations scoring below min_score are dropped, and nothing is
+        returned when the best one is not min_margin ahead of the runner-up.
+        """
+        indices, weights = self._vectorize(text)
+        if indices is None:
+            return []
+
+        phrase_scores = self.matrix[:, indices] @ weights
+        scores = np.maximum.reduceat(phrase_scores, self._offsets)
+
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+
+        if len(scores) > 1:
+            runner_up = scores[best[1]] if top_k > 1 else np.partition(scores, -2)[-2]
+            if scores[best[0]] - runner_up < self.min_margin:
+                return []
+
+        return [
+            {**self.specializations[i], "score": float(scores[i])}
+            for i in best
+            if scores[i] >= self.min_score
+        ]
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Regression tests for the chatbot's intent handling and specialty recommendations.
+Run with pytest, or directly: python test_chatbot.py
+"""
+
+import sys
+import logging
+
+from chatbot import get_response, strip_greetings
+from specialty_recommender import SpecialtyRecommender
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BOOKING_REPLY = "تقدر تحجز من خلال صفحة الحجز في الموقع أو التطبيق."
+
+# Message -> expected recommended specialization
+SYMPTOM_CASES = {
+    "عندي ألم في البطن": "Gastroenterology",
+    "عندي صداع": "Neurology",
+    "السلام عليكم، عندي صداع": "Neurology",
+    "ألم في الصدر": "Cardiology",
+    "كحة مستمرة": "Pulmonology",
+    "عندي طفح جلدي وحكة": "Dermatology",
+    "ألم في الأذن": "Otolaryngology (ENT)",
+}
+
+def test_booking_before_symptoms():
+    """A booking request gets the booking reply, not a specialization its n-grams resemble."""
+    for message in ("ممكن احجز موعد مع دكتور", "عايز احجز", "عايز موعد"):
+        assert get_response(message) == BOOKING_REPLY, message
+
+def test_greetings_are_not_symptoms():
+    """A bare greeting is answered as a greeting, not routed to a specialization."""
+    for message in ("السلام عليكم", "مرحبا", "مساء الخير"):
+        response = get_response(message)
+        assert "أنصحك" not in response, f"{message} -> {response}"
+
+def test_greetings_stripped_as_whole_words():
+    """Greetings inside longer words are part of the message, not greetings."""
+    assert strip_greetings("السلام عليكم، عندي صداع") == "عندي صداع"
+    assert strip_greetings("مرحبا عندي صداع") == "عندي صداع"
+    for message in ("السلامة", "عندي سؤال عن السلامة", "سلامات"):
+        assert strip_greetings(message) == message, message
+
+def test_symptoms_route_to_specialization():
+    for message, specialization in SYMPTOM_CASES.items():
+        response = get_response(message)
+        assert response == f"أنصحك تروح لدكتور {specialization}.", f"{message} -> {response}"
+
+def test_noise_has_no_recommendation():
+    """Messages without symptoms stay below min_score or within min_margin."""
+    recommender = SpecialtyRecommender.from_file()
+    for message in ("شكرا", "عايز اعرف", "ازيك"):
+        assert recommender.recommend(message, top_k=1) == [], message
+
+if __name__ == "__main__":
+    tests = [
+        test_booking_before_symptoms, test_greetings_are_not_symptoms, test_greetings_stripped_as_whole_words,
+        test_symptoms_route_to_specialization, test_noise_has_no_recommendation
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            logger.info(f"{test.__name__} passed")
+        except AssertionError as e:
+            logger.error(f"{test.__name__} failed: {e}")
+            failed += 1
+    sys.exit(1 if failed else 0)
@@ -12,11 +12,10 @@ from chatbot import get_response
 try:
     from medllama.medllama_integration import MedLLamaIntegration
     MEDLLAMA_AVAILABLE = True
-    medllama_integration = MedLLamaIntegration()
 except ImportError:
     MEDLLAMA_AVAILABLE = False
-    medllama_integration = None
     logging.warning("MedLLama integration not available. Using only the basic chatbot.")
+medllama_integration = None
 
 app = Flask(__name__)
 
@@ -51,15 +50,27 @@ X = vectorizer.fit_transform(texts)
 model = LogisticRegression()
 model.fit(X, labels)
 
-def classify_symptom(symptom):
-    """Classify a symptom using the simple model."""
+def classify_symptoms(symptoms):
+    """Classify several symptoms with one call to the simple model."""
     try:
-        x = vectorizer.transform([symptom])
-        prediction = model.predict(x)[0]
-        return prediction
+        return model.predict(vectorizer.transform(symptoms)).tolist()
     except Exception as e:
-        logger.error(f"Error classifying symptom: {str(e)}")
-        return "لا يمكن تصنيف العرض، يرجى استشارة الطبيب"
+        logger.error(f"Error classifying symptoms: {str(e)}")
+        return ["لا يمكن تصنيف العرض، يرجى استشارة الطبيب"] * len(symptoms)
+
+def classify_symptom(symptom):
+    """Classify a symptom using the simple model."""
+    return classify_symptoms([symptom])[0]
+
+if MEDLLAMA_AVAILABLE:
+    # Share the classifier above with the integration; importing it back from
+    # app would run this module again when it is started as __main__.
+    # MEDLLAMA_API_URLS lists the API servers to balance over, comma-separated
+    medllama_integration = MedLLamaIntegration(
+        os.environ.get("MEDLLAMA_API_URLS", "http://localhost:5001").split(","),
+        fallback=classify_symptom,
+        batch_fallback=classify_symptoms
+    )
 
 @app.route('/classify', methods=['POST'])
 def classify():
@@ -102,6 +113,31 @@ def classify():
         logger.error(f"Error processing request: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/classify/batch', methods=['POST'])
+def classify_batch():
+    """Answer several symptoms in one request."""
+    try:
+        data = request.json
+        
+        if not data:
+            return jsonify({"error": "No JSON data received"}), 400
+            
+        symptoms = data.get('symptoms')
+        if not symptoms or not isinstance(symptoms, list):
+            return jsonify({"error": "يرجى إرسال قائمة الأعراض في المفتاح 'symptoms'"}), 400
+
+        if MEDLLAMA_AVAILABLE:
+            results = medllama_integration.process_queries(symptoms, data.get('userId'))
+            replies = [{"reply": result["response"], "source": result["source"]} for result in results]
+        else:
+            replies = [{"reply": prediction} for prediction in classify_symptoms(symptoms)]
+        
+        return jsonify({"replies": replies})
+        
+    except Exception as e:
+        logger.error(f"Error processing batch request: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """Enhanced chat endpoint that supports both MedLLama and legacy chatbot."""
@@ -119,7 +155,10 @@ def chat():
         include_suggestions = data.get('includeSuggestions', False)
         
         if MEDLLAMA_AVAILABLE:
-            result = medllama_integration.process_query(message, user_id, include_suggestions)
+            # Only clients that send a conversationId get answers in the context of earlier messages
+            result = medllama_integration.process_query(
+                message, user_id, include_suggestions, conversation_id=data.get('conversationId')
+            )
             
             # Format response
             response = {
@@ -1,57 +1,204 @@
 import os
 import sys
 import json
+import time
+import random
+import hashlib
 import logging
+import threading
 import requests
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('medllama_integration.log'),
+        logging.FileHandler(os.environ.get('MEDLLAMA_INTEGRATION_LOG', 'medllama_integration.log')),
         logging.StreamHandler(sys.stdout)
     ]
 )
 logger = logging.getLogger(__name__)
 
+# JSON-lines log of every answered query, the log cache pre-warming reads (MEDLLAMA_PREWARM_LOG)
+INTERACTIONS_LOG = os.environ.get("MEDLLAMA_INTERACTIONS_LOG", "medllama_interactions.jsonl")
+
+# Seconds to wait for /generate; sent along so the API stops generating once we have given up
+GENERATE_TIMEOUT = 30
+# Questions per /batch request, and seconds to wait for one
+BATCH_CHUNK_SIZE = 8
+BATCH_TIMEOUT = 120
+
+class BackendNode:
+    """One MedLLama API server and what this client has observed of it."""
+    
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency = None  # Moving average of successful request seconds
+        self.healthy = True
+        self.retry_at = 0.0
+
+class NodePool:
+    """Spreads requests over several MedLLama API servers.
+    
+    With strategy "least_outstanding" the node with the fewest requests in
+    flight from this client is chosen, ties going to the lower latency. With
+    "power_of_two" two random nodes are compared by in-flight requests weighted
+    by latency, which keeps many clients from herding onto the same node.
+    A node that fails is skipped for retry_after seconds and then tried again.
+    
+    Requests with an affinity key (the conversation id) go to the node that
+    rendezvous hashing picks for that key among the available nodes, so a
+    conversation stays on one node, where its KV cache is, while it is up.
+    """
+    
+    STRATEGIES = ("least_outstanding", "power_of_two")
+    
+    def __init__(self, urls, strategy="least_outstanding", latency_alpha=0.2, retry_after=10.0):
+        """
+        Initialize the pool.
+        
+        Args:
+            urls: Base URLs of the API servers
+            strategy: "least_outstanding" or "power_of_two"
+            latency_alpha: Weight of the newest request in the latency average
+            retry_after: Seconds a failed node is skipped
+        """
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown balancing strategy: {strategy}")
+        if not urls:
+            raise ValueError("At least one MedLLama API URL is needed")
+        
+        self.nodes = [BackendNode(url) for url in urls]
+        self.strategy = strategy
+        self.latency_alpha = latency_alpha
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+    
+    def _available(self, exclude=()):
+        now = time.monotonic()
+        return [node for node in self.nodes if node not in exclude and (node.healthy or now >= node.retry_at)]
+    
+    def any_available(self):
+        with self._lock:
+            return bool(self._available())
+    
+    @staticmethod
+    def _cost(node):
+        return (node.outstanding + 1) * (node.latency or 1.0)
+    
+    def acquire(self, affinity_key=None, exclude=()):
+        """Choose a node for a request and count it as in flight; None if no node is available."""
+        with self._lock:
+            candidates = self._available(exclude)
+            if not candidates:
+                return None
+            
+            if affinity_key is not None:
+                node = max(candidates, key=lambda node: hashlib.md5(f"{affinity_key}|{node.url}".encode("utf-8")).digest())
+            elif self.strategy == "power_of_two" and len(candidates) > 1:
+                node = min(random.sample(candidates, 2), key=self._cost)
+            else:
+                node = min(candidates, key=lambda node: (node.outstanding, node.latency or 0.0, random.random()))
+            
+            node.outstanding += 1
+            node.requests += 1
+            return node
+    
+    def release(self, node, seconds=None, ok=True):
+        """End a request on a node; a successful one updates its latency, a failed one takes it out for a while."""
+        with self._lock:
+            node.outstanding -= 1
+            self._record(node, ok)
+            if ok and seconds is not None:
+                alpha = self.latency_alpha
+                node.latency = seconds if node.latency is None else (1 - alpha) * node.latency + alpha * seconds
+    
+    def mark(self, node, healthy):
+        """Record the result of a health check."""
+        with self._lock:
+            self._record(node, healthy)
+    
+    def _record(self, node, ok):
+        node.healthy = ok
+        if not ok:
+            node.failures += 1
+            node.retry_at = time.monotonic() + self.retry_after
+    
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "url": node.url,
+                    "healthy": node.healthy,
+                    "outstanding": node.outstanding,
+                    "requests": node.requests,
+                    "failures": node.failures,
+                    "latency": node.latency,
+                }
+                for node in self.nodes
+            ]
+
 class MedLLamaIntegration:
     """A class to integrate MedLLama Arabic with the existing chatbot system."""
     
-    def __init__(self, medllama_api_url="http://localhost:5001", fallback_to_existing=True):
+    def __init__(self, medllama_api_url="http://localhost:5001", fallback_to_existing=True, fallback=None, batch_fallback=None,
+                 balancing="least_outstanding", session_affinity=True):
         """
         Initialize the MedLLama integration.
         
         Args:
-            medllama_api_url: URL to the MedLLama API server
+            medllama_api_url: URL to the MedLLama API server, or a list of URLs
+                of several servers to balance requests over
             fallback_to_existing: Whether to fall back to the existing chatbot if MedLLama fails
+            fallback: Callable answering a single query in-process, e.g. the
+                Chatbot app's classify_symptom, loaded once by the caller
+            batch_fallback: Callable answering a list of queries at once;
+                defaults to calling fallback for each query
+            balancing: Node selection, "least_outstanding" or "power_of_two" (see NodePool)
+            session_affinity: Keep each conversation on one node while it is up
         """
-        self.medllama_api_url = medllama_api_url
+        urls = [medllama_api_url] if isinstance(medllama_api_url, str) else list(medllama_api_url)
+        self.nodes = NodePool(urls, strategy=balancing)
+        self.medllama_api_url = self.nodes.nodes[0].url
+        self.session_affinity = session_affinity
         self.fallback_to_existing = fallback_to_existing
+        self.fallback = fallback
+        if batch_fallback is None and fallback is not None:
+            batch_fallback = lambda queries: [fallback(query) for query in queries]
+        self.batch_fallback = batch_fallback
         self.health_check_successful = False
         
+        if fallback is None:
+            logger.warning("No fallback registered, queries MedLLama cannot answer get a generic response")
+        
         # Try an initial health check
         self._check_medllama_health()
     
     def _check_medllama_health(self):
-        """Check if MedLLama API is healthy."""
-        try:
-            response = requests.get(f"{self.medllama_api_url}/health", timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                self.health_check_successful = data.get("model_status") == "loaded"
-                if self.health_check_successful:
-                    logger.info("MedLLama API health check successful")
+        """Check which MedLLama API nodes are healthy."""
+        for node in self.nodes.nodes:
+            healthy = False
+            try:
+                response = requests.get(f"{node.url}/health", timeout=5)
+                if response.status_code == 200:
+                    data = response.json()
+                    healthy = data.get("model_status") == "loaded"
+                    if healthy:
+                        logger.info(f"MedLLama API health check successful for {node.url}")
+                    else:
+                        logger.warning(f"MedLLama API at {node.url} is up but model is not loaded yet")
                 else:
-                    logger.warning("MedLLama API is up but model is not loaded yet")
-            else:
-                logger.warning(f"MedLLama API health check failed with status {response.status_code}")
-                self.health_check_successful = False
-        except Exception as e:
-            logger.error(f"MedLLama API health check error: {str(e)}")
-            self.health_check_successful = False
-            
+                    logger.warning(f"MedLLama API health check failed for {node.url} with status {response.status_code}")
+            except Exception as e:
+                logger.error(f"MedLLama API health check error for {node.url}: {str(e)}")
+            self.nodes.mark(node, healthy)
+        
+        self.health_check_successful = self.nodes.any_available()
         return self.health_check_successful
     
     def is_arabic_text(self, text):
@@ -72,62 +219,225 @@ class MedLLamaIntegration:
         text_lower = text.lower()
         return any(keyword in text_lower for keyword in medical_keywords)
     
-    def process_query(self, query, user_id=None, include_suggestions=False):
+    def _routes_to_medllama(self, query):
+        """Whether a query is one MedLLama should answer (Arabic and medical)."""
+        return self.is_arabic_text(query) and self.is_medical_query(query)
+    
+    def process_query(self, query, user_id=None, include_suggestions=False, conversation_id=None):
         """
         Process a user query using MedLLama or fall back to the existing system.
         
         Args:
             query: The user's query text
-            user_id: Optional user ID for context
+            user_id: Optional user ID, recorded in the interaction log
             include_suggestions: Whether to include suggested follow-up questions
+            conversation_id: Answer the query as the next message of this
+                conversation, with its earlier messages as context. Without it
+                the query is answered on its own, batched with other requests
+                and from the API's response cache when possible
             
         Returns:
             dict: Response with answer and optional suggestions
         """
         # Check if we should use MedLLama
-        use_medllama = self.health_check_successful and self.is_arabic_text(query) and self.is_medical_query(query)
+        use_medllama = self.nodes.any_available() and self._routes_to_medllama(query)
         
         if use_medllama:
-            try:
-                # Try using MedLLama
-                response = requests.post(
-                    f"{self.medllama_api_url}/generate",
-                    json={"question": query},
-                    timeout=30
-                )
+            affinity_key = conversation_id if self.session_affinity else None
+            tried = []
+            # A node that is down or refuses the request right away gets one retry elsewhere
+            while len(tried) < 2:
+                node = self.nodes.acquire(affinity_key, exclude=tried)
+                if node is None:
+                    break
+                tried.append(node)
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    result = {
-                        "response": data.get("response", "لم أستطع فهم استفسارك. هل يمكنك توضيح سؤالك؟"),
-                        "source": "medllama"
-                    }
-                    
-                    # Log the successful response
-                    logger.info(f"MedLLama response for query: {query[:50]}...")
-                    self._log_interaction(query, result["response"], "medllama", user_id)
-                    
+                result, retry = self._generate_on(node, query, user_id, conversation_id)
+                if result is not None:
                     return result
-                else:
-                    logger.warning(f"MedLLama API returned status {response.status_code}")
-                    if self.fallback_to_existing:
-                        return self._fallback_to_existing(query, user_id, include_suggestions)
-            except Exception as e:
-                logger.error(f"Error using MedLLama API: {str(e)}")
-                if self.fallback_to_existing:
-                    return self._fallback_to_existing(query, user_id, include_suggestions)
+                if not retry:
+                    break
         
         # Either not suitable for MedLLama or we need to fall back
         return self._fallback_to_existing(query, user_id, include_suggestions)
     
+    def _generate_on(self, node, query, user_id=None, conversation_id=None):
+        """Ask one node to answer a query.
+        
+        Returns:
+            (result, retry): the response dict or None, and whether another node may be tried
+        """
+        start = time.perf_counter()
+        try:
+            # A conversation's earlier turns stay cached in its session on this node
+            payload = {"question": query}
+            if conversation_id is not None:
+                payload["session_id"] = str(conversation_id)
+            response = requests.post(
+                f"{node.url}/generate",
+                json=payload,
+                headers={"X-Request-Timeout": str(GENERATE_TIMEOUT)},
+                timeout=GENERATE_TIMEOUT
+            )
+        except requests.Timeout:
+            logger.error(f"MedLLama API at {node.url} timed out")
+            self.nodes.release(node, ok=False)
+            return None, False
+        except Exception as e:
+            logger.error(f"Error using MedLLama API at {node.url}: {str(e)}")
+            self.nodes.release(node, ok=False)
+            return None, True
+        
+        if response.status_code != 200:
+            logger.warning(f"MedLLama API at {node.url} returned status {response.status_code}")
+            # Busy (429) or shedding load (503): the node is fine but another may answer
+            self.nodes.release(node, ok=response.status_code < 500 or response.status_code == 503)
+            return None, response.status_code in (429, 503)
+        
+        self.nodes.release(node, time.perf_counter() - start)
+        data = response.json()
+        result = {
+            "response": data.get("response", "لم أستطع فهم استفسارك. هل يمكنك توضيح سؤالك؟"),
+            "source": "medllama"
+        }
+        
+        # Log the successful response
+        logger.info(f"MedLLama response for query: {query[:50]}...")
+        self._log_interaction(query, result["response"], "medllama", user_id)
+        
+        return result, False
+    
+    def process_queries(self, queries, user_id=None, chunk_size=BATCH_CHUNK_SIZE, max_workers=None):
+        """
+        Process several user queries at once.
+        
+        Queries MedLLama should answer are sent to /batch in chunks of
+        chunk_size, the chunks running concurrently over the available nodes;
+        the rest, and the queries of any chunk that fails, are answered by one
+        batch_fallback call.
+        
+        Args:
+            queries: List of query texts
+            user_id: Optional user ID for context
+            chunk_size: Maximum questions per /batch request
+            max_workers: Maximum chunks in flight (default: two per node)
+            
+        Returns:
+            list: Response dicts, in the order of queries
+        """
+        results = [None] * len(queries)
+        if self.nodes.any_available():
+            eligible = [index for index, query in enumerate(queries) if self._routes_to_medllama(query)]
+        else:
+            eligible = []
+        
+        chunks = [eligible[start:start + chunk_size] for start in range(0, len(eligible), chunk_size)]
+        if chunks:
+            workers = min(len(chunks), max_workers or 2 * len(self.nodes.nodes))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                responses = list(executor.map(lambda chunk: self._batch_on_pool([queries[index] for index in chunk]), chunks))
+            
+            for chunk, chunk_responses in zip(chunks, responses):
+                if chunk_responses is None:
+                    continue
+                for index, response in zip(chunk, chunk_responses):
+                    results[index] = {"response": response, "source": "medllama"}
+                    self._log_interaction(queries[index], response, "medllama", user_id)
+        
+        remaining = [index for index, result in enumerate(results) if result is None]
+        if remaining:
+            fallback_results = self._fallback_many([queries[index] for index in remaining], user_id)
+            for index, result in zip(remaining, fallback_results):
+                results[index] = result
+        
+        return results
+    
+    def _batch_on_pool(self, queries):
+        """Answer a chunk of queries on one node, retrying once on another; None if no node did."""
+        tried = []
+        while len(tried) < 2:
+            node = self.nodes.acquire(exclude=tried)
+            if node is None:
+                break
+            tried.append(node)
+            
+            responses, retry = self._batch_on(node, queries)
+            if responses is not None:
+                return responses
+            if not retry:
+                break
+        return None
+    
+    def _batch_on(self, node, queries):
+        """Ask one node to answer a chunk of queries through /batch.
+        
+        Returns:
+            (responses, retry): the response texts in query order or None, and whether another node may be tried
+        """
+        start = time.perf_counter()
+        try:
+            response = requests.post(
+                f"{node.url}/batch",
+                json={"questions": queries},
+                headers={"X-Request-Timeout": str(BATCH_TIMEOUT)},
+                timeout=BATCH_TIMEOUT
+            )
+        except requests.Timeout:
+            logger.error(f"MedLLama API at {node.url} timed out on a batch of {len(queries)}")
+            self.nodes.release(node, ok=False)
+            return None, False
+        except Exception as e:
+            logger.error(f"Error using MedLLama API at {node.url}: {str(e)}")
+            self.nodes.release(node, ok=False)
+            return None, True
+        
+        if response.status_code != 200:
+            logger.warning(f"MedLLama API at {node.url} returned status {response.status_code} for a batch of {len(queries)}")
+            self.nodes.release(node, ok=response.status_code < 500 or response.status_code == 503)
+            return None, response.status_code in (429, 503)
+        
+        self.nodes.release(node, time.perf_counter() - start)
+        results = response.json().get("results", [])
+        if len(results) != len(queries):
+            logger.error(f"MedLLama API at {node.url} answered {len(results)} of {len(queries)} batch questions")
+            return None, False
+        
+        logger.info(f"MedLLama batch response for {len(queries)} queries from {node.url}")
+        return [result.get("response", "لم أستطع فهم استفسارك. هل يمكنك توضيح سؤالك؟") for result in results], False
+    
+    def _fallback_many(self, queries, user_id=None):
+        """Fall back to the existing chatbot for several queries in one batch_fallback call."""
+        try:
+            if self.batch_fallback is None:
+                raise RuntimeError("No fallback registered")
+            
+            responses = self.batch_fallback(queries)
+            results = [{"response": response, "source": "existing_chatbot"} for response in responses]
+            
+            logger.info(f"Fallback responses for {len(queries)} queries")
+            for query, result in zip(queries, results):
+                self._log_interaction(query, result["response"], "existing_chatbot", user_id)
+            
+            return results
+            
+        except Exception as e:
+            logger.error(f"Error in batch fallback: {str(e)}")
+            return [
+                {
+                    "response": "عذراً، لم أستطع فهم سؤالك حالياً. يرجى المحاولة مرة أخرى أو التواصل مع طبيب.",
+                    "source": "generic_fallback"
+                }
+                for _ in queries
+            ]
+    
     def _fallback_to_existing(self, query, user_id=None, include_suggestions=False):
         """Fall back to the existing chatbot system."""
         try:
-            # Use the existing chatbot API
-            from app import classify_symptom
+            if self.fallback is None:
+                raise RuntimeError("No fallback registered")
             
             result = {
-                "response": classify_symptom(query),
+                "response": self.fallback(query),
                 "source": "existing_chatbot"
             }
             
@@ -155,8 +465,7 @@ class MedLLamaIntegration:
             "user_id": user_id
         }
         
-        log_file = "medllama_interactions.jsonl"
-        with open(log_file, "a", encoding="utf-8") as f:
+        with open(INTERACTIONS_LOG, "a", encoding="utf-8") as f:
             f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
 
 # Example usage as a standalone module
@@ -1,8 +1,10 @@
 using System;
 using System.Collections.Generic;
+using System.Globalization;
 using System.Net.Http;
 using System.Text;
 using System.Text.Json;
+using System.Threading;
 using System.Threading.Tasks;
 using DoctorAppoitmentApi.Controllers;
 using Microsoft.Extensions.Configuration;
@@ -74,8 +76,14 @@ namespace DoctorAppoitmentApi.Service
                     Encoding.UTF8,
                     "application/json");
                 
-                // Send the request to MedLLama API
-                var response = await _httpClient.PostAsync($"{_medLLamaApiUrl}/generate", content);
+                // Send the request to MedLLama API, telling it how long we will wait
+                // so it stops generating an answer nobody is waiting for
+                var request = new HttpRequestMessage(HttpMethod.Post, $"{_medLLamaApiUrl}/generate") { Content = content };
+                if (_httpClient.Timeout != Timeout.InfiniteTimeSpan)
+                {
+                    request.Headers.Add("X-Request-Timeout", _httpClient.Timeout.TotalSeconds.ToString(CultureInfo.InvariantCulture));
+                }
+                var response = await _httpClient.SendAsync(request);
                 
                 if (response.IsSuccessStatusCode)
                 {
@@ -1,9 +1,24 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 import os
+import ssl
 import json
+import time
+import select
+import socket
 import logging
 import traceback
-from medllama_arabic import MedLLamaArabic, MedLLamaConfig
+import functools
+import dataclasses
+from transformers import TextIteratorStreamer
+from medllama_arabic import MedLLamaArabic, MedLLamaConfig, PromptEncoder
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from request_batcher import RequestBatcher, ContinuousBatcher, Deadline, RequestCancelled, TokenBudgetExceeded, BATCH
+from finetune_jobs import FinetuneJobManager
+from metrics import MedLLamaMetrics, TimedLock
+from single_flight import SingleFlight
+from session_store import Session, SessionStore, kv_cache_nbytes
+from degradation import LoadDegrader, load_policy
+from response_cache import open_response_cache, response_cache_key, frequent_questions
 import threading
 
 # Set up logging
@@ -13,44 +28,503 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 
+# Request, generation and resource metrics served on /metrics
+metrics = MedLLamaMetrics()
+
 # Initialize MedLLama model with default configuration
 model = None
-model_lock = threading.Lock()
+model_lock = TimedLock(threading.Lock(), metrics.observe_lock_wait)
+# Serializes initialize_model without blocking /health, which only takes model_lock
+model_init_lock = threading.Lock()
+
+# State of the latest /admin/reload job
+reload_state = {"status": "idle"}
+reload_lock = threading.Lock()
+
+# Fine-tuning runs in separate processes, one job at a time
+finetune_jobs = FinetuneJobManager()
+
+def build_batcher():
+    """Create the request scheduler, with token budgets from MEDLLAMA_* environment variables.
+    
+    With MEDLLAMA_KV_CACHE_BLOCKS set, requests are generated token by token
+    on a paged KV cache of that many blocks (of MEDLLAMA_KV_BLOCK_SIZE tokens)
+    and join or leave the running batch at every step.
+    """
+    budgets = dict(
+        max_request_tokens=int(os.environ.get("MEDLLAMA_MAX_REQUEST_TOKENS", "2048")),
+        max_pending_tokens=int(os.environ.get("MEDLLAMA_MAX_PENDING_TOKENS", "16384")),
+        on_cancel=metrics.record_cancel
+    )
+    kv_cache_blocks = int(os.environ.get("MEDLLAMA_KV_CACHE_BLOCKS", "0"))
+    if kv_cache_blocks > 0:
+        return ContinuousBatcher(
+            lambda: model,
+            model_lock,
+            num_blocks=kv_cache_blocks,
+            block_size=int(os.environ.get("MEDLLAMA_KV_BLOCK_SIZE", "16")),
+            max_batch_size=int(os.environ.get("MEDLLAMA_MAX_RUNNING", "32")),
+            on_preempt=metrics.kv_preemptions.inc,
+            **budgets
+        )
+    
+    return RequestBatcher(
+        lambda: model,
+        model_lock,
+        chunk_tokens=int(os.environ.get("MEDLLAMA_CHUNK_TOKENS", "512")),
+        **budgets
+    )
+
+# Schedules /generate and /batch requests within token budgets and batches
+# concurrent requests for the same adapter into one model call
+batcher = build_batcher()
+
+# Concurrent identical /generate requests share one generation
+single_flight = SingleFlight(on_coalesced=metrics.coalesced.inc)
+
+def build_session_store():
+    """Create the conversation store, bounded by MEDLLAMA_SESSION_MAX_BYTES and MEDLLAMA_SESSION_TTL."""
+    return SessionStore(
+        max_bytes=int(os.environ.get("MEDLLAMA_SESSION_MAX_BYTES", str(1 << 30))),
+        ttl_seconds=float(os.environ.get("MEDLLAMA_SESSION_TTL", "600")),
+        on_evict=metrics.session_evictions.inc
+    )
+
+# Conversations of /generate requests with a session_id, with their KV caches
+sessions = build_session_store()
+
+def build_degrader():
+    """Create the load watcher, with the policy from MEDLLAMA_DEGRADATION_POLICY (JSON or a JSON file)."""
+    def on_change(old, new):
+        logger.warning(f"Degradation level changed from '{old.name}' to '{new.name}'")
+    
+    return LoadDegrader(
+        load_policy(os.environ.get("MEDLLAMA_DEGRADATION_POLICY")),
+        cooldown_seconds=float(os.environ.get("MEDLLAMA_DEGRADATION_COOLDOWN", "10")),
+        on_change=on_change
+    )
+
+# Shortens answers, decodes greedily or sends clients to their fallback under load
+degrader = build_degrader()
+
+def build_response_cache():
+    """Create the answer cache named by MEDLLAMA_RESPONSE_CACHE ("memory" or "sqlite:PATH"), or None.
+    
+    With "sqlite:PATH" every worker and every node on the same machine using
+    that file shares the answers. MEDLLAMA_RESPONSE_CACHE_MAX_BYTES caps its
+    size and MEDLLAMA_RESPONSE_CACHE_TTL the age of its entries.
+    """
+    max_bytes = os.environ.get("MEDLLAMA_RESPONSE_CACHE_MAX_BYTES")
+    return open_response_cache(
+        os.environ.get("MEDLLAMA_RESPONSE_CACHE"),
+        max_bytes=int(max_bytes) if max_bytes else None,
+        ttl_seconds=float(os.environ.get("MEDLLAMA_RESPONSE_CACHE_TTL", "86400")),
+        on_evict=lambda reason, count: metrics.response_cache_evictions.inc(reason, amount=count)
+    )
+
+# Generated answers of /classify, /generate and /batch, reused for the same
+# question; kept across fork (SQLite connections are reopened per process)
+response_cache = build_response_cache()
+
+def model_memory_bytes():
+    """Memory held by the serving model's weights and buffers."""
+    current_model = model
+    if current_model is None or current_model.model is None:
+        return None
+    return current_model.model.get_memory_footprint()
+
+def cuda_memory_allocated_bytes():
+    import torch
+    return torch.cuda.memory_allocated() if torch.cuda.is_available() else None
+
+metrics.add_gauge("medllama_queue_depth", "Generation requests waiting to be batched.", lambda: batcher.pending_count())
+metrics.add_gauge("medllama_model_memory_bytes", "Memory footprint of the serving model.", model_memory_bytes)
+metrics.add_gauge("medllama_in_flight_generations", "Distinct /generate requests being generated.", lambda: single_flight.in_flight_count())
+metrics.add_gauge("medllama_sessions", "Conversation sessions in the store.", lambda: sessions.stats()["sessions"])
+metrics.add_gauge("medllama_session_cache_bytes", "KV-cache memory held by stored sessions.", lambda: sessions.stats()["bytes"])
+metrics.add_gauge("medllama_degradation_level", "Current load degradation level (0 = normal).", lambda: degrader.index)
+metrics.add_gauge("medllama_scheduled_tokens", "Token cost of queued and running generation requests.", lambda: batcher.scheduled_tokens())
+def kv_stat(name):
+    """A value of the paged KV cache stats, or None when it is not in use."""
+    stats = batcher.kv_stats()
+    return stats[name] if stats else None
+
+metrics.add_gauge("medllama_running_sequences", "Requests generating on the paged KV cache.", lambda: kv_stat("running"))
+metrics.add_gauge("medllama_kv_blocks_total", "Blocks in the paged KV cache.", lambda: kv_stat("total_blocks"))
+metrics.add_gauge("medllama_kv_blocks_used", "Paged KV-cache blocks held by running requests.", lambda: kv_stat("used_blocks"))
+metrics.add_gauge("medllama_kv_cache_bytes", "Memory of the paged KV cache.", lambda: kv_stat("cache_bytes"))
+metrics.add_gauge("medllama_kv_utilization", "Share of the used KV-cache blocks' slots that hold tokens.", lambda: kv_stat("utilization"))
+metrics.add_gauge("medllama_kv_fragmentation", "Share of the used KV-cache blocks' slots that are still empty.", lambda: kv_stat("fragmentation"))
+def response_cache_stat(name):
+    """A value of the response cache stats, or None when caching is off."""
+    return response_cache.stats()[name] if response_cache is not None else None
+
+metrics.add_gauge("medllama_response_cache_entries", "Answers in the response cache.", lambda: response_cache_stat("entries"))
+metrics.add_gauge("medllama_response_cache_bytes", "Size of the answers in the response cache.", lambda: response_cache_stat("bytes"))
+metrics.add_gauge("medllama_cuda_memory_allocated_bytes", "CUDA memory currently allocated by tensors.", cuda_memory_allocated_bytes)
+
+def instrumented(endpoint, track_load=False):
+    """Count and time requests to a hot-path endpoint; with track_load, successful
+    requests that generated their answer also feed the latency the degradation
+    level is based on (a handler sets g.served_from_cache for the others)."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            response = handler(*args, **kwargs)
+            status = response[1] if isinstance(response, tuple) else response.status_code
+            seconds = time.perf_counter() - start
+            metrics.observe_request(endpoint, status, seconds)
+            # Cache hits are fast at any load and would hide an overloaded model
+            if track_load and status == 200 and not g.get("served_from_cache"):
+                degrader.observe_latency(seconds)
+            return response
+        return wrapper
+    return decorator
+
+def parse_adapters(value):
+    """Parse MEDLLAMA_ADAPTERS, e.g. "v1=./finetuned/a,v2=./finetuned/b", into a dict."""
+    adapters = {}
+    for entry in (value or "").split(","):
+        if "=" in entry:
+            name, path = entry.split("=", 1)
+            adapters[name.strip()] = path.strip()
+    return adapters
+
+def build_model(model_config, adapters):
+    """Load a MedLLamaArabic instance (warmed up by load_model) and its adapters."""
+    new_model = MedLLamaArabic(model_config)
+    new_model.generation_listeners.append(metrics.record_generation)
+    new_model.cache_listeners.append(metrics.record_cache)
+    new_model.load_model()
+    for name, adapter_path in adapters.items():
+        new_model.load_adapter(name, adapter_path)
+    return new_model
+
+def model_config_from_env():
+    """Build the serving MedLLamaConfig from MEDLLAMA_* environment variables."""
+    # MEDLLAMA_MODEL_DIR points at a snapshot from `python medllama_arabic.py prepare`;
+    # MEDLLAMA_FAKE_MODEL=tiny|stub serves an offline fake model for testing
+    return MedLLamaConfig(
+        local_model_dir=os.environ.get("MEDLLAMA_MODEL_DIR"),
+        draft_model=os.environ.get("MEDLLAMA_DRAFT_MODEL"),
+        fake_model=os.environ.get("MEDLLAMA_FAKE_MODEL"),
+        fake_token_delay=float(os.environ.get("MEDLLAMA_FAKE_TOKEN_DELAY", "0"))
+    )
+
+# Outcome of the startup cache pre-warming, shown on /health
+prewarm_state = {"status": "idle"}
+
+def prewarm_response_cache(new_model, batch_size=8):
+    """Cache answers to the most frequent questions of the interaction log before new_model serves.
+    
+    Off unless MEDLLAMA_PREWARM_LOG names the log, e.g. medllama_interactions.jsonl;
+    MEDLLAMA_PREWARM_TOP and MEDLLAMA_PREWARM_MIN_COUNT select the questions.
+    Questions already cached, e.g. in a SQLite cache kept from a previous run,
+    are skipped; the rest are generated in batches until MEDLLAMA_PREWARM_TIMEOUT
+    seconds have passed, or with MEDLLAMA_PREWARM_USE_LOGGED=1 their logged
+    answers are stored instead.
+    """
+    log_path = os.environ.get("MEDLLAMA_PREWARM_LOG")
+    if response_cache is None or not log_path:
+        return
+    if not os.path.isfile(log_path):
+        logger.warning(f"Interaction log {log_path} not found, the response cache starts cold")
+        return
+    
+    start = time.perf_counter()
+    try:
+        prewarm_state.update({"status": "running", "log": log_path})
+        frequent = frequent_questions(
+            log_path, PromptEncoder.normalize,
+            top_n=int(os.environ.get("MEDLLAMA_PREWARM_TOP", "32")),
+            min_count=int(os.environ.get("MEDLLAMA_PREWARM_MIN_COUNT", "2"))
+        )
+        # Keyed like the requests that will hit them: the default limit of /classify, /generate and /batch
+        questions = [question for question, _, _ in frequent]
+        cached = cached_answers(questions, 256, current_model=new_model)
+        missing = [(question, response) for (question, _, response), answer in zip(frequent, cached) if answer is None]
+        
+        stored = 0
+        if os.environ.get("MEDLLAMA_PREWARM_USE_LOGGED") == "1":
+            logged = [(question, response) for question, response in missing if isinstance(response, str) and response]
+            store_answers([question for question, _ in logged], [response for _, response in logged], 256, current_model=new_model)
+            stored = len(logged)
+        else:
+            timeout = float(os.environ.get("MEDLLAMA_PREWARM_TIMEOUT", "300"))
+            for index in range(0, len(missing), batch_size):
+                if time.perf_counter() - start > timeout:
+                    logger.warning(f"Cache pre-warming stopped after {timeout:.0f}s, {len(missing) - stored} questions left")
+                    break
+                chunk = [question for question, _ in missing[index:index + batch_size]]
+                store_answers(chunk, new_model.generate_batch(chunk, max_new_tokens=256), 256, current_model=new_model)
+                stored += len(chunk)
+        
+        seconds = time.perf_counter() - start
+        prewarm_state.update({
+            "status": "completed", "questions": len(questions), "already_cached": len(questions) - len(missing),
+            "stored": stored, "seconds": seconds
+        })
+        logger.info(f"Pre-warmed the response cache with {stored} of {len(questions)} frequent questions in {seconds:.2f}s")
+    except Exception as e:
+        # A cold cache is slower, not broken
+        logger.error(f"Error pre-warming the response cache: {str(e)}")
+        logger.error(traceback.format_exc())
+        prewarm_state.update({"status": "failed", "error": str(e)})
 
 def initialize_model():
     """Initialize the MedLLama model in a separate thread."""
     global model
     
-    with model_lock:
-        if model is None:
-            logger.info("Initializing MedLLama Arabic model...")
-            try:
-                model_config = MedLLamaConfig()
-                model = MedLLamaArabic(model_config)
-                model.load_model()
+    # A second caller waits for the first load instead of loading another copy
+    with model_init_lock:
+        if model is not None:
+            return
+        
+        logger.info("Initializing MedLLama Arabic model...")
+        try:
+            # Loading and pre-warming happen outside model_lock, so /health keeps answering
+            # "not_loaded" meanwhile and reports the model loaded only once the frequent
+            # questions are cached
+            new_model = build_model(model_config_from_env(), parse_adapters(os.environ.get("MEDLLAMA_ADAPTERS")))
+            prewarm_response_cache(new_model)
+        except Exception as e:
+            logger.error(f"Error initializing model: {str(e)}")
+            logger.error(traceback.format_exc())
+            return
+        
+        with model_lock:
+            if model is None:
+                model, new_model = new_model, None
                 logger.info("MedLLama Arabic model initialized successfully")
-            except Exception as e:
-                logger.error(f"Error initializing model: {str(e)}")
-                logger.error(traceback.format_exc())
-                model = None
+        if new_model is not None:
+            # A reload published its model first
+            new_model.release()
 
-@app.before_first_request
+def reinitialize_after_fork():
+    """Recreate the locks and background threads in a forked worker process.
+    
+    Threads do not survive fork(), so a worker inherits the loaded model but
+    needs its own batcher and fine-tuning queue.
+    """
+    global model_lock, model_init_lock, reload_lock, batcher, single_flight, sessions, degrader, finetune_jobs
+    
+    model_lock = TimedLock(threading.Lock(), metrics.observe_lock_wait)
+    model_init_lock = threading.Lock()
+    reload_lock = threading.Lock()
+    batcher = build_batcher()
+    single_flight = SingleFlight(on_coalesced=metrics.coalesced.inc)
+    sessions = build_session_store()
+    degrader = build_degrader()
+    finetune_jobs = FinetuneJobManager()
+
+def reload_model(model_config, adapters):
+    """Load a new model in the background and swap it in without downtime.
+    
+    The old model keeps serving while the new one loads and warms up. The swap
+    happens under model_lock, so requests already generating finish on the old
+    model first; its memory is released afterwards.
+    """
+    global model
+    
+    timings = {}
+    try:
+        phase_start = time.perf_counter()
+        new_model = build_model(model_config, adapters)
+        timings["load"] = time.perf_counter() - phase_start
+        timings.update({f"load_{phase}": seconds for phase, seconds in new_model.load_timings.items()})
+        
+        phase_start = time.perf_counter()
+        with model_lock:
+            timings["swap_wait"] = time.perf_counter() - phase_start
+            old_model, model = model, new_model
+            # The caches were computed by the old weights; the dialogues stay
+            sessions.drop_caches()
+            # Cached answers are keyed by model path and may be shared with other
+            # workers still serving the old model, so they are left to expire
+        
+        phase_start = time.perf_counter()
+        if old_model is not None:
+            old_model.release()
+            del old_model
+        timings["release_old"] = time.perf_counter() - phase_start
+        
+        logger.info("Model reloaded (" + ", ".join(f"{phase}={seconds:.2f}s" for phase, seconds in timings.items()) + ")")
+        with reload_lock:
+            reload_state.update({"status": "completed", "finished_at": time.time(), "timings": timings})
+    except Exception as e:
+        logger.error(f"Error reloading model: {str(e)}")
+        logger.error(traceback.format_exc())
+        with reload_lock:
+            reload_state.update({"status": "failed", "finished_at": time.time(), "error": str(e), "timings": timings})
+
+def is_admin_request():
+    """Check the X-Admin-Token header when MEDLLAMA_ADMIN_TOKEN is configured."""
+    admin_token = os.environ.get("MEDLLAMA_ADMIN_TOKEN")
+    return not admin_token or request.headers.get("X-Admin-Token") == admin_token
+
+model_init_started = threading.Event()
+
+@app.before_request
 def before_first_request():
-    """Initialize model before the first request."""
-    threading.Thread(target=initialize_model).start()
+    """Initialize model before the first request (Flask 2.3 removed before_first_request)."""
+    if not model_init_started.is_set():
+        model_init_started.set()
+        threading.Thread(target=initialize_model).start()
+
+def client_disconnect_check():
+    """Callable telling whether the client of the current request has closed its connection."""
+    connection = request.environ.get("werkzeug.socket")
+    if connection is None or isinstance(connection, ssl.SSLSocket):
+        return None
+    
+    def disconnected():
+        # A closed connection is readable with nothing left to read
+        try:
+            readable, _, _ = select.select([connection], [], [], 0)
+            return bool(readable) and connection.recv(1, socket.MSG_PEEK) == b""
+        except (OSError, ValueError):
+            return True
+    return disconnected
+
+def request_deadline(data):
+    """Deadline of the current request, from the X-Request-Timeout header or the 'timeout'
+    field (seconds), else MEDLLAMA_REQUEST_TIMEOUT; it also expires if the client disconnects.
+    
+    Raises:
+        ValueError: If the timeout is not a number
+    """
+    timeout = request.headers.get("X-Request-Timeout", data.get("timeout", os.environ.get("MEDLLAMA_REQUEST_TIMEOUT")))
+    return Deadline(float(timeout) if timeout else None, client_disconnect_check())
+
+def degrade(max_new_tokens):
+    """Re-evaluate the degradation level and return it with max_new_tokens capped to it.
+    
+    The caller passes level.greedy on with the request it generates, so a
+    level change never affects requests already queued or generating.
+    """
+    level = degrader.update(batcher.pending_count())
+    
+    capped = level.max_new_tokens is not None and max_new_tokens > level.max_new_tokens
+    if level.fallback or level.greedy or capped:
+        metrics.degraded_requests.inc(level.name)
+    if capped:
+        max_new_tokens = level.max_new_tokens
+    return level, max_new_tokens
+
+def fallback_response(level):
+    """Refuse generation at a fallback level; clients answer from their own fallback instead."""
+    body = {"error": "الخادم تحت ضغط عالٍ حالياً، يرجى استخدام النظام البديل", "degradation": level.name, "fallback": True}
+    return jsonify(body), 503, {"Retry-After": str(int(degrader.cooldown_seconds))}
+
+def answer_key(question, max_new_tokens, adapter=None, current_model=None):
+    """Response cache key: the normalized question, the token limit and the model and adapter answering it."""
+    current_model = current_model or model
+    config = current_model.config
+    adapter_path = current_model.adapters.get(adapter) if adapter is not None else None
+    return response_cache_key(
+        PromptEncoder.normalize(question), max_new_tokens, adapter, adapter_path,
+        config.local_model_dir or config.base_model, config.fake_model
+    )
+
+def cached_answers(questions, max_new_tokens, adapter=None, current_model=None):
+    """Cached answers of questions, None for each miss (and for all when caching is off)."""
+    if response_cache is None:
+        return [None] * len(questions)
+    try:
+        answers = response_cache.get_many([answer_key(question, max_new_tokens, adapter, current_model) for question in questions])
+    except Exception as e:
+        # A cache that is unavailable only costs the generation
+        logger.error(f"Response cache lookup failed: {str(e)}")
+        return [None] * len(questions)
+    for answer in answers:
+        metrics.record_cache("response", answer is not None)
+    return answers
+
+def store_answers(questions, answers, max_new_tokens, adapter=None, current_model=None):
+    """Keep generated answers for later requests with the same question and limits."""
+    if response_cache is None:
+        return
+    try:
+        response_cache.put_many([
+            (answer_key(question, max_new_tokens, adapter, current_model), answer) for question, answer in zip(questions, answers)
+        ])
+    except Exception as e:
+        logger.error(f"Response cache update failed: {str(e)}")
+
+def cancelled_response(deadline):
+    return jsonify({"error": f"تم إلغاء الطلب ({deadline.reason or 'deadline'})"}), 504
+
+def generate_in_session(session_id, question, max_new_tokens, adapter, deadline, greedy=False):
+    """Answer the next message of a conversation, prefilling only the new message."""
+    with model_lock:
+        session = sessions.take(session_id)
+        metrics.record_cache("session", session is not None)
+        if session is None or session.adapter != adapter:
+            session = Session(adapter)
+        
+        response = model.generate_session_turn(
+            session, question, max_new_tokens=max_new_tokens, adapter=adapter, cancelled=deadline.expired, greedy=greedy
+        )
+        sessions.put(session_id, session, kv_cache_nbytes(session.past_key_values))
+    return response
+
+def stream_response(question, max_new_tokens, adapter, deadline, greedy=False):
+    """Yield response text as it is generated, for clients measuring time to first token."""
+    streamer = TextIteratorStreamer(model.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    
+    def run():
+        try:
+            with model_lock:
+                model.generate_response(
+                    question, max_new_tokens=max_new_tokens, adapter=adapter, streamer=streamer, cancelled=deadline.expired,
+                    greedy=greedy
+                )
+            if deadline.expired():
+                metrics.record_cancel(deadline.reason, "generating")
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            streamer.end()
+    
+    threading.Thread(target=run).start()
+    try:
+        for text in streamer:
+            if text:
+                yield text
+    except GeneratorExit:
+        # The server noticed the client stopped reading
+        deadline.cancel("disconnect")
+        raise
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
     with model_lock:
         model_status = "loaded" if model is not None else "not_loaded"
+        speculative = model.speculative_metrics() if model is not None and model.draft_model is not None else None
         
-    return jsonify({
+    status = {
         "status": "healthy", 
         "model_status": model_status
-    })
+    }
+    if speculative:
+        status["speculative_decoding"] = speculative
+    status["degradation"] = degrader.status()
+    if response_cache is not None:
+        status["response_cache"] = response_cache.stats()
+        status["response_cache"]["prewarm"] = dict(prewarm_state)
+    with reload_lock:
+        status["reload_status"] = reload_state["status"]
+        
+    return jsonify(status)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/classify', methods=['POST'])
+@instrumented("classify")
 def classify():
     """Process a medical query and return a response."""
     try:
@@ -66,11 +540,19 @@ def classify():
             logger.warning("No symptom provided in request")
             return jsonify({"error": "يرجى إرسال العرض في المفتاح 'symptom'"}), 400
 
-        with model_lock:
-            if model is None:
-                return jsonify({"error": "النموذج قيد التحميل، يرجى المحاولة بعد قليل"}), 503
+        if model is None:
+            return jsonify({"error": "النموذج قيد التحميل، يرجى المحاولة بعد قليل"}), 503
+        
+        response = cached_answers([symptom], 256)[0]
+        if response is None:
+            level, max_new_tokens = degrade(256)
+            if level.fallback:
+                return fallback_response(level)
             
-            response = model.generate_response(symptom)
+            with model_lock:
+                response = model.generate_response(symptom, max_new_tokens=max_new_tokens, greedy=level.greedy)
+            if max_new_tokens == 256:
+                store_answers([symptom], [response], 256)
         
         result = {"reply": response}
         logger.info(f"Sending response: {result}")
@@ -82,6 +564,7 @@ def classify():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/generate', methods=['POST'])
+@instrumented("generate", track_load=True)
 def generate():
     """Generate a response to a medical query."""
     try:
@@ -93,20 +576,98 @@ def generate():
             
         question = data.get('question')
         max_new_tokens = data.get('max_new_tokens', 256)
+        adapter = data.get('adapter')
+        debug = data.get('debug', False)
+        stream = data.get('stream', False)
+        session_id = data.get('session_id')
         
         if not question:
             return jsonify({"error": "يرجى إرسال السؤال في المفتاح 'question'"}), 400
+        try:
+            deadline = request_deadline(data)
+        except ValueError:
+            return jsonify({"error": "قيمة المهلة 'timeout' غير صالحة"}), 400
 
-        with model_lock:
-            if model is None:
-                return jsonify({"error": "النموذج قيد التحميل، يرجى المحاولة بعد قليل"}), 503
-            
-            response = model.generate_response(question, max_new_tokens=max_new_tokens)
+        current_model = model
+        if current_model is None:
+            return jsonify({"error": "النموذج قيد التحميل، يرجى المحاولة بعد قليل"}), 503
+        if adapter is not None and adapter not in current_model.adapters:
+            return jsonify({"error": f"Unknown adapter: {adapter}"}), 404
+        
+        # A cached answer needs no generation, so it is served at any degradation level
+        cacheable = not (stream or debug or session_id is not None)
+        if cacheable:
+            response = cached_answers([question], max_new_tokens, adapter)[0]
+            if response is not None:
+                result = {"question": question, "response": response, "cached": True}
+                if adapter is not None:
+                    result["adapter"] = adapter
+                g.served_from_cache = True
+                return jsonify(result)
+        
+        requested_tokens = max_new_tokens
+        level, max_new_tokens = degrade(max_new_tokens)
+        if level.fallback:
+            return fallback_response(level)
+        
+        try:
+            if stream or debug or session_id is not None:
+                # Not scheduled, but still held to the per-request budget
+                _, max_new_tokens = batcher.fit_request(question, max_new_tokens)
+            else:
+                key = (PromptEncoder.normalize(question), max_new_tokens, adapter)
+                
+                future, shared_deadline, leader = single_flight.submit(
+                    key,
+                    lambda: batcher.submit(question, max_new_tokens=max_new_tokens, adapter=adapter, deadline=deadline, greedy=level.greedy),
+                    deadline
+                )
+                if not leader:
+                    # Joined a generation in flight: it is only abandoned once every client has given up
+                    shared_deadline.attach(deadline)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 413
+        except TokenBudgetExceeded as e:
+            return jsonify({"error": str(e)}), 429
+        
+        if stream:
+            return Response(stream_response(question, max_new_tokens, adapter, deadline, level.greedy), mimetype="text/plain; charset=utf-8")
+        
+        profile = None
+        if session_id is not None or debug:
+            if session_id is not None:
+                response = generate_in_session(session_id, question, max_new_tokens, adapter, deadline, level.greedy)
+            else:
+                # Profiled requests run on their own so the timings are not shared with a batch
+                with model_lock:
+                    response, profile = model.generate_response(
+                        question, max_new_tokens=max_new_tokens, adapter=adapter, return_profile=True,
+                        cancelled=deadline.expired, greedy=level.greedy
+                    )
+            if deadline.expired():
+                metrics.record_cancel(deadline.reason, "generating")
+                return cancelled_response(deadline)
+        else:
+            try:
+                response = future.result(timeout=deadline.remaining())
+            except (RequestCancelled, FutureTimeoutError):
+                return cancelled_response(deadline)
+            # Shortened answers are not kept; coalesced requests leave it to the one that started
+            if max_new_tokens == requested_tokens and leader:
+                store_answers([question], [response], requested_tokens, adapter)
         
         result = {
             "question": question,
             "response": response
         }
+        if adapter is not None:
+            result["adapter"] = adapter
+        if session_id is not None:
+            result["session_id"] = session_id
+        if level is not degrader.levels[0]:
+            result["degradation"] = level.name
+        if profile is not None:
+            result["profile"] = profile
         
         return jsonify(result)
         
@@ -116,6 +677,7 @@ def generate():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/batch', methods=['POST'])
+@instrumented("batch")
 def batch_process():
     """Process multiple medical queries in batch."""
     try:
@@ -129,25 +691,167 @@ def batch_process():
         if not questions or not isinstance(questions, list):
             return jsonify({"error": "يرجى إرسال قائمة من الأسئلة في المفتاح 'questions'"}), 400
 
-        results = []
+        if model is None:
+            return jsonify({"error": "النموذج قيد التحميل، يرجى المحاولة بعد قليل"}), 503
+        try:
+            deadline = request_deadline(data)
+        except ValueError:
+            return jsonify({"error": "قيمة المهلة 'timeout' غير صالحة"}), 400
+        
+        answers = cached_answers(questions, 256)
+        missing = [question for question, answer in zip(questions, answers) if answer is None]
+        if missing:
+            # Batch jobs run at low priority, between interactive requests
+            level, max_new_tokens = degrade(256)
+            if level.fallback:
+                return fallback_response(level)
+            
+            try:
+                futures = batcher.submit_many(missing, max_new_tokens=max_new_tokens, priority=BATCH, deadline=deadline, greedy=level.greedy)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 413
+            except TokenBudgetExceeded as e:
+                return jsonify({"error": str(e)}), 429
+            
+            try:
+                generated = [future.result(timeout=deadline.remaining()) for future in futures]
+            except (RequestCancelled, FutureTimeoutError):
+                return cancelled_response(deadline)
+            if max_new_tokens == 256:
+                store_answers(missing, generated, 256)
+            
+            generated = iter(generated)
+            answers = [answer if answer is not None else next(generated) for answer in answers]
+        
+        results = [{"question": question, "response": answer} for question, answer in zip(questions, answers)]
+        return jsonify({"results": results})
+        
+    except Exception as e:
+        logger.error(f"Error processing batch request: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/sessions', methods=['GET'])
+def list_sessions():
+    """Number of stored conversation sessions and the memory of their caches."""
+    return jsonify(sessions.stats())
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def end_session(session_id):
+    """End a conversation and free its cache."""
+    if not sessions.discard(session_id):
+        return jsonify({"error": f"Unknown session: {session_id}"}), 404
+    return jsonify({"session_id": session_id, "status": "ended"})
+
+@app.route('/adapters', methods=['GET'])
+def list_adapters():
+    """List the LoRA adapters loaded on top of the base model."""
+    current_model = model
+    if current_model is None:
+        return jsonify({"error": "النموذج قيد التحميل، يرجى المحاولة بعد قليل"}), 503
+    
+    return jsonify({"adapters": current_model.adapters})
+
+@app.route('/adapters', methods=['POST'])
+def load_adapter():
+    """Load a LoRA adapter (e.g. a fine-tuning output directory) under a name."""
+    try:
+        data = request.json
+        
+        if not data:
+            return jsonify({"error": "No JSON data received"}), 400
+            
+        name = data.get('name')
+        adapter_path = data.get('path')
         
+        if not name or not adapter_path:
+            return jsonify({"error": "يرجى تحديد اسم المحول ومساره"}), 400
+
         with model_lock:
             if model is None:
                 return jsonify({"error": "النموذج قيد التحميل، يرجى المحاولة بعد قليل"}), 503
             
-            for question in questions:
-                response = model.generate_response(question)
-                results.append({
-                    "question": question,
-                    "response": response
-                })
+            model.load_adapter(name, adapter_path)
+            adapters = dict(model.adapters)
         
-        return jsonify({"results": results})
+        return jsonify({"status": "loaded", "adapters": adapters})
         
     except Exception as e:
-        logger.error(f"Error processing batch request: {str(e)}")
+        logger.error(f"Error loading adapter: {str(e)}")
+        logger.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+@app.route('/adapters/<name>', methods=['DELETE'])
+def unload_adapter(name):
+    """Unload a LoRA adapter."""
+    try:
+        with model_lock:
+            if model is None:
+                return jsonify({"error": "النموذج قيد التحميل، يرجى المحاولة بعد قليل"}), 503
+            if name not in model.adapters:
+                return jsonify({"error": f"Unknown adapter: {name}"}), 404
+            
+            model.unload_adapter(name)
+            adapters = dict(model.adapters)
+        
+        return jsonify({"status": "unloaded", "adapters": adapters})
+        
+    except Exception as e:
+        logger.error(f"Error unloading adapter: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/reload', methods=['POST'])
+def start_reload():
+    """Load a new model (e.g. a fresh fine-tuned checkpoint) and swap it in without downtime."""
+    try:
+        if not is_admin_request():
+            return jsonify({"error": "Unauthorized"}), 401
+        
+        data = request.json or {}
+        
+        current_model = model
+        base_config = current_model.config if current_model is not None else MedLLamaConfig()
+        overrides = {key: data[key] for key in ("base_model", "local_model_dir", "draft_model") if key in data}
+        model_config = dataclasses.replace(base_config, **overrides)
+        
+        # Keep serving the current adapters unless a new set is given
+        adapters = data.get('adapters')
+        if adapters is None:
+            adapters = dict(current_model.adapters) if current_model is not None else {}
+        
+        with reload_lock:
+            if reload_state["status"] == "loading":
+                return jsonify({"error": "A reload is already in progress"}), 409
+            reload_state.clear()
+            reload_state.update({"status": "loading", "started_at": time.time(), "config": overrides, "adapters": adapters})
+        
+        threading.Thread(target=reload_model, args=(model_config, adapters)).start()
+        
+        return jsonify({"status": "Reload started", "config": overrides, "adapters": adapters}), 202
+        
+    except Exception as e:
+        logger.error(f"Error starting reload: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/reload', methods=['GET'])
+def reload_status():
+    """Report the progress and timings of the latest reload."""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    with reload_lock:
+        return jsonify(dict(reload_state))
+
+@app.route('/admin/cache', methods=['DELETE'])
+def clear_response_cache():
+    """Drop every cached answer, e.g. after changing the prompt or an adapter's weights in place."""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    if response_cache is None:
+        return jsonify({"error": "Response cache is disabled"}), 404
+
+    response_cache.clear()
+    return jsonify({"status": "cleared", "response_cache": response_cache.stats()})
+
 @app.route('/finetune', methods=['POST'])
 def finetune():
     """Start a fine-tuning job."""
@@ -166,28 +870,29 @@ def finetune():
         if not train_data_path or not output_dir:
             return jsonify({"error": "يرجى تحديد مسار بيانات التدريب ومسار الإخراج"}), 400
 
-        # Start fine-tuning in a separate thread
-        def start_finetuning():
-            try:
-                with model_lock:
-                    if model is None:
-                        initialize_model()
-                    
-                    model.finetune(
-                        train_data_path=train_data_path,
-                        output_dir=output_dir,
-                        batch_size=batch_size,
-                        epochs=epochs,
-                        learning_rate=learning_rate
-                    )
-            except Exception as e:
-                logger.error(f"Fine-tuning error: {str(e)}")
-                logger.error(traceback.format_exc())
+        # Train a private copy of the base model in its own process; the serving
+        # model and model_lock are never touched
+        current_model = model
+        base_config = current_model.config if current_model is not None else MedLLamaConfig()
+        model_config = dataclasses.replace(
+            base_config,
+            base_model=data.get('base_model', base_config.base_model),
+            local_model_dir=None,
+            draft_model=None,
+            warmup=False
+        )
         
-        threading.Thread(target=start_finetuning).start()
+        job = finetune_jobs.submit(model_config, {
+            "train_data_path": train_data_path,
+            "output_dir": output_dir,
+            "batch_size": batch_size,
+            "epochs": epochs,
+            "learning_rate": learning_rate
+        })
         
         return jsonify({
-            "status": "Fine-tuning job started",
+            "status": "Fine-tuning job queued",
+            "job_id": job["id"],
             "train_data_path": train_data_path,
             "output_dir": output_dir,
             "parameters": {
@@ -195,13 +900,37 @@ def finetune():
                 "epochs": epochs,
                 "learning_rate": learning_rate
             }
-        })
+        }), 202
         
     except Exception as e:
         logger.error(f"Error starting fine-tuning: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/finetune', methods=['GET'])
+def list_finetune_jobs():
+    """List fine-tuning jobs and their progress."""
+    return jsonify({"jobs": finetune_jobs.list()})
+
+@app.route('/finetune/<job_id>', methods=['GET'])
+def finetune_status(job_id):
+    """Report progress of a fine-tuning job: step, loss, steps/second and ETA."""
+    job = finetune_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    
+    return jsonify(job)
+
+@app.route('/finetune/<job_id>', methods=['DELETE'])
+def cancel_finetune(job_id):
+    """Cancel a queued or running fine-tuning job."""
+    job = finetune_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    
+    return jsonify(job)
+
 if __name__ == '__main__':
-    # Initialize model during startup
+    # Initialize model during startup; the first request must not start a second load
+    model_init_started.set()
     threading.Thread(target=initialize_model).start()
     app.run(debug=True, host='0.0.0.0', port=5001)
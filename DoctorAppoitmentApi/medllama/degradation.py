@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, asdict
+
+@dataclass
+class DegradationLevel:
+    """One step of the degradation policy and the load that triggers it.
+
+    A level applies once the queue holds queue_depth requests or the recent
+    p95 latency of /generate reaches latency_seconds, whichever comes first.
+    """
+    name: str
+    queue_depth: int = None
+    latency_seconds: float = None
+    max_new_tokens: int = None  # Cap on the tokens generated per request
+    greedy: bool = False  # Greedy decoding instead of sampling
+    fallback: bool = False  # Refuse generation so clients use their own fallback
+
+DEFAULT_POLICY = [
+    DegradationLevel("normal"),
+    DegradationLevel("short_answers", queue_depth=8, latency_seconds=5.0, max_new_tokens=128),
+    DegradationLevel("greedy", queue_depth=16, latency_seconds=10.0, max_new_tokens=64, greedy=True),
+    DegradationLevel("fallback", queue_depth=32, latency_seconds=20.0, fallback=True),
+]
+
+def load_policy(value=None):
+    """Parse a policy from JSON, or a path to a JSON file: a list of DegradationLevel fields, mildest first.
+
+    Returns DEFAULT_POLICY when value is empty.
+    """
+    if not value:
+        return list(DEFAULT_POLICY)
+    if os.path.isfile(value):
+        with open(value, 'r', encoding='utf-8') as f:
+            value = f.read()
+    levels = [DegradationLevel(**entry) for entry in json.loads(value)]
+    if not levels:
+        raise ValueError("A degradation policy needs at least one level")
+    return levels
+
+class LoadDegrader:
+    """Picks the degradation level from queue depth and recent latency.
+
+    The level rises as soon as a threshold is reached, and falls one level at
+    a time once the load has stayed below the current level for
+    cooldown_seconds, so it does not flap at a threshold.
+    """
+
+    def __init__(self, levels=None, window_seconds=30.0, cooldown_seconds=10.0, min_samples=5, on_change=None):
+        """
+        Initialize the degrader.
+
+        Args:
+            levels: DegradationLevel list, mildest first (default: DEFAULT_POLICY)
+            window_seconds: How far back latencies count as recent
+            cooldown_seconds: Calm time before stepping down one level
+            min_samples: Latencies needed in the window before latency counts
+            on_change: Called with (old level, new level) whenever the level changes
+        """
+        self.levels = levels or list(DEFAULT_POLICY)
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.min_samples = min_samples
+        self.on_change = on_change
+        self.index = 0
+        self.queue_depth = 0
+        self._latencies = deque(maxlen=1000)
+        self._calm_since = None
+        self._lock = threading.Lock()
+
+    @property
+    def level(self):
+        return self.levels[self.index]
+
+    def observe_latency(self, seconds):
+        with self._lock:
+            self._latencies.append((time.monotonic(), seconds))
+
+    def recent_latency(self):
+        """p95 latency over the window, or None with too few samples."""
+        with self._lock:
+            horizon = time.monotonic() - self.window_seconds
+            while self._latencies and self._latencies[0][0] < horizon:
+                self._latencies.popleft()
+            samples = sorted(seconds for _, seconds in self._latencies)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(int(len(samples) * 0.95), len(samples) - 1)]
+
+    def _target(self, queue_depth, latency):
+        """Index of the highest level whose thresholds are reached."""
+        target = 0
+        for index, level in enumerate(self.levels):
+            if (level.queue_depth is not None and queue_depth >= level.queue_depth) or \
+               (level.latency_seconds is not None and latency is not None and latency >= level.latency_seconds):
+                target = index
+        return target
+
+    def update(self, queue_depth):
+        """Re-evaluate the level for the current queue depth and return it."""
+        latency = self.recent_latency()
+        now = time.monotonic()
+        with self._lock:
+            self.queue_depth = queue_depth
+            old = self.index
+            target = self._target(queue_depth, latency)
+            if target >= self.index:
+                self.index = target
+                self._calm_since = None
+            elif self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.cooldown_seconds:
+                self.index -= 1
+                self._calm_since = now
+            new = self.index
+
+        if new != old and self.on_change is not None:
+            self.on_change(self.levels[old], self.levels[new])
+        return self.levels[new]
+
+    def status(self):
+        latency = self.recent_latency()
+        return {
+            **asdict(self.level),
+            "level": self.index,
+            "queue_depth": self.queue_depth,
+            "latency_p95_seconds": latency,
+        }
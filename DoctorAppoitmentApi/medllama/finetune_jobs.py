@@ -0,0 +1,211 @@
+import time
+import uuid
+import queue
+import logging
+import threading
+import traceback
+import multiprocessing
+
+from transformers import TrainerCallback
+
+logger = logging.getLogger(__name__)
+
+class _ProgressCallback(TrainerCallback):
+    """Reports trainer progress to the parent process and stops training on cancellation."""
+
+    def __init__(self, progress_queue, cancel_event):
+        self.progress_queue = progress_queue
+        self.cancel_event = cancel_event
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.progress_queue.put({"event": "started", "max_steps": state.max_steps})
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.progress_queue.put({"event": "step", "step": state.global_step, "epoch": state.epoch})
+        if self.cancel_event.is_set():
+            control.should_training_stop = True
+            control.should_save = False
+        return control
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if logs and "loss" in logs:
+            self.progress_queue.put({"event": "loss", "step": state.global_step, "loss": logs["loss"]})
+
+def _run_job(model_config, params, progress_queue, cancel_event):
+    """Entry point of the training process: load a private model copy and fine-tune it."""
+    from medllama_arabic import MedLLamaArabic
+
+    try:
+        model = MedLLamaArabic(model_config)
+        model.finetune(callbacks=[_ProgressCallback(progress_queue, cancel_event)], **params)
+        progress_queue.put({"event": "cancelled" if cancel_event.is_set() else "completed"})
+    except Exception as e:
+        progress_queue.put({"event": "failed", "error": str(e), "traceback": traceback.format_exc()})
+
+class FinetuneJobManager:
+    """Queue of fine-tuning jobs, each trained in its own process.
+
+    Jobs run one at a time so training never competes with itself for the GPU,
+    and never touches the serving model or its lock. Progress (step, loss,
+    steps/second, ETA) is streamed back from the training process.
+    """
+
+    def __init__(self, cancel_grace_seconds=60):
+        """
+        Initialize the job manager.
+
+        Args:
+            cancel_grace_seconds: How long a cancelled job may take to stop at a
+                step boundary before its process is terminated
+        """
+        self.cancel_grace_seconds = cancel_grace_seconds
+
+        # CUDA cannot be re-initialised in a forked child
+        self._context = multiprocessing.get_context("spawn")
+        self._jobs = {}
+        self._cancel_events = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="finetune-jobs", daemon=True)
+        self._worker.start()
+
+    def submit(self, model_config, params):
+        """Queue a fine-tuning job and return its initial status."""
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "parameters": params,
+            "created_at": time.time(),
+            "step": 0,
+            "max_steps": None,
+            "loss": None,
+            "steps_per_second": None,
+            "eta_seconds": None,
+        }
+
+        with self._lock:
+            self._jobs[job_id] = job
+            self._cancel_events[job_id] = self._context.Event()
+        self._queue.put((job_id, model_config, params))
+
+        logger.info(f"Queued fine-tuning job {job_id}")
+        return dict(job)
+
+    def get(self, job_id):
+        """Return a snapshot of a job's status, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        """Return status snapshots of all jobs, oldest first."""
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or ask a running one to stop at the next step."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+
+            if job["status"] == "queued":
+                job["status"] = "cancelled"
+                job["finished_at"] = time.time()
+            elif job["status"] == "running":
+                job["status"] = "cancelling"
+                self._cancel_events[job_id].set()
+
+            return dict(job)
+
+    def _run(self):
+        while True:
+            job_id, model_config, params = self._queue.get()
+
+            with self._lock:
+                if self._jobs[job_id]["status"] != "queued":
+                    continue
+                self._jobs[job_id].update({"status": "running", "started_at": time.time()})
+
+            try:
+                self._run_process(job_id, model_config, params)
+            except Exception as e:
+                logger.error(f"Fine-tuning job {job_id} error: {str(e)}")
+                self._finish(job_id, "failed", error=str(e))
+
+    def _run_process(self, job_id, model_config, params):
+        """Start the training process for a job and follow it until it exits."""
+        cancel_event = self._cancel_events[job_id]
+        progress_queue = self._context.Queue()
+        process = self._context.Process(
+            target=_run_job,
+            args=(model_config, params, progress_queue, cancel_event),
+            name=f"finetune-{job_id}",
+            daemon=True
+        )
+        process.start()
+        logger.info(f"Started fine-tuning job {job_id} in process {process.pid}")
+
+        outcome = None
+        cancel_requested_at = None
+        while True:
+            try:
+                message = progress_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+
+                if cancel_event.is_set():
+                    cancel_requested_at = cancel_requested_at or time.monotonic()
+                    if time.monotonic() - cancel_requested_at > self.cancel_grace_seconds:
+                        logger.warning(f"Fine-tuning job {job_id} did not stop in time, terminating")
+                        process.terminate()
+                continue
+
+            if message["event"] in ("completed", "cancelled", "failed"):
+                outcome = message
+            else:
+                self._update_progress(job_id, message)
+
+        process.join()
+
+        if outcome is None:
+            if cancel_event.is_set():
+                self._finish(job_id, "cancelled")
+            else:
+                self._finish(job_id, "failed", error=f"Training process exited with code {process.exitcode}")
+        elif outcome["event"] == "failed":
+            logger.error(outcome["traceback"])
+            self._finish(job_id, "failed", error=outcome["error"])
+        else:
+            self._finish(job_id, outcome["event"])
+
+    def _update_progress(self, job_id, message):
+        with self._lock:
+            job = self._jobs[job_id]
+
+            if message["event"] == "started":
+                job["max_steps"] = message["max_steps"]
+                job["train_started_at"] = time.time()
+                return
+
+            job["step"] = message["step"]
+            if message["event"] == "loss":
+                job["loss"] = message["loss"]
+            else:
+                job["epoch"] = message["epoch"]
+
+            elapsed = time.time() - job.get("train_started_at", job["started_at"])
+            if job["step"] and elapsed > 0:
+                job["steps_per_second"] = job["step"] / elapsed
+                if job["max_steps"]:
+                    job["eta_seconds"] = max(job["max_steps"] - job["step"], 0) / job["steps_per_second"]
+
+    def _finish(self, job_id, status, error=None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update({"status": status, "finished_at": time.time(), "eta_seconds": None})
+            if error:
+                job["error"] = error
+        logger.info(f"Fine-tuning job {job_id} {status}")
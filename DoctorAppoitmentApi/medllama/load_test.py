@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Load-testing and benchmark harness for the MedLLama API (api.py) and the Chatbot app (app.py).
+
+Sends a reproducible mix of questions at a fixed concurrency (closed loop) or
+Poisson arrival rate (open loop), and reports throughput, p50/p95/p99 latency
+and, for streamed /generate requests, time to first token.
+
+With --local the MedLLama API is started in-process on an offline fake model
+(a tiny randomly initialised LLaMA, or a deterministic stub with a per-token
+delay), so the whole stack can be benchmarked without a GPU or network:
+
+    python load_test.py --local --concurrency 8 --requests 200 --stream
+    python load_test.py --local --fake-model stub --token-delay 0.02 --concurrency 16
+    python load_test.py --benchmark-workers 1 2 4 8 --concurrency 16 --requests 400
+    python load_test.py --target chatbot --url http://localhost:5000 --rate 5 --duration 60
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import subprocess
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from test_medllama import SAMPLE_QUESTIONS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def load_questions(question_files):
+    """Return SAMPLE_QUESTIONS plus the questions of any collected datasets."""
+    questions = list(SAMPLE_QUESTIONS)
+
+    for path in question_files or []:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        questions.extend(item["question"] if isinstance(item, dict) else item for item in data)
+
+    logger.info(f"Loaded {len(questions)} questions")
+    return questions
+
+def start_local_api(port, model_dir=None, fake_model="tiny", token_delay=0.0):
+    """Serve api.py in-process on a local or fake model and return the base URL."""
+    from werkzeug.serving import make_server
+    import api
+    from medllama_arabic import MedLLamaConfig
+
+    if model_dir:
+        model_config = MedLLamaConfig(local_model_dir=model_dir, fake_token_delay=token_delay)
+    else:
+        model_config = MedLLamaConfig(fake_model=fake_model, fake_token_delay=token_delay)
+    api.model = api.build_model(model_config, {})
+    api.model_init_started.set()
+
+    server = make_server("127.0.0.1", port, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+def send_request(session, target, url, question, max_new_tokens, stream):
+    """Send one request; return (latency, time to first token or None, ok)."""
+    start = time.perf_counter()
+    first_token = None
+
+    if target == "chatbot":
+        response = session.post(f"{url}/chat", json={"message": question, "userId": "load_test"}, timeout=300)
+    else:
+        payload = {"question": question, "max_new_tokens": max_new_tokens, "stream": stream}
+        response = session.post(f"{url}/generate", json=payload, timeout=300, stream=stream)
+        if stream and response.status_code == 200:
+            for chunk in response.iter_content(chunk_size=None):
+                if chunk and first_token is None:
+                    first_token = time.perf_counter() - start
+        response.close()
+
+    return time.perf_counter() - start, first_token, response.status_code == 200
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": values[-1],
+    }
+
+def run_load_test(url, questions, target="api", concurrency=4, rate=0.0, num_requests=100,
+                  duration=None, max_new_tokens=64, stream=False, seed=0):
+    """Drive the target and return a report dict.
+
+    rate=0 runs a closed loop: `concurrency` clients send back to back. A positive
+    rate sends Poisson arrivals at that many requests/second, at most
+    `concurrency` in flight. duration, when given, bounds the run instead of num_requests.
+    """
+    rng = random.Random(seed)
+    latencies, ttfts = [], []
+    errors = 0
+    results_lock = threading.Lock()
+    local = threading.local()
+
+    def one_request(question):
+        nonlocal errors
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        try:
+            latency, first_token, ok = send_request(local.session, target, url, question, max_new_tokens, stream)
+        except requests.RequestException as e:
+            logger.warning(f"Request failed: {str(e)}")
+            latency, first_token, ok = None, None, False
+
+        with results_lock:
+            if ok:
+                latencies.append(latency)
+                if first_token is not None:
+                    ttfts.append(first_token)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+
+    def more():
+        return (time.perf_counter() < deadline) if deadline else (sent < num_requests)
+
+    sent = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if rate > 0:
+            next_arrival = start
+            while more():
+                next_arrival += rng.expovariate(rate)
+                time.sleep(max(0.0, next_arrival - time.perf_counter()))
+                executor.submit(one_request, rng.choice(questions))
+                sent += 1
+        else:
+            slots = threading.Semaphore(concurrency)
+            while more():
+                slots.acquire()
+                future = executor.submit(one_request, rng.choice(questions))
+                future.add_done_callback(lambda _: slots.release())
+                sent += 1
+
+    elapsed = time.perf_counter() - start
+    report = {
+        "target": target,
+        "url": url,
+        "concurrency": concurrency,
+        "rate": rate,
+        "stream": stream,
+        "max_new_tokens": max_new_tokens,
+        "requests": sent,
+        "errors": errors,
+        "duration_seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_seconds": summarize(latencies),
+        "ttft_seconds": summarize(ttfts),
+    }
+    return report
+
+def start_workers(port, workers, model_dir=None, fake_model="tiny", token_delay=0.0, timeout=600):
+    """Launch serve.py with the given worker count and wait until it answers /health."""
+    env = dict(os.environ, MEDLLAMA_FAKE_TOKEN_DELAY=str(token_delay))
+    if model_dir:
+        env["MEDLLAMA_MODEL_DIR"] = model_dir
+    else:
+        env["MEDLLAMA_FAKE_MODEL"] = fake_model
+
+    serve_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+    process = subprocess.Popen(
+        [sys.executable, serve_script, "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        env=env
+    )
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve.py exited with code {process.returncode}")
+        try:
+            if requests.get(f"{url}/health", timeout=5).json()["model_status"] == "loaded":
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError(f"serve.py did not become ready within {timeout} seconds")
+
+def benchmark_workers(worker_counts, questions, port=5011, model_dir=None, fake_model="tiny", token_delay=0.0, **load_kwargs):
+    """Measure how throughput scales with the number of serve.py worker processes."""
+    results = []
+    for workers in worker_counts:
+        process, url = start_workers(port, workers, model_dir, fake_model, token_delay)
+        try:
+            report = run_load_test(url, questions, **load_kwargs)
+        finally:
+            process.terminate()
+            process.wait()
+
+        report["workers"] = workers
+        results.append(report)
+
+    baseline = results[0]["throughput_rps"] if results else 0.0
+    logger.info("Workers | Throughput (req/s) | Speedup | p50 (s) | p99 (s) | Errors")
+    for report in results:
+        latency = report["latency_seconds"] or {}
+        speedup = report["throughput_rps"] / baseline if baseline else 0.0
+        logger.info(
+            f"{report['workers']:7d} | {report['throughput_rps']:18.2f} | {speedup:6.2f}x | "
+            f"{latency.get('p50', 0):7.3f} | {latency.get('p99', 0):7.3f} | {report['errors']}"
+        )
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test the MedLLama API or the Chatbot app")
+    parser.add_argument("--target", choices=["api", "chatbot"], default="api", help="api.py (/generate) or app.py (/chat)")
+    parser.add_argument("--url", default="http://localhost:5001", help="Base URL of the target")
+    parser.add_argument("--local", action="store_true", help="Serve api.py in-process on an offline fake model")
+    parser.add_argument("--fake-model", choices=["tiny", "stub"], default="tiny", help="Fake model for --local and --benchmark-workers")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds added per generated token by the fake model")
+    parser.add_argument("--local-model-dir", help="Model directory for --local instead of a fake model")
+    parser.add_argument("--benchmark-workers", type=int, nargs="+", metavar="N", help="Run the load test against serve.py with each worker count")
+    parser.add_argument("--port", type=int, default=5011, help="Port for --local and --benchmark-workers")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum requests in flight")
+    parser.add_argument("--rate", type=float, default=0.0, help="Poisson arrival rate in requests/second (0 = closed loop)")
+    parser.add_argument("--requests", type=int, default=100, help="Number of requests to send")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds instead of --requests")
+    parser.add_argument("--questions", nargs="*", help="Collected dataset JSON files to add to the question mix")
+    parser.add_argument("--max-new-tokens", type=int, default=64, help="max_new_tokens sent to /generate")
+    parser.add_argument("--stream", action="store_true", help="Stream /generate responses to measure time to first token")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the question mix and arrival times")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    questions = load_questions(args.questions)
+    load_kwargs = dict(
+        concurrency=args.concurrency,
+        rate=args.rate,
+        num_requests=args.requests,
+        duration=args.duration,
+        max_new_tokens=args.max_new_tokens,
+        stream=args.stream,
+        seed=args.seed
+    )
+
+    if args.benchmark_workers:
+        results = benchmark_workers(
+            args.benchmark_workers, questions, args.port,
+            args.local_model_dir, args.fake_model, args.token_delay, **load_kwargs
+        )
+        report = {"workers": results, "errors": sum(result["errors"] for result in results)}
+    else:
+        url = start_local_api(args.port, args.local_model_dir, args.fake_model, args.token_delay) if args.local else args.url
+        report = run_load_test(url, questions, target=args.target, **load_kwargs)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    sys.exit(0 if report["errors"] == 0 else 1)
@@ -1,10 +1,21 @@
 import os
+import gc
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 import torch
 import json
 import logging
 from dataclasses import dataclass
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-from peft import LoraConfig, get_peft_model
+from transformers.generation import GenerateDecoderOnlyOutput
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig,
+    BatchEncoding, LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList,
+    TemperatureLogitsWarper, TopPLogitsWarper
+)
+from peft import LoraConfig, PeftModel, get_peft_model
 from tqdm import tqdm
 from torch.utils.data import Dataset, DataLoader
 import numpy as np
@@ -26,6 +37,25 @@ class MedLLamaConfig:
     device_map: str = "auto"
     target_modules: list = None
     max_length: int = 512
+    local_model_dir: str = None  # Snapshot written by prepare_snapshot(); loaded offline when present
+    backend: str = "auto"  # "cuda" (bitsandbytes 4-bit), "cpu", or "auto" to pick by available hardware
+    cpu_int8: bool = True  # Dynamic int8 quantization of linear layers on the CPU backend
+    cpu_bf16: bool = True  # bf16 weights on the CPU backend when int8 is off and the CPU supports it
+    cpu_num_threads: int = None
+    cpu_num_interop_threads: int = None
+    cpu_compile: bool = False
+    draft_model: str = None  # Small model sharing the tokenizer, used for assisted (speculative) generation
+    num_assistant_tokens: int = 5  # Draft tokens proposed per verification step
+    warmup: bool = True
+    warmup_max_new_tokens: int = 8
+    profile: bool = False  # Record per-phase timings of every generate_response call
+    profile_trace_dir: str = None  # Also write a torch.profiler Chrome trace per profiled call
+    fake_model: str = None  # "tiny" (random LLaMA) or "stub" (deterministic, no weights), built offline instead of base_model
+    fake_token_delay: float = 0.0  # Seconds added per generated token, to emulate a larger model's decode speed
+    stop_sequences: tuple = ("<SYS>", "<</SYS>>", "[INST]")  # Generation stops at (and the response is cut before) any of these
+    prompt_cache_size: int = 4096  # Questions whose prompt token ids are kept in an LRU cache (0 disables)
+    session_max_tokens: int = 2048  # A conversation longer than this starts over from the new message
+    session_turn_template: str = "\n\n{instruction}\n"  # Follow-up messages, appended to the dialogue so far
     arabic_prompt_template: str = """
 <SYS>
 أنت مساعد طبي ذكي متخصص في الإجابة على الأسئلة الطبية باللغة العربية. أنت تقدم معلومات دقيقة وموثوقة.
@@ -46,6 +76,12 @@ class ArabicMedicalDataset(Dataset):
         with open(data_path, 'r', encoding='utf-8') as f:
             self.data = json.load(f)
         
+        # Tokenize every example once, in two batched calls, instead of on every epoch
+        template = MedLLamaConfig().arabic_prompt_template
+        prompts = [template.format(instruction=item["question"]) for item in self.data]
+        self.prompt_ids = tokenizer(prompts)["input_ids"] if self.data else []
+        self.answer_ids = tokenizer([item["answer"] for item in self.data])["input_ids"] if self.data else []
+        
         logger.info(f"Loaded {len(self.data)} examples")
     
     def __len__(self):
@@ -54,17 +90,14 @@ class ArabicMedicalDataset(Dataset):
     def __getitem__(self, idx):
         item = self.data[idx]
         
-        # Format the prompt using the Arabic prompt template
-        prompt = MedLLamaConfig().arabic_prompt_template.format(instruction=item["question"])
-        
-        # Tokenize
-        encoded_prompt = self.tokenizer(prompt, truncation=True, max_length=self.max_length - len(item["answer"]))
-        encoded_answer = self.tokenizer(item["answer"], truncation=True, max_length=len(item["answer"]))
+        # Truncate the pre-tokenized prompt and answer
+        prompt_ids = self.prompt_ids[idx][:max(self.max_length - len(item["answer"]), 0)]
+        answer_ids = self.answer_ids[idx][:len(item["answer"])]
         
         # Create input_ids and labels
-        input_ids = encoded_prompt["input_ids"] + encoded_answer["input_ids"]
-        attention_mask = encoded_prompt["attention_mask"] + encoded_answer["attention_mask"]
-        labels = [-100] * len(encoded_prompt["input_ids"]) + encoded_answer["input_ids"]
+        input_ids = prompt_ids + answer_ids
+        attention_mask = [1] * len(input_ids)
+        labels = [-100] * len(prompt_ids) + answer_ids
         
         # Pad or truncate
         if len(input_ids) < self.max_length:
@@ -83,6 +116,264 @@ class ArabicMedicalDataset(Dataset):
             "labels": torch.tensor(labels)
         }
 
+class PromptEncoder:
+    """Token ids of formatted prompts, with a bounded LRU cache per question.
+    
+    Questions are cached by their whitespace-normalised text. When the
+    tokenizer splits the template and the question independently (checked
+    once on sample prompts), the template text around {instruction} is
+    tokenized once and only the question is tokenized on a miss; otherwise the
+    ids of the whole prompt are cached. Misses in a batch are tokenized with
+    one call to the fast tokenizer.
+    """
+    
+    PROBES = ("ما هي أعراض السكري؟", "Is it  a cold, or the flu?")
+    
+    def __init__(self, tokenizer, template, max_size=4096, on_lookup=None):
+        self.tokenizer = tokenizer
+        self.template = template
+        self.max_size = max_size
+        self.on_lookup = on_lookup
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        
+        prefix, suffix = template.split("{instruction}", 1)
+        self.prefix_ids = tokenizer(prefix)["input_ids"]
+        self.suffix_ids = tokenizer(suffix, add_special_tokens=False)["input_ids"]
+        self.piecewise = all(
+            self._join(tokenizer(question, add_special_tokens=False)["input_ids"]) == tokenizer(template.format(instruction=question))["input_ids"]
+            for question in self.PROBES
+        )
+    
+    @staticmethod
+    def normalize(question):
+        return " ".join(question.split())
+    
+    def _join(self, question_ids):
+        return self.prefix_ids + question_ids + self.suffix_ids
+    
+    def _tokenize(self, questions):
+        if self.piecewise:
+            return [self._join(ids) for ids in self.tokenizer(questions, add_special_tokens=False)["input_ids"]]
+        prompts = [self.template.format(instruction=question) for question in questions]
+        return self.tokenizer(prompts)["input_ids"]
+    
+    def encode_batch(self, questions):
+        """Prompt token ids for each question."""
+        keys = [self.normalize(question) for question in questions]
+        with self._lock:
+            cached = [self._cache.get(key) for key in keys]
+            for key, ids in zip(keys, cached):
+                if ids is not None:
+                    self._cache.move_to_end(key)
+        
+        misses = list(dict.fromkeys(key for key, ids in zip(keys, cached) if ids is None))
+        if misses:
+            encoded = dict(zip(misses, self._tokenize(misses)))
+            cached = [ids if ids is not None else encoded[key] for key, ids in zip(keys, cached)]
+            if self.max_size:
+                with self._lock:
+                    self._cache.update(encoded)
+                    while len(self._cache) > self.max_size:
+                        self._cache.popitem(last=False)
+        
+        if self.on_lookup is not None:
+            for key in keys:
+                self.on_lookup(key not in misses)
+        return cached
+    
+    def encode(self, question):
+        return self.encode_batch([question])[0]
+    
+    def pad(self, id_lists):
+        """Left-pad prompt ids into input_ids/attention_mask tensors."""
+        length = max(len(ids) for ids in id_lists)
+        input_ids = np.full((len(id_lists), length), self.tokenizer.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(id_lists), length), dtype=np.int64)
+        for row, ids in enumerate(id_lists):
+            input_ids[row, length - len(ids):] = ids
+            attention_mask[row, length - len(ids):] = 1
+        return BatchEncoding({
+            "input_ids": torch.from_numpy(input_ids),
+            "attention_mask": torch.from_numpy(attention_mask),
+        })
+
+def _synchronize():
+    """Wait for queued CUDA work so wall-clock timings cover it."""
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+class _FirstStepTimer(LogitsProcessor):
+    """Records when the first decoding step runs, i.e. when prompt processing has finished."""
+    
+    def __init__(self, synchronize=False):
+        self.synchronize = synchronize
+        self.first_step_time = None
+    
+    def __call__(self, input_ids, scores):
+        if self.first_step_time is None:
+            if self.synchronize:
+                _synchronize()
+            self.first_step_time = time.perf_counter()
+        return scores
+
+class _StopSequences(StoppingCriteria):
+    """Stops each sequence once its generated text contains a stop sequence.
+    
+    Every step decodes only the tokens added since the previous step plus a
+    short overlap, so the cost per step does not grow with the output and
+    stop sequences split across tokens (or multi-byte characters) are found.
+    """
+    
+    def __init__(self, tokenizer, stop_sequences, prompt_length):
+        self.tokenizer = tokenizer
+        self.stop_sequences = stop_sequences
+        # A character is at most 4 byte-level tokens
+        self.overlap = 4 * max(len(stop) for stop in stop_sequences)
+        self.prompt_length = prompt_length
+        self.seen_length = prompt_length
+        self.stopped = None
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.stopped is None:
+            self.stopped = [False] * input_ids.shape[0]
+        
+        start = max(self.prompt_length, self.seen_length - self.overlap)
+        self.seen_length = input_ids.shape[1]
+        for row, token_ids in enumerate(input_ids[:, start:].tolist()):
+            if not self.stopped[row]:
+                tail = self.tokenizer.decode(token_ids, skip_special_tokens=True)
+                self.stopped[row] = any(stop in tail for stop in self.stop_sequences)
+        
+        return torch.tensor(self.stopped, dtype=torch.bool, device=input_ids.device)
+
+class _Cancellation(StoppingCriteria):
+    """Stops each sequence once its request has been cancelled (deadline passed, client gone)."""
+    
+    def __init__(self, checks):
+        self.checks = checks
+        self.cancelled = [False] * len(checks)
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        for row, check in enumerate(self.checks):
+            if not self.cancelled[row] and check is not None:
+                self.cancelled[row] = check()
+        return torch.tensor(self.cancelled, dtype=torch.bool, device=input_ids.device)
+
+class _TokenDelay(LogitsProcessor):
+    """Sleeps at every decoding step to emulate a slower model."""
+    
+    def __init__(self, delay):
+        self.delay = delay
+    
+    def __call__(self, input_ids, scores):
+        time.sleep(self.delay)
+        return scores
+
+def build_byte_tokenizer():
+    """Byte-level BPE tokenizer built in memory: every UTF-8 byte is one token."""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+    
+    vocab = {"<unk>": 0, "<s>": 1, "</s>": 2}
+    for symbol in pre_tokenizers.ByteLevel.alphabet():
+        vocab[symbol] = len(vocab)
+    
+    tokenizer = Tokenizer(models.BPE(vocab=vocab, merges=[], unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        bos_token="<s>",
+        eos_token="</s>",
+        unk_token="<unk>"
+    )
+
+def build_tiny_llama(vocab_size, hidden_size=64, num_layers=2, seed=0):
+    """Randomly initialised LLaMA-architecture model, small enough to run anywhere."""
+    from transformers import LlamaConfig, LlamaForCausalLM
+    
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=4,
+        max_position_embeddings=4096,
+        bos_token_id=1,
+        eos_token_id=2
+    )
+    return LlamaForCausalLM(config)
+
+class StubCausalLM:
+    """Deterministic stand-in for a causal LM with no weights.
+    
+    generate() answers every prompt with the same canned reply, one token per
+    step, calling the logits processors, stopping criteria and streamer like
+    transformers does, so timing, streaming and batching code runs unchanged.
+    A prompt that already ends with the start of the reply is continued.
+    """
+    
+    REPLY = "هذه إجابة تجريبية من نموذج وهمي لاختبار الخدمة وقياس أدائها."
+    
+    def __init__(self, tokenizer):
+        self.reply_ids = tokenizer(self.REPLY, add_special_tokens=False)["input_ids"] + [tokenizer.eos_token_id]
+        self.vocab_size = len(tokenizer)
+        self.device = torch.device("cpu")
+        self.dtype = torch.float32
+    
+    def eval(self):
+        return self
+    
+    def get_memory_footprint(self):
+        return 0
+    
+    def _reply_offset(self, token_ids):
+        """Length of the longest prefix of the reply that token_ids ends with."""
+        for length in range(min(len(token_ids), len(self.reply_ids)), 0, -1):
+            if token_ids[-length:] == self.reply_ids[:length]:
+                return length
+        return 0
+    
+    def generate(self, input_ids, attention_mask=None, max_new_tokens=20, logits_processor=None,
+                 stopping_criteria=None, streamer=None, pad_token_id=None, return_dict_in_generate=False, **kwargs):
+        batch_size = input_ids.shape[0]
+        offsets = [self._reply_offset(row) for row in input_ids.tolist()]
+        finished = torch.zeros(batch_size, dtype=torch.bool)
+        pad_token_id = self.reply_ids[-1] if pad_token_id is None else pad_token_id
+        
+        sequences = input_ids
+        if streamer is not None:
+            streamer.put(input_ids.cpu())
+        
+        for step in range(max_new_tokens):
+            scores = torch.zeros(batch_size, self.vocab_size)
+            for processor in logits_processor or []:
+                scores = processor(sequences, scores)
+            
+            next_tokens = torch.tensor(
+                [self.reply_ids[min(offset + step, len(self.reply_ids) - 1)] for offset in offsets],
+                dtype=input_ids.dtype
+            )
+            next_tokens = torch.where(finished, torch.full_like(next_tokens, pad_token_id), next_tokens)
+            sequences = torch.cat([sequences, next_tokens[:, None]], dim=1)
+            if streamer is not None:
+                streamer.put(next_tokens)
+            
+            finished |= next_tokens == self.reply_ids[-1]
+            for criteria in stopping_criteria or []:
+                finished |= criteria(sequences, scores)
+            if finished.all():
+                break
+        
+        if streamer is not None:
+            streamer.end()
+        if return_dict_in_generate:
+            return GenerateDecoderOnlyOutput(sequences=sequences, past_key_values=None)
+        return sequences
+
 class MedLLamaArabic:
     """Class for handling MedLLama models with Arabic support."""
     
@@ -90,46 +381,247 @@ class MedLLamaArabic:
         self.config = config or MedLLamaConfig()
         self.tokenizer = None
         self.model = None
+        self.load_timings = {}
+        self.draft_model = None
+        self.adapters = {}
+        # Called with a stats dict after every generate call (token counts, prefill/decode time)
+        self.generation_listeners = []
+        # Called with (cache name, hit) on every cache lookup
+        self.cache_listeners = []
+        self.prompt_encoder = None
+        self.last_profile = None
+        self.speculative_stats = {"calls": 0, "generated_tokens": 0, "target_forwards": 0, "draft_tokens": 0, "accepted_tokens": 0}
         
-    def load_model(self):
-        """Load the MedLLama model."""
-        logger.info(f"Loading model from {self.config.base_model}")
-        
-        # Setup quantization config if enabled
-        if self.config.use_4bit:
-            quantization_config = BitsAndBytesConfig(
-                load_in_4bit=True,
-                bnb_4bit_compute_dtype=self.config.bnb_4bit_compute_dtype,
-                bnb_4bit_quant_type=self.config.bnb_4bit_quant_type,
-                bnb_4bit_use_double_quant=False
-            )
-        else:
+    def _backend(self):
+        """Resolve the configured backend to "cuda" or "cpu"."""
+        if self.config.backend == "auto":
+            return "cuda" if torch.cuda.is_available() else "cpu"
+        if self.config.backend not in ("cuda", "cpu"):
+            raise ValueError(f"Unknown backend: {self.config.backend}")
+        return self.config.backend
+    
+    def _cpu_dtype(self):
+        """Pick the weight dtype for the CPU backend."""
+        # Dynamic int8 quantization only applies to float32 linear layers
+        if not self.config.cpu_int8 and self.config.cpu_bf16 and torch.ops.mkldnn._is_mkldnn_bf16_supported():
+            return torch.bfloat16
+        return torch.float32
+    
+    def _quantization_config(self):
+        """Build the bitsandbytes config for a fresh load from the base model."""
+        if not self.config.use_4bit or self._backend() != "cuda":
+            return None
+        return BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=self.config.bnb_4bit_compute_dtype,
+            bnb_4bit_quant_type=self.config.bnb_4bit_quant_type,
+            bnb_4bit_use_double_quant=False
+        )
+    
+    def _snapshot_dir(self):
+        """Return the local snapshot directory if one has been prepared."""
+        snapshot_dir = self.config.local_model_dir
+        if not snapshot_dir:
+            return None
+        if not os.path.isfile(os.path.join(snapshot_dir, "config.json")):
+            logger.warning(f"No prepared snapshot in {snapshot_dir}, loading {self.config.base_model} instead")
+            return None
+        return snapshot_dir
+    
+    def load_model(self, optimize=True):
+        """Load the MedLLama model.
+        
+        A snapshot prepared with prepare_snapshot() is loaded from local disk only:
+        the weights are already quantized and the safetensors files are memory-mapped.
+        Otherwise the base model is resolved and quantized as configured.
+        
+        Args:
+            optimize: Apply the backend's inference optimizations and warm up.
+                Disabled when the raw weights are needed, e.g. to save a snapshot.
+        """
+        timings = {}
+        start = time.perf_counter()
+        backend = self._backend()
+        
+        fake_model = self.config.fake_model
+        snapshot_dir = None if fake_model else self._snapshot_dir()
+        if fake_model:
+            logger.info(f"Building offline fake model ({fake_model})")
+            source = None
+            load_kwargs = {}
+            quantization_config = None
+        elif snapshot_dir:
+            logger.info(f"Loading prepared snapshot from {snapshot_dir}")
+            source = snapshot_dir
+            load_kwargs = {"local_files_only": True, "use_safetensors": True}
+            # The quantization config is stored in the snapshot's config.json
             quantization_config = None
+        else:
+            logger.info(f"Loading model from {self.config.base_model}")
+            source = self.config.base_model
+            load_kwargs = {}
+            quantization_config = self._quantization_config()
         
         # Load tokenizer
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            self.config.base_model,
-            use_fast=True
-        )
+        phase_start = time.perf_counter()
+        if fake_model:
+            self.tokenizer = build_byte_tokenizer()
+        else:
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                source,
+                use_fast=True,
+                local_files_only=load_kwargs.get("local_files_only", False)
+            )
         
         # Ensure padding token exists
         if self.tokenizer.pad_token_id is None:
             self.tokenizer.pad_token_id = self.tokenizer.eos_token_id
+        # Batched generation needs prompts to end at the same position
+        self.tokenizer.padding_side = "left"
+        self.prompt_encoder = PromptEncoder(
+            self.tokenizer,
+            self.config.arabic_prompt_template,
+            max_size=self.config.prompt_cache_size,
+            on_lookup=self._record_prompt_cache
+        )
+        timings["tokenizer"] = time.perf_counter() - phase_start
             
         # Load model
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.config.base_model,
-            quantization_config=quantization_config,
-            device_map=self.config.device_map
-        )
+        phase_start = time.perf_counter()
+        if fake_model:
+            self.model = self._build_fake_model()
+        else:
+            if backend == "cpu":
+                load_kwargs["torch_dtype"] = self._cpu_dtype()
+            self.model = AutoModelForCausalLM.from_pretrained(
+                source,
+                quantization_config=quantization_config,
+                device_map=self.config.device_map if backend == "cuda" else None,
+                low_cpu_mem_usage=True,
+                **load_kwargs
+            )
+        self.model.eval()
+        timings["weights"] = time.perf_counter() - phase_start
+        
+        if optimize and backend == "cpu" and fake_model != "stub":
+            phase_start = time.perf_counter()
+            self._optimize_for_cpu()
+            timings["cpu_optimize"] = time.perf_counter() - phase_start
+        
+        if self.config.draft_model:
+            phase_start = time.perf_counter()
+            self._load_draft_model(backend)
+            timings["draft_weights"] = time.perf_counter() - phase_start
         
-        logger.info("Model loaded successfully")
+        if optimize and self.config.warmup:
+            phase_start = time.perf_counter()
+            self.warmup()
+            timings["warmup"] = time.perf_counter() - phase_start
+        
+        timings["total"] = time.perf_counter() - start
+        self.load_timings = timings
+        
+        logger.info("Model loaded successfully (" + ", ".join(f"{phase}={seconds:.2f}s" for phase, seconds in timings.items()) + ")")
         return self.model, self.tokenizer
     
+    def _record_prompt_cache(self, hit):
+        for listener in self.cache_listeners:
+            listener("prompt_tokens", hit)
+    
+    def _build_fake_model(self):
+        """Build the configured offline model; it always runs on the CPU."""
+        if self.config.fake_model == "tiny":
+            return build_tiny_llama(len(self.tokenizer))
+        if self.config.fake_model == "stub":
+            return StubCausalLM(self.tokenizer)
+        raise ValueError(f"Unknown fake model: {self.config.fake_model}")
+    
+    def _load_draft_model(self, backend):
+        """Load the draft model used to propose tokens for assisted generation."""
+        logger.info(f"Loading draft model from {self.config.draft_model}")
+        self.draft_model = AutoModelForCausalLM.from_pretrained(
+            self.config.draft_model,
+            torch_dtype=self._cpu_dtype() if backend == "cpu" else torch.float16,
+            low_cpu_mem_usage=True
+        ).to(self.model.device)
+        self.draft_model.eval()
+        self.draft_model.generation_config.num_assistant_tokens = self.config.num_assistant_tokens
+    
+    def _optimize_for_cpu(self):
+        """Apply thread tuning, int8 dynamic quantization and torch.compile for CPU inference."""
+        if self.config.cpu_num_threads:
+            torch.set_num_threads(self.config.cpu_num_threads)
+        if self.config.cpu_num_interop_threads:
+            try:
+                torch.set_num_interop_threads(self.config.cpu_num_interop_threads)
+            except RuntimeError:
+                # Can only be set once, before any inter-op parallel work has started
+                logger.warning("Inter-op thread count already fixed for this process, keeping it")
+        
+        if self.config.cpu_int8:
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model,
+                {torch.nn.Linear},
+                dtype=torch.qint8
+            )
+        
+        if self.config.cpu_compile:
+            self.model.forward = torch.compile(self.model.forward, dynamic=True)
+        
+        logger.info(
+            f"CPU backend: dtype={self.model.dtype}, int8={self.config.cpu_int8}, "
+            f"compile={self.config.cpu_compile}, threads={torch.get_num_threads()}"
+        )
+    
+    def warmup(self):
+        """Run a short greedy generation so the first request does not pay for lazy initialisation."""
+        prompt = self.config.arabic_prompt_template.format(instruction="ما هي أعراض الإنفلونزا؟")
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        
+        with torch.no_grad():
+            self.model.generate(
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                max_new_tokens=self.config.warmup_max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.tokenizer.pad_token_id
+            )
+    
+    def prepare_snapshot(self, output_dir=None):
+        """Save the loaded, already-quantized model and tokenizer as a local snapshot.
+        
+        Point config.local_model_dir at the result to start up offline without
+        resolving or re-quantizing the base model. CPU int8 quantization is applied
+        at load time, so on the CPU backend the float weights are saved.
+        """
+        output_dir = output_dir or self.config.local_model_dir
+        if not output_dir:
+            raise ValueError("No output directory given for the model snapshot")
+        
+        if self.model is None or self._backend() == "cpu":
+            self.load_model(optimize=False)
+        
+        logger.info(f"Saving model snapshot to {output_dir}")
+        os.makedirs(output_dir, exist_ok=True)
+        self.model.save_pretrained(output_dir, safe_serialization=True)
+        self.tokenizer.save_pretrained(output_dir)
+        
+        return output_dir
+    
+    def release(self):
+        """Drop the model weights and return cached accelerator memory."""
+        self.model = None
+        self.draft_model = None
+        self.adapters = {}
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    
     def prepare_for_training(self):
         """Prepare the model for LoRA fine-tuning."""
         if self.model is None:
-            self.load_model()
+            # LoRA needs the plain linear layers, not the CPU int8 inference ones
+            self.load_model(optimize=False)
         
         # Set target modules if not specified
         if not self.config.target_modules:
@@ -154,8 +646,11 @@ class MedLLamaArabic:
         
         return self.model
     
-    def finetune(self, train_data_path, output_dir, batch_size=4, epochs=3, learning_rate=3e-4):
-        """Fine-tune the model on Arabic medical data."""
+    def finetune(self, train_data_path, output_dir, batch_size=4, epochs=3, learning_rate=3e-4, callbacks=None):
+        """Fine-tune the model on Arabic medical data.
+        
+        callbacks are passed to the Trainer, e.g. to report progress or stop early.
+        """
         from transformers import Trainer, TrainingArguments
         
         if self.model is None:
@@ -170,7 +665,7 @@ class MedLLamaArabic:
             per_device_train_batch_size=batch_size,
             num_train_epochs=epochs,
             learning_rate=learning_rate,
-            fp16=True,
+            fp16=self._backend() == "cuda",
             logging_dir=f"{output_dir}/logs",
             logging_steps=10,
             save_strategy="epoch",
@@ -182,7 +677,8 @@ class MedLLamaArabic:
             model=self.model,
             args=training_args,
             train_dataset=dataset,
-            tokenizer=self.tokenizer
+            tokenizer=self.tokenizer,
+            callbacks=callbacks
         )
         
         # Train
@@ -196,32 +692,466 @@ class MedLLamaArabic:
         
         return self.model
     
-    def generate_response(self, question, max_new_tokens=256):
-        """Generate a response in Arabic for a medical question."""
+    def load_adapter(self, name, adapter_path):
+        """Load a LoRA adapter next to the base model so requests can select it by name."""
+        if self.model is None:
+            self.load_model()
+        
+        logger.info(f"Loading LoRA adapter '{name}' from {adapter_path}")
+        if isinstance(self.model, PeftModel):
+            self.model.load_adapter(adapter_path, adapter_name=name)
+        else:
+            self.model = PeftModel.from_pretrained(self.model, adapter_path, adapter_name=name)
+        self.model.eval()
+        self.adapters[name] = adapter_path
+    
+    def unload_adapter(self, name):
+        """Remove a previously loaded LoRA adapter."""
+        if name not in self.adapters:
+            raise KeyError(f"Unknown adapter: {name}")
+        
+        self.model.delete_adapter(name)
+        del self.adapters[name]
+        logger.info(f"Unloaded LoRA adapter '{name}'")
+    
+    @contextmanager
+    def _adapter_context(self, adapter):
+        """Activate a LoRA adapter, or the bare base model when adapter is None."""
+        if adapter is None:
+            if self.adapters:
+                with self.model.disable_adapter():
+                    yield
+            else:
+                yield
+            return
+        
+        if adapter not in self.adapters:
+            raise KeyError(f"Unknown adapter: {adapter}")
+        self.model.set_adapter(adapter)
+        yield
+    
+    def _base_model(self):
+        """Return the underlying causal LM, unwrapping the PEFT adapter model."""
+        return self.model.get_base_model() if isinstance(self.model, PeftModel) else self.model
+    
+    def _stop_criteria(self, prompt_length):
+        """Stop-sequence criteria for a generate call, or None when none are configured."""
+        if not self.config.stop_sequences:
+            return None
+        return _StopSequences(self.tokenizer, self.config.stop_sequences, prompt_length)
+    
+    def _cancel_criteria(self, cancelled):
+        """Cancellation criteria for one callable, a list of them (one per row), or None."""
+        checks = cancelled if isinstance(cancelled, (list, tuple)) else [cancelled]
+        if all(check is None for check in checks):
+            return None
+        return _Cancellation(checks)
+    
+    def decode_response(self, token_ids):
+        """Decode generated token ids, cutting the text at the first stop sequence."""
+        response = self.tokenizer.decode(token_ids, skip_special_tokens=True)
+        for stop in self.config.stop_sequences or ():
+            response = response.split(stop, 1)[0]
+        return response.strip()
+    
+    def _generation_kwargs(self, max_new_tokens, timer, stop=None, cancel=None, greedy=False):
+        """Decoding settings shared by single and batched generation; greedy decodes instead of sampling."""
+        processors = [timer]
+        if self.config.fake_token_delay:
+            processors.append(_TokenDelay(self.config.fake_token_delay))
+        sampling = dict(do_sample=False) if greedy else dict(temperature=0.7, top_p=0.9, do_sample=True)
+        return dict(
+            max_new_tokens=max_new_tokens,
+            **sampling,
+            pad_token_id=self.tokenizer.pad_token_id,
+            logits_processor=LogitsProcessorList(processors),
+            stopping_criteria=StoppingCriteriaList([criteria for criteria in (stop, cancel) if criteria is not None])
+        )
+    
+    def _report_generation(self, inputs, outputs, start, end, timer, profile=None, max_new_tokens=None, stop=None, cached_tokens=0, cancel=None):
+        """Pass token counts, stop reasons and prefill/decode timings of a generate call to the listeners."""
+        if not self.generation_listeners:
+            return
+        
+        first_step = timer.first_step_time or end
+        generated = outputs[:, inputs["input_ids"].shape[1]:]
+        stats = {
+            "input_tokens": inputs["attention_mask"].sum(dim=1).tolist(),
+            "output_tokens": (generated != self.tokenizer.pad_token_id).sum(dim=1).tolist(),
+            "prefill_seconds": first_step - start,
+            "decode_seconds": end - first_step,
+        }
+        if max_new_tokens is not None:
+            stats["max_new_tokens"] = max_new_tokens
+            stats["stop_reasons"] = [
+                "cancelled" if cancel is not None and cancel.cancelled[row]
+                else "stop_sequence" if stop is not None and stop.stopped and stop.stopped[row]
+                else "eos" if (row_tokens == self.tokenizer.eos_token_id).any()
+                else "length"
+                for row, row_tokens in enumerate(generated)
+            ]
+        if cached_tokens:
+            stats["cached_tokens"] = cached_tokens
+        if profile:
+            stats["profile"] = profile
+        
+        self._notify_generation(stats)
+    
+    def _notify_generation(self, stats):
+        for listener in self.generation_listeners:
+            try:
+                listener(stats)
+            except Exception as e:
+                logger.warning(f"Generation listener failed: {str(e)}")
+    
+    def generate_response(self, question, max_new_tokens=256, adapter=None, return_profile=False, streamer=None, cancelled=None, greedy=False):
+        """Generate a response in Arabic for a medical question.
+        
+        A transformers streamer (e.g. TextIteratorStreamer) receives tokens as they are generated.
+        cancelled is polled at every step; once it returns True generation stops
+        and the partial response is returned. greedy decodes the most likely
+        token at every step instead of sampling, e.g. while the server is overloaded.
+        
+        When profiling (config.profile or return_profile), the call is split into
+        tokenize, to_device, prefill, decode and detokenize timings, synchronising
+        CUDA at each boundary. They are kept in last_profile, passed to the
+        generation listeners, and with return_profile returned as (response, profile).
+        """
         if self.model is None:
             self.load_model()
+        
+        profiling = self.config.profile or return_profile
+        trace_dir = self.config.profile_trace_dir if profiling else None
+        
+        with self._trace(trace_dir) as trace:
+            phase_start = time.perf_counter()
             
-        # Format prompt
-        prompt = self.config.arabic_prompt_template.format(instruction=question)
+            # Tokenize the formatted prompt (cached per question)
+            inputs = self.prompt_encoder.pad([self.prompt_encoder.encode(question)])
+            tokenized = time.perf_counter()
+            inputs = inputs.to(self.model.device)
+            if profiling:
+                _synchronize()
+            
+            timer = _FirstStepTimer(synchronize=profiling)
+            stop = self._stop_criteria(inputs["input_ids"].shape[1])
+            cancel = self._cancel_criteria(cancelled)
+            generate_kwargs = dict(
+                input_ids=inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                streamer=streamer,
+                **self._generation_kwargs(max_new_tokens, timer, stop, cancel, greedy)
+            )
+            
+            # Generate
+            start = time.perf_counter()
+            with torch.no_grad(), self._adapter_context(adapter):
+                if self.draft_model is None:
+                    outputs = self.model.generate(**generate_kwargs)
+                else:
+                    outputs = self._assisted_generate(generate_kwargs)
+            if profiling:
+                _synchronize()
+            end = time.perf_counter()
+            
+            # Decode
+            response = self.decode_response(outputs[0][inputs["input_ids"].shape[1]:])
+            detokenized = time.perf_counter()
         
-        # Tokenize
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        profile = None
+        if profiling:
+            first_step = timer.first_step_time or end
+            profile = {
+                "tokenize": tokenized - phase_start,
+                "to_device": start - tokenized,
+                "prefill": first_step - start,
+                "decode": end - first_step,
+                "detokenize": detokenized - end,
+                "total": detokenized - phase_start,
+            }
+            if trace is not None:
+                profile["trace_file"] = self._export_trace(trace, trace_dir)
+            self.last_profile = profile
         
-        # Generate
-        with torch.no_grad():
+        self._report_generation(inputs, outputs, start, end, timer, profile, max_new_tokens, stop, cancel=cancel)
+        
+        return (response, profile) if return_profile else response
+    
+    def _trace(self, trace_dir):
+        """torch.profiler context for a traced call, or a no-op context."""
+        if not trace_dir:
+            return nullcontext()
+        
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        return torch.profiler.profile(activities=activities)
+    
+    def _export_trace(self, trace, trace_dir):
+        """Write a Chrome trace of a profiled call and return its path."""
+        os.makedirs(trace_dir, exist_ok=True)
+        trace_file = os.path.join(trace_dir, f"generate_{time.strftime('%Y%m%d_%H%M%S')}_{time.perf_counter_ns()}.json")
+        trace.export_chrome_trace(trace_file)
+        return trace_file
+    
+    def generate_batch(self, questions, max_new_tokens=256, adapter=None, cancelled=None, greedy=False):
+        """Generate responses for several questions as one left-padded batch.
+        
+        cancelled may hold one callable (or None) per question; a row stops once its callable returns True.
+        """
+        if self.model is None:
+            self.load_model()
+        
+        inputs = self.prompt_encoder.pad(self.prompt_encoder.encode_batch(questions)).to(self.model.device)
+        
+        prompt_length = inputs["input_ids"].shape[1]
+        timer = _FirstStepTimer()
+        stop = self._stop_criteria(prompt_length)
+        cancel = self._cancel_criteria(cancelled or [None] * len(questions))
+        start = time.perf_counter()
+        with torch.no_grad(), self._adapter_context(adapter):
             outputs = self.model.generate(
                 input_ids=inputs["input_ids"],
                 attention_mask=inputs["attention_mask"],
-                max_new_tokens=max_new_tokens,
-                temperature=0.7,
-                top_p=0.9,
-                do_sample=True,
-                pad_token_id=self.tokenizer.pad_token_id
+                **self._generation_kwargs(max_new_tokens, timer, stop, cancel, greedy)
             )
+        self._report_generation(inputs, outputs, start, time.perf_counter(), timer, max_new_tokens=max_new_tokens, stop=stop, cancel=cancel)
         
-        # Decode and return
-        response = self.tokenizer.decode(outputs[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True)
-        return response.strip()
+        return [self.decode_response(output[prompt_length:]) for output in outputs]
+    
+    def count_prompt_tokens(self, question):
+        """Number of tokens in the formatted prompt for a question."""
+        return len(self.prompt_encoder.encode(question))
+    
+    def generate_chunk(self, question, generated_ids, max_new_tokens, adapter=None, cancelled=None, request_max_new_tokens=None, greedy=False):
+        """Continue a response by at most max_new_tokens tokens.
+        
+        Lets a scheduler generate long responses a chunk at a time; the prompt
+        and the tokens generated so far are prefilled again for every chunk.
+        With request_max_new_tokens, the token limit of the whole response, the
+        chunk that finishes it reports the stop reason and the unused tokens of
+        the request, once, to the generation listeners.
+        
+        Returns:
+            (generated_ids, finished): all response tokens so far, and whether
+            the model has ended the response
+        """
+        if self.model is None:
+            self.load_model()
+        
+        prompt_ids = self.prompt_encoder.encode(question)
+        input_ids = torch.tensor([prompt_ids + list(generated_ids)], device=self.model.device)
+        inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+        timer = _FirstStepTimer()
+        # Scanning from the end of the prompt catches stop sequences split across chunks
+        stop = self._stop_criteria(len(prompt_ids))
+        cancel = self._cancel_criteria(cancelled)
+        generate_kwargs = dict(**inputs, **self._generation_kwargs(max_new_tokens, timer, stop, cancel, greedy))
+        
+        start = time.perf_counter()
+        with torch.no_grad(), self._adapter_context(adapter):
+            if self.draft_model is None:
+                outputs = self.model.generate(**generate_kwargs)
+            else:
+                outputs = self._assisted_generate(generate_kwargs)
+        end = time.perf_counter()
+        
+        new_ids = outputs[0, input_ids.shape[1]:].tolist()
+        eos_token_id = self.tokenizer.eos_token_id
+        finished = eos_token_id in new_ids or len(new_ids) < max_new_tokens or bool(stop is not None and stop.stopped and stop.stopped[0])
+        
+        if request_max_new_tokens is not None and (finished or len(generated_ids) + len(new_ids) >= request_max_new_tokens):
+            # Measured against what the request had left, so the tokens saved are the request's
+            remaining = request_max_new_tokens - len(generated_ids)
+            self._report_generation(inputs, outputs, start, end, timer, max_new_tokens=remaining, stop=stop, cancel=cancel)
+        else:
+            self._report_generation(inputs, outputs, start, end, timer)
+        
+        if eos_token_id in new_ids:
+            new_ids = new_ids[:new_ids.index(eos_token_id)]
+        
+        return list(generated_ids) + new_ids, finished
+    
+    def generate_session_turn(self, session, question, max_new_tokens=256, adapter=None, cancelled=None, greedy=False):
+        """Answer the next message of a conversation, reusing its KV cache.
+        
+        session holds the dialogue's token ids and past_key_values (see
+        session_store.Session) and is updated in place. Only the new message
+        is prefilled; the rest of the dialogue comes from the cache. A session
+        that would grow beyond config.session_max_tokens starts over.
+        """
+        if self.model is None:
+            self.load_model()
+        
+        if session.token_ids:
+            turn = self.config.session_turn_template.format(instruction=question)
+            turn_ids = self.tokenizer(turn, add_special_tokens=False)["input_ids"]
+        if not session.token_ids or len(session.token_ids) + len(turn_ids) + max_new_tokens > self.config.session_max_tokens:
+            session.token_ids, session.past_key_values = [], None
+            turn_ids = self.prompt_encoder.encode(question)
+        
+        input_ids = torch.tensor([session.token_ids + turn_ids], device=self.model.device)
+        inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+        cached_tokens = session.past_key_values.get_seq_length() if session.past_key_values is not None else 0
+        timer = _FirstStepTimer()
+        stop = self._stop_criteria(input_ids.shape[1])
+        cancel = self._cancel_criteria(cancelled)
+        
+        start = time.perf_counter()
+        with torch.no_grad(), self._adapter_context(adapter):
+            outputs = self.model.generate(
+                **inputs,
+                past_key_values=session.past_key_values,
+                return_dict_in_generate=True,
+                **self._generation_kwargs(max_new_tokens, timer, stop, cancel, greedy)
+            )
+        self._report_generation(
+            inputs, outputs.sequences, start, time.perf_counter(), timer,
+            max_new_tokens=max_new_tokens, stop=stop, cached_tokens=cached_tokens, cancel=cancel
+        )
+        
+        session.token_ids = outputs.sequences[0].tolist()
+        session.past_key_values = outputs.past_key_values
+        session.turns += 1
+        return self.decode_response(outputs.sequences[0, input_ids.shape[1]:])
+    
+    def kv_cache_spec(self):
+        """Shape of the model's KV cache: (num_layers, num_kv_heads, head_dim, dtype, device).
+        
+        Raises:
+            ValueError: If the model is not a transformers decoder (e.g. the "stub" fake model)
+        """
+        if self.model is None:
+            self.load_model()
+        
+        model_config = getattr(self._base_model(), "config", None)
+        if model_config is None:
+            raise ValueError("A paged KV cache needs a transformers decoder model")
+        
+        num_heads = model_config.num_attention_heads
+        head_dim = getattr(model_config, "head_dim", None) or model_config.hidden_size // num_heads
+        num_kv_heads = getattr(model_config, "num_key_value_heads", None) or num_heads
+        # Dynamically quantized linear layers still compute in the embedding dtype
+        dtype = self._base_model().get_input_embeddings().weight.dtype
+        return model_config.num_hidden_layers, num_kv_heads, head_dim, dtype, self.model.device
+    
+    def paged_forward(self, cache, seq_ids, token_ids, adapter=None):
+        """Run the next tokens of several sequences on a paged KV cache (see paged_kv.PagedKVCache).
+        
+        Every sequence adds the same number of tokens: its whole prompt when
+        prefilling a single sequence, or one token per sequence when decoding.
+        
+        Returns:
+            Next-token logits, one row per sequence
+        """
+        position_ids, attention_mask = cache.begin_step(seq_ids, len(token_ids[0]))
+        input_ids = torch.tensor(token_ids, device=self.model.device)
+        with torch.no_grad(), self._adapter_context(adapter):
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=cache,
+                use_cache=True,
+                logits_to_keep=1
+            )
+        return outputs.logits[:, -1, :]
+    
+    def sample_next_tokens(self, logits, greedy=False):
+        """Sample one token per row with the same settings as generate_response.
+        
+        greedy is one flag for all rows or a list with one per row; greedy rows
+        take the most likely token instead of sampling.
+        """
+        if self.config.fake_token_delay:
+            time.sleep(self.config.fake_token_delay)
+        rows = list(greedy) if isinstance(greedy, (list, tuple)) else [greedy] * logits.shape[0]
+        if all(rows):
+            return logits.argmax(dim=-1).tolist()
+        scores = TemperatureLogitsWarper(0.7)(None, logits.float())
+        scores = TopPLogitsWarper(0.9)(None, scores)
+        tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+        if any(rows):
+            tokens = torch.where(torch.tensor(rows, device=tokens.device), logits.argmax(dim=-1), tokens)
+        return tokens.tolist()
+    
+    def stop_checker(self):
+        """Callable telling whether a growing list of response token ids has reached a stop sequence."""
+        stop = self._stop_criteria(0)
+        if stop is None:
+            return lambda token_ids: False
+        return lambda token_ids: bool(stop(torch.tensor([token_ids]), None)[0])
+    
+    def report_paged_generation(self, prompt_tokens, output_tokens, prefill_seconds, decode_seconds, max_new_tokens, stop_reason):
+        """Pass the stats of one request generated on a paged KV cache to the listeners."""
+        if not self.generation_listeners:
+            return
+        
+        self._notify_generation({
+            "input_tokens": [prompt_tokens],
+            "output_tokens": [output_tokens],
+            "prefill_seconds": prefill_seconds,
+            "decode_seconds": decode_seconds,
+            "max_new_tokens": max_new_tokens,
+            "stop_reasons": [stop_reason],
+        })
+    
+    def _assisted_generate(self, generate_kwargs):
+        """Generate with the draft model proposing tokens and record how many were accepted.
+        
+        The counts come from transformers' candidate generator: get_candidates()
+        returns each round's proposals and update_candidate_strategy() receives
+        how many of them the target model accepted.
+        """
+        counts = {"target_forwards": 0, "draft_tokens": 0, "accepted_tokens": 0}
+        target = self._base_model()
+        get_candidate_generator = target._get_candidate_generator
+        
+        def counting_candidate_generator(*args, **kwargs):
+            candidate_generator = get_candidate_generator(*args, **kwargs)
+            get_candidates = candidate_generator.get_candidates
+            update_candidate_strategy = candidate_generator.update_candidate_strategy
+            
+            def counted_get_candidates(input_ids, *rest, **options):
+                candidate_ids, candidate_logits = get_candidates(input_ids, *rest, **options)
+                counts["draft_tokens"] += candidate_ids.shape[1] - input_ids.shape[1]
+                return candidate_ids, candidate_logits
+            
+            def counted_update_candidate_strategy(input_ids, scores, num_matches):
+                counts["accepted_tokens"] += int(num_matches)
+                return update_candidate_strategy(input_ids, scores, num_matches)
+            
+            candidate_generator.get_candidates = counted_get_candidates
+            candidate_generator.update_candidate_strategy = counted_update_candidate_strategy
+            return candidate_generator
+        
+        def count_target_forward(module, args, output):
+            counts["target_forwards"] += 1
+        
+        target._get_candidate_generator = counting_candidate_generator
+        handle = target.register_forward_hook(count_target_forward)
+        try:
+            outputs = self.model.generate(assistant_model=self.draft_model, **generate_kwargs)
+        finally:
+            handle.remove()
+            del target._get_candidate_generator
+        
+        stats = self.speculative_stats
+        stats["calls"] += 1
+        stats["generated_tokens"] += outputs.shape[1] - generate_kwargs["input_ids"].shape[1]
+        for name, count in counts.items():
+            stats[name] += count
+        
+        return outputs
+    
+    def speculative_metrics(self):
+        """Summarise assisted generation since the model was loaded."""
+        stats = self.speculative_stats
+        return {
+            **stats,
+            "acceptance_rate": stats["accepted_tokens"] / stats["draft_tokens"] if stats["draft_tokens"] else 0.0,
+            "tokens_per_target_forward": stats["generated_tokens"] / stats["target_forwards"] if stats["target_forwards"] else 0.0,
+        }
     
     def process_batch(self, data_dir, output_file):
         """Process a batch of medical queries from files."""
@@ -293,5 +1223,19 @@ def create_sample_dataset(output_path, n_samples=50):
     return sample_data
 
 if __name__ == "__main__":
-    # Example usage
-    print("MedLLama Arabic module. Import to use in your application.")
+    parser = argparse.ArgumentParser(description="MedLLama Arabic model utilities")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    prepare_parser = subparsers.add_parser("prepare", help="Save a quantized local snapshot for fast offline startup")
+    prepare_parser.add_argument("--base_model", type=str, default=MedLLamaConfig.base_model, help="Base model to snapshot")
+    prepare_parser.add_argument("--output_dir", type=str, required=True, help="Directory to write the snapshot to")
+    prepare_parser.add_argument("--no_4bit", action="store_true", help="Save full-precision weights instead of 4-bit")
+    
+    args = parser.parse_args()
+    
+    if args.command == "prepare":
+        config = MedLLamaConfig(base_model=args.base_model, use_4bit=not args.no_4bit)
+        MedLLamaArabic(config).prepare_snapshot(args.output_dir)
+    else:
+        print("MedLLama Arabic module. Import to use in your application.")
+
@@ -0,0 +1,200 @@
+import time
+import bisect
+import threading
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+THROUGHPUT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, values)) + "}"
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time."""
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.callback()
+        except Exception:
+            value = None
+        if value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels + ("le",), label_values + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class TimedLock:
+    """Wraps a lock and reports how long each acquisition waited."""
+
+    def __init__(self, lock, on_wait):
+        self._lock = lock
+        self._on_wait = on_wait
+
+    def __enter__(self):
+        wait_start = time.perf_counter()
+        self._lock.acquire()
+        self._on_wait(time.perf_counter() - wait_start)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._lock.release()
+
+class MedLLamaMetrics:
+    """Metrics for the MedLLama API, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.requests = Counter("medllama_requests_total", "Requests handled, by endpoint and HTTP status.", ("endpoint", "status"))
+        self.request_seconds = Histogram("medllama_request_duration_seconds", "End-to-end request latency.", LATENCY_BUCKETS, ("endpoint",))
+        self.lock_wait_seconds = Histogram("medllama_lock_wait_seconds", "Time spent waiting for the model lock.", LATENCY_BUCKETS)
+        self.prefill_seconds = Histogram("medllama_prefill_seconds", "Time from generate() start to the first token (prompt processing).", LATENCY_BUCKETS)
+        self.decode_seconds = Histogram("medllama_decode_seconds", "Time spent decoding after the first token.", LATENCY_BUCKETS)
+        self.decode_tokens_per_second = Histogram("medllama_decode_tokens_per_second", "Generated tokens per second of decode time, per model call.", THROUGHPUT_BUCKETS)
+        self.input_tokens = Histogram("medllama_input_tokens", "Prompt length in tokens, per sequence.", TOKEN_BUCKETS)
+        self.output_tokens = Histogram("medllama_output_tokens", "Generated tokens, per sequence.", TOKEN_BUCKETS)
+        self.generated_tokens = Counter("medllama_generated_tokens_total", "Tokens generated across all sequences.")
+        self.phase_seconds = Histogram("medllama_generation_phase_seconds", "Per-phase time of profiled generate calls.", LATENCY_BUCKETS, ("phase",))
+        self.batch_size = Histogram("medllama_batch_size", "Sequences per model call.", (1, 2, 4, 8, 16, 32, 64))
+        self.stops = Counter("medllama_generation_stops_total", "Finished sequences, by why generation stopped.", ("reason",))
+        self.cancelled = Counter("medllama_cancelled_requests_total", "Requests dropped after their deadline or client disconnect, by reason and stage.", ("reason", "stage"))
+        self.cancelled_tokens_saved = Counter("medllama_cancelled_tokens_saved_total", "max_new_tokens not generated because the request was cancelled.")
+        self.tokens_saved = Histogram("medllama_tokens_saved", "Unused max_new_tokens of sequences stopped by EOS or a stop sequence.", TOKEN_BUCKETS)
+        self.session_cached_tokens = Counter("medllama_session_cached_tokens_total", "Dialogue tokens reused from a session's KV cache instead of being prefilled.")
+        self.session_evictions = Counter("medllama_session_evictions_total", "Sessions dropped from the store, by reason.", ("reason",))
+        self.coalesced = Counter("medllama_coalesced_requests_total", "Requests answered by an identical request already in flight.")
+        self.degraded_requests = Counter("medllama_degraded_requests_total", "Requests shortened, decoded greedily or refused under load, by level.", ("level",))
+        self.kv_preemptions = Counter("medllama_kv_preemptions_total", "Requests preempted because the paged KV cache was full.")
+        self.cache_lookups = Counter("medllama_cache_lookups_total", "Cache lookups, by cache and hit/miss.", ("cache", "result"))
+        self.response_cache_evictions = Counter("medllama_response_cache_evictions_total", "Answers dropped from the response cache, by reason.", ("reason",))
+        self._gauges = []
+
+    def add_gauge(self, name, documentation, callback):
+        """Register a gauge read from callback() at scrape time."""
+        self._gauges.append(Gauge(name, documentation, callback))
+
+    def observe_request(self, endpoint, status, seconds):
+        self.requests.inc(endpoint, status)
+        self.request_seconds.observe(seconds, endpoint)
+
+    def observe_lock_wait(self, seconds):
+        self.lock_wait_seconds.observe(seconds)
+
+    def record_cache(self, cache, hit):
+        self.cache_lookups.inc(cache, "hit" if hit else "miss")
+
+    def record_cancel(self, reason, stage, tokens_saved=0):
+        """Record a cancelled request and the tokens saved that the model did not report."""
+        self.cancelled.inc(reason, stage)
+        self.cancelled_tokens_saved.inc(amount=tokens_saved)
+
+    def record_generation(self, stats):
+        """Record the stats MedLLamaArabic reports after every generate call."""
+        self.batch_size.observe(len(stats["input_tokens"]))
+        self.prefill_seconds.observe(stats["prefill_seconds"])
+        self.decode_seconds.observe(stats["decode_seconds"])
+
+        generated = sum(stats["output_tokens"])
+        self.generated_tokens.inc(amount=generated)
+        if stats["decode_seconds"] > 0:
+            self.decode_tokens_per_second.observe(generated / stats["decode_seconds"])
+
+        for count in stats["input_tokens"]:
+            self.input_tokens.observe(count)
+        for count in stats["output_tokens"]:
+            self.output_tokens.observe(count)
+
+        for reason, count in zip(stats.get("stop_reasons", ()), stats["output_tokens"]):
+            self.stops.inc(reason)
+            if reason == "cancelled":
+                self.cancelled_tokens_saved.inc(amount=max(stats["max_new_tokens"] - count, 0))
+            elif reason != "length":
+                self.tokens_saved.observe(max(stats["max_new_tokens"] - count, 0))
+
+        self.session_cached_tokens.inc(amount=stats.get("cached_tokens", 0))
+
+        for phase, seconds in stats.get("profile", {}).items():
+            if phase not in ("total", "trace_file"):
+                self.phase_seconds.observe(seconds, phase)
+
+    def render(self):
+        families = [
+            self.requests, self.request_seconds, self.lock_wait_seconds,
+            self.prefill_seconds, self.decode_seconds, self.decode_tokens_per_second,
+            self.input_tokens, self.output_tokens, self.generated_tokens,
+            self.phase_seconds, self.batch_size, self.stops, self.tokens_saved,
+            self.cancelled, self.cancelled_tokens_saved,
+            self.session_cached_tokens, self.session_evictions,
+            self.coalesced, self.degraded_requests, self.kv_preemptions,
+            self.cache_lookups, self.response_cache_evictions, *self._gauges,
+        ]
+        lines = []
+        for family in families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
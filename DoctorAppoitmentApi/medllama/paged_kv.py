@@ -0,0 +1,182 @@
+import threading
+import torch
+
+class OutOfBlocks(RuntimeError):
+    """Raised when the KV-cache pool has no free blocks left for a sequence."""
+
+class BlockAllocator:
+    """Hands out fixed-size KV-cache blocks to sequences.
+
+    A sequence owns a list of blocks (its block table) that grows one block
+    at a time as it gets longer, so it never holds more than block_size - 1
+    unused slots; the blocks of a finished sequence go straight back to the
+    free list and can be reused by any other sequence.
+    """
+
+    def __init__(self, num_blocks, block_size=16):
+        """
+        Initialize the allocator.
+
+        Args:
+            num_blocks: Number of blocks in the pool
+            block_size: Tokens per block
+        """
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self._free = list(range(num_blocks - 1, -1, -1))
+        self._tables = {}
+        self._lengths = {}
+        self._lock = threading.Lock()
+
+    def blocks_for(self, num_tokens):
+        return -(-num_tokens // self.block_size)
+
+    def free_count(self):
+        with self._lock:
+            return len(self._free)
+
+    def can_allocate(self, num_tokens, seq_id=None):
+        """Whether a sequence (new, or seq_id) could grow to num_tokens now."""
+        with self._lock:
+            held = len(self._tables.get(seq_id, ()))
+            return self.blocks_for(num_tokens) - held <= len(self._free)
+
+    def reserve(self, seq_id, num_tokens):
+        """Grow a sequence to num_tokens tokens, taking new blocks as needed.
+
+        Raises:
+            OutOfBlocks: If the pool does not have enough free blocks
+        """
+        with self._lock:
+            table = self._tables.setdefault(seq_id, [])
+            needed = self.blocks_for(num_tokens) - len(table)
+            if needed > len(self._free):
+                if not table:
+                    del self._tables[seq_id]
+                raise OutOfBlocks(f"Sequence needs {needed} more blocks, {len(self._free)} are free")
+            for _ in range(needed):
+                table.append(self._free.pop())
+            self._lengths[seq_id] = max(num_tokens, self._lengths.get(seq_id, 0))
+
+    def free(self, seq_id):
+        """Return all blocks of a sequence to the pool."""
+        with self._lock:
+            self._free.extend(reversed(self._tables.pop(seq_id, [])))
+            self._lengths.pop(seq_id, None)
+
+    def length(self, seq_id):
+        with self._lock:
+            return self._lengths.get(seq_id, 0)
+
+    def slots(self, seq_id, start, end):
+        """Flat pool slot indices of the tokens start..end-1 of a sequence."""
+        with self._lock:
+            table = self._tables[seq_id]
+        positions = range(start, end)
+        return [table[position // self.block_size] * self.block_size + position % self.block_size for position in positions]
+
+    def stats(self):
+        """Block usage, and how much of the used blocks actually holds tokens.
+
+        utilization is stored tokens / slots of the used blocks; fragmentation
+        is the rest, i.e. slots reserved at the end of each sequence's last
+        block that hold nothing yet.
+        """
+        with self._lock:
+            used_blocks = self.num_blocks - len(self._free)
+            used_tokens = sum(self._lengths.values())
+            sequences = len(self._tables)
+        utilization = used_tokens / (used_blocks * self.block_size) if used_blocks else 1.0
+        return {
+            "total_blocks": self.num_blocks,
+            "used_blocks": used_blocks,
+            "block_size": self.block_size,
+            "used_tokens": used_tokens,
+            "sequences": sequences,
+            "occupancy": used_blocks / self.num_blocks if self.num_blocks else 0.0,
+            "utilization": utilization,
+            "fragmentation": 1.0 - utilization,
+        }
+
+class PagedKVCache:
+    """KV cache stored in a shared pool of blocks instead of one tensor per batch.
+
+    Used as past_key_values of a transformers decoder. Before each forward,
+    begin_step() reserves slots for the new tokens of every sequence in the
+    batch; the attention layers then write their keys and values into those
+    slots and read each sequence's own slots back, padded only to the longest
+    sequence of that step. The pool itself is never padded, so sequences of
+    any length can join and leave between steps.
+
+    It is not a transformers Cache subclass: it implements the two methods a
+    decoder's forward calls on past_key_values, update() and get_seq_length().
+    It relies on the forward passing a custom 4D attention_mask through
+    create_causal_mask unchanged and on its logits_to_keep argument, as in
+    transformers 4.57 (the version requirements.txt asks for).
+    """
+
+    def __init__(self, allocator, num_layers, num_kv_heads, head_dim, dtype=torch.float32, device="cpu"):
+        self.allocator = allocator
+        num_slots = allocator.num_blocks * allocator.block_size
+        self.keys = [torch.zeros(num_slots, num_kv_heads, head_dim, dtype=dtype, device=device) for _ in range(num_layers)]
+        self.values = [torch.zeros(num_slots, num_kv_heads, head_dim, dtype=dtype, device=device) for _ in range(num_layers)]
+        self.dtype = dtype
+        self.device = device
+        self._write_slots = None
+        self._read_slots = None
+        self._past_length = 0
+
+    @property
+    def block_nbytes(self):
+        """Memory of one block across all layers, keys and values."""
+        slot = self.keys[0][0]
+        return 2 * len(self.keys) * slot.numel() * slot.element_size() * self.allocator.block_size
+
+    def nbytes(self):
+        return self.block_nbytes * self.allocator.num_blocks
+
+    def begin_step(self, seq_ids, num_new_tokens):
+        """Reserve slots for num_new_tokens more tokens of every sequence.
+
+        Returns:
+            (position_ids, attention_mask): positions of the new tokens, and the
+            additive 4D mask letting each one attend to its own sequence only
+        """
+        lengths = [self.allocator.length(seq_id) for seq_id in seq_ids]
+        for seq_id, length in zip(seq_ids, lengths):
+            self.allocator.reserve(seq_id, length + num_new_tokens)
+
+        total = max(lengths) + num_new_tokens
+        write_slots, read_slots = [], []
+        for seq_id, length in zip(seq_ids, lengths):
+            slots = self.allocator.slots(seq_id, 0, length + num_new_tokens)
+            write_slots.append(slots[length:])
+            # Padding reads slot 0 and is masked out
+            read_slots.append(slots + [0] * (total - len(slots)))
+        self._write_slots = torch.tensor(write_slots, device=self.device).reshape(-1)
+        self._read_slots = torch.tensor(read_slots, device=self.device)
+        self._past_length = total - num_new_tokens
+
+        starts = torch.tensor(lengths, device=self.device).unsqueeze(1)
+        position_ids = starts + torch.arange(num_new_tokens, device=self.device)
+        key_positions = torch.arange(total, device=self.device)
+        allowed = key_positions[None, None, :] <= position_ids[:, :, None]
+        attention_mask = torch.zeros(allowed.shape, dtype=self.dtype, device=self.device)
+        attention_mask.masked_fill_(~allowed, torch.finfo(self.dtype).min)
+        return position_ids, attention_mask.unsqueeze(1)
+
+    def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+        """Store the step's keys and values and return every sequence's full keys and values."""
+        batch_size, num_heads, num_new, head_dim = key_states.shape
+        keys, values = self.keys[layer_idx], self.values[layer_idx]
+        keys[self._write_slots] = key_states.transpose(1, 2).reshape(-1, num_heads, head_dim).to(self.dtype)
+        values[self._write_slots] = value_states.transpose(1, 2).reshape(-1, num_heads, head_dim).to(self.dtype)
+        return keys[self._read_slots].transpose(1, 2), values[self._read_slots].transpose(1, 2)
+
+    def get_seq_length(self, layer_idx=0):
+        """Tokens before the current step in the keys update() returns, i.e. the longest sequence's.
+
+        The forward derives cache_position from it; shorter sequences' padding
+        is masked out by the attention mask of begin_step().
+        """
+        return self._past_length
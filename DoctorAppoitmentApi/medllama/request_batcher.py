@@ -0,0 +1,540 @@
+import time
+import logging
+import weakref
+import threading
+from concurrent.futures import Future
+
+from paged_kv import BlockAllocator, PagedKVCache
+
+logger = logging.getLogger(__name__)
+
+# Scheduling classes: interactive requests are always served before batch jobs
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Seconds between checks of a client's connection
+DISCONNECT_PROBE_INTERVAL = 0.1
+
+class TokenBudgetExceeded(RuntimeError):
+    """Raised when the scheduler has no token budget left for a request right now."""
+
+class RequestCancelled(RuntimeError):
+    """Raised for a request whose deadline passed or whose client disconnected before it was answered."""
+
+    def __init__(self, reason):
+        super().__init__(f"Request cancelled ({reason})")
+        self.reason = reason
+
+class Deadline:
+    """Tells when a request is no longer worth generating for.
+
+    A request expires when its timeout passes or when its client disconnects.
+    Requests answered by one shared generation attach their deadlines to the
+    first one, which then only expires once all of them have.
+    """
+
+    def __init__(self, timeout=None, disconnected=None):
+        """
+        Initialize the deadline.
+
+        Args:
+            timeout: Seconds from now, or None for no time limit
+            disconnected: Callable returning True once the client has gone away
+        """
+        self.expires_at = time.monotonic() + timeout if timeout else None
+        self.disconnected = disconnected
+        self.reason = None
+        self._attached = []
+        self._last_probe = 0.0
+
+    def attach(self, other):
+        self._attached.append(other)
+
+    def cancel(self, reason="disconnect"):
+        """Expire now, e.g. when the server finds the client gone while writing to it."""
+        if self.reason is None:
+            self.reason = reason
+
+    def remaining(self):
+        """Seconds left, or None when there is no time limit."""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self._check() is not None and all(other.expired() for other in self._attached)
+
+    def _check(self):
+        """This request's own reason for expiring, if it has one yet."""
+        if self.reason is None:
+            now = time.monotonic()
+            if self.expires_at is not None and now >= self.expires_at:
+                self.reason = "deadline"
+            elif self.disconnected is not None and now - self._last_probe >= DISCONNECT_PROBE_INTERVAL:
+                self._last_probe = now
+                if self.disconnected():
+                    self.reason = "disconnect"
+        return self.reason
+
+class _Request:
+    """A queued generation request and its token cost (prompt + max_new_tokens)."""
+
+    def __init__(self, question, max_new_tokens, adapter, priority, cost, deadline=None, greedy=False):
+        self.question = question
+        self.max_new_tokens = max_new_tokens
+        self.adapter = adapter
+        # Decoding mode chosen when the request arrived, e.g. greedy under load
+        self.greedy = greedy
+        self.priority = priority
+        self.cost = cost
+        self.deadline = deadline
+        self.future = Future()
+        # Response tokens generated so far by a chunked or paged request
+        self.generated_ids = []
+        # State of a request running on the paged KV cache
+        self.stop_check = None
+        self.prefill_seconds = 0.0
+        self.decode_start = None
+
+    @property
+    def key(self):
+        return (self.adapter, self.max_new_tokens, self.greedy)
+
+    def expired(self):
+        return self.deadline is not None and self.deadline.expired()
+
+    def cancel_check(self):
+        """Callable for the model to poll during generation, or None without a deadline."""
+        return self.deadline.expired if self.deadline is not None else None
+
+class RequestBatcher:
+    """Token-budgeted scheduler that batches concurrent generation requests.
+
+    Every request is costed as prompt tokens + max_new_tokens. A request may
+    not exceed max_request_tokens (max_new_tokens is reduced to fit), and all
+    queued and running requests together may not exceed max_pending_tokens;
+    batch jobs only get batch_budget_fraction of it, so interactive requests
+    always find room.
+
+    Requests may carry a Deadline. Expired requests are dropped from the queue
+    without generating, and generation stops as soon as every request of a
+    batch has expired; either way the request fails with RequestCancelled.
+
+    A single worker thread takes the oldest interactive request (or, when none
+    is waiting, the oldest batch job), waits up to max_wait_ms for more
+    requests with the same adapter, max_new_tokens and decoding mode (greedy
+    or sampled), and runs them as one batch under the model lock. Requests
+    asking for more than chunk_tokens new tokens are generated chunk_tokens at
+    a time and go back to the end of the queue between chunks, so a long
+    request never holds the model for long.
+    """
+
+    def __init__(self, get_model, model_lock, max_batch_size=8, max_wait_ms=10,
+                 max_request_tokens=2048, max_pending_tokens=16384, batch_budget_fraction=0.5, chunk_tokens=512,
+                 on_cancel=None):
+        """
+        Initialize the batcher.
+
+        Args:
+            get_model: Callable returning the current MedLLamaArabic instance (or None)
+            model_lock: Lock serialising access to the model
+            max_batch_size: Maximum number of requests generated together
+            max_wait_ms: How long to hold the oldest request while a batch fills up
+            max_request_tokens: Token budget of a single request
+            max_pending_tokens: Token budget of all queued and running requests
+            batch_budget_fraction: Share of max_pending_tokens batch jobs may use
+            chunk_tokens: New tokens generated per turn for longer requests; keep it
+                above the endpoints' default max_new_tokens (256), or every default
+                request is generated on its own instead of batched
+            on_cancel: Called with (reason, stage, tokens_saved) for every cancelled
+                request; stage is "queued" or "generating", and tokens_saved counts
+                the tokens not generated that the model does not report itself
+        """
+        self.get_model = get_model
+        self.model_lock = model_lock
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_request_tokens = max_request_tokens
+        self.max_pending_tokens = max_pending_tokens
+        self.batch_budget_fraction = batch_budget_fraction
+        self.chunk_tokens = chunk_tokens
+        self.on_cancel = on_cancel
+
+        self._pending = []
+        self._scheduled_tokens = {INTERACTIVE: 0, BATCH: 0}
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name="request-batcher", daemon=True)
+        self._worker.start()
+
+    def fit_request(self, question, max_new_tokens):
+        """Apply the per-request budget and return (prompt_tokens, max_new_tokens).
+
+        Raises:
+            ValueError: If the prompt alone does not fit the budget
+        """
+        model = self.get_model()
+        prompt_tokens = model.count_prompt_tokens(question) if model is not None else 0
+        if prompt_tokens >= self.max_request_tokens:
+            raise ValueError(f"Prompt is {prompt_tokens} tokens, the limit per request is {self.max_request_tokens}")
+        return prompt_tokens, min(max_new_tokens, self.max_request_tokens - prompt_tokens)
+
+    def submit(self, question, max_new_tokens=256, adapter=None, priority=INTERACTIVE, deadline=None, greedy=False):
+        """Queue a question and return a Future resolving to the generated response."""
+        return self.submit_many([question], max_new_tokens, adapter, priority, deadline, greedy)[0]
+
+    def submit_many(self, questions, max_new_tokens=256, adapter=None, priority=INTERACTIVE, deadline=None, greedy=False):
+        """Queue several questions, reserving their token budget all at once.
+
+        With greedy they are decoded greedily instead of sampled.
+
+        Raises:
+            ValueError: If a question, or all of them together, can never fit the budget
+            TokenBudgetExceeded: If the budget is currently in use by other requests
+        """
+        items = []
+        for question in questions:
+            prompt_tokens, fitted_tokens = self.fit_request(question, max_new_tokens)
+            items.append(_Request(question, fitted_tokens, adapter, priority, prompt_tokens + fitted_tokens, deadline, greedy))
+        cost = sum(item.cost for item in items)
+
+        budget = self.max_pending_tokens
+        if priority == BATCH:
+            budget = int(budget * self.batch_budget_fraction)
+        if cost > budget:
+            raise ValueError(f"Requests need {cost} tokens, the {priority} budget is {budget}")
+
+        with self._condition:
+            total = sum(self._scheduled_tokens.values())
+            if total + cost > self.max_pending_tokens or self._scheduled_tokens[priority] + cost > budget:
+                raise TokenBudgetExceeded(f"Token budget exhausted ({total} of {self.max_pending_tokens} scheduled)")
+
+            self._scheduled_tokens[priority] += cost
+            self._pending.extend(items)
+            self._condition.notify()
+
+        return [item.future for item in items]
+
+    def pending_count(self):
+        """Number of requests waiting to be batched."""
+        with self._condition:
+            return len(self._pending)
+
+    def scheduled_tokens(self):
+        """Token cost of all queued and running requests."""
+        with self._condition:
+            return sum(self._scheduled_tokens.values())
+
+    def kv_stats(self):
+        """KV-cache block usage, or None when requests are not generated on a paged cache."""
+        return None
+
+    def _is_long(self, item):
+        return item.max_new_tokens > self.chunk_tokens
+
+    def _head(self):
+        """The oldest interactive request, else the oldest batch job."""
+        for item in self._pending:
+            if item.priority == INTERACTIVE:
+                return item
+        return self._pending[0]
+
+    def _next_batch(self):
+        """Block until a batch is ready and remove it from the pending list."""
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+
+            head = self._head()
+            if self._is_long(head):
+                self._pending.remove(head)
+                return [head]
+
+            deadline = time.monotonic() + self.max_wait
+            while True:
+                candidates = [item for item in self._pending if item.key == head.key and not self._is_long(item)]
+                candidates.sort(key=lambda item: item.priority != INTERACTIVE)
+                batch = candidates[:self.max_batch_size]
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            taken = {id(item) for item in batch}
+            self._pending = [item for item in self._pending if id(item) not in taken]
+
+        return batch
+
+    def _cancel(self, item, stage, tokens_saved):
+        """Fail an expired request and report how many tokens were not generated for it."""
+        reason = item.deadline.reason or "deadline"
+        if self.on_cancel is not None:
+            self.on_cancel(reason, stage, max(tokens_saved, 0))
+        self._finish(item, error=RequestCancelled(reason))
+
+    def _finish(self, item, response=None, error=None):
+        with self._condition:
+            self._scheduled_tokens[item.priority] -= item.cost
+        if error is not None:
+            item.future.set_exception(error)
+        else:
+            item.future.set_result(response)
+
+    def _run_chunk(self, model, item):
+        """Generate the next chunk of a long request; return the response once it is complete."""
+        remaining = item.max_new_tokens - len(item.generated_ids)
+        item.generated_ids, finished = model.generate_chunk(
+            item.question, item.generated_ids, min(self.chunk_tokens, remaining), adapter=item.adapter, cancelled=item.cancel_check(),
+            request_max_new_tokens=item.max_new_tokens, greedy=item.greedy
+        )
+        if item.expired():
+            # A chunk cut short by the cancellation was reported by the model, unused tokens included
+            self._cancel(item, "generating", 0 if finished else item.max_new_tokens - len(item.generated_ids))
+            return None
+        if finished or len(item.generated_ids) >= item.max_new_tokens:
+            return model.decode_response(item.generated_ids)
+        return None
+
+    def _drop_expired(self, batch):
+        """Cancel the expired requests of a batch before generating and return the rest."""
+        live = []
+        for item in batch:
+            if item.expired():
+                self._cancel(item, "queued", item.max_new_tokens - len(item.generated_ids))
+            else:
+                live.append(item)
+        return live
+
+    def _run(self):
+        while True:
+            batch = self._drop_expired(self._next_batch())
+            if not batch:
+                continue
+            questions = [item.question for item in batch]
+            adapter, max_new_tokens, greedy = batch[0].key
+            checks = [item.cancel_check() for item in batch]
+
+            try:
+                with self.model_lock:
+                    model = self.get_model()
+                    if model is None:
+                        raise RuntimeError("Model is not loaded")
+
+                    if self._is_long(batch[0]):
+                        responses = [self._run_chunk(model, batch[0])]
+                    elif len(questions) == 1:
+                        responses = [model.generate_response(
+                            questions[0], max_new_tokens=max_new_tokens, adapter=adapter, cancelled=checks[0], greedy=greedy
+                        )]
+                    else:
+                        responses = model.generate_batch(questions, max_new_tokens=max_new_tokens, adapter=adapter, cancelled=checks, greedy=greedy)
+            except Exception as e:
+                logger.error(f"Error generating batch: {str(e)}")
+                for item in batch:
+                    self._finish(item, error=e)
+                continue
+
+            for item in batch:
+                if not item.future.done() and item.expired():
+                    self._cancel(item, "generating", 0)
+            responses = [response for item, response in zip(batch, responses) if not item.future.done()]
+            batch = [item for item in batch if not item.future.done()]
+            if not batch:
+                continue
+
+            if responses[0] is None:
+                # Unfinished long request: let everything queued meanwhile go first
+                with self._condition:
+                    self._pending.append(batch[0])
+                continue
+
+            logger.info(f"Generated batch of {len(questions)} for adapter {adapter or 'base'}")
+            for item, response in zip(batch, responses):
+                self._finish(item, response)
+
+class ContinuousBatcher(RequestBatcher):
+    """Iteration-level scheduler generating on a paged KV cache.
+
+    Instead of running a batch to completion, every step generates one token
+    for every running request. Requests join as soon as the KV-cache pool has
+    blocks for their prompt and leave as soon as they finish, so a short
+    answer never waits for a long one. Blocks are taken as responses grow,
+    so how many requests run at once depends on the tokens they actually
+    hold, not on prompt + max_new_tokens padded to the longest request.
+
+    When the pool runs out, the most recently admitted request is preempted:
+    its blocks are freed and it goes back to the front of the queue, to be
+    prefilled again with its partial response once blocks are free.
+    The token budgets of RequestBatcher still bound the queue, and expired
+    requests leave the running batch at the next step.
+    """
+
+    def __init__(self, get_model, model_lock, num_blocks=1024, block_size=16, max_batch_size=32, on_preempt=None, **kwargs):
+        """
+        Initialize the batcher.
+
+        Args:
+            get_model: Callable returning the current MedLLamaArabic instance (or None)
+            model_lock: Lock serialising access to the model
+            num_blocks: KV-cache blocks in the pool
+            block_size: Tokens per block
+            max_batch_size: Maximum number of requests running at once
+            on_preempt: Called with no arguments whenever a request is preempted
+            **kwargs: Token budgets, as for RequestBatcher
+        """
+        self.allocator = BlockAllocator(num_blocks, block_size)
+        self.on_preempt = on_preempt
+        self._cache = None
+        self._cache_model = None
+        self._running = []
+        super().__init__(get_model, model_lock, max_batch_size=max_batch_size, **kwargs)
+
+    def fit_request(self, question, max_new_tokens):
+        """Apply the per-request budget and the pool size and return (prompt_tokens, max_new_tokens).
+
+        Raises:
+            ValueError: If the prompt alone does not fit the budget or the pool
+        """
+        prompt_tokens, max_new_tokens = super().fit_request(question, max_new_tokens)
+        capacity = self.allocator.num_blocks * self.allocator.block_size
+        if prompt_tokens >= capacity:
+            raise ValueError(f"Prompt is {prompt_tokens} tokens, the KV cache holds {capacity}")
+        return prompt_tokens, min(max_new_tokens, capacity - prompt_tokens)
+
+    def kv_stats(self):
+        stats = self.allocator.stats()
+        stats["running"] = len(self._running)
+        stats["cache_bytes"] = self._cache.nbytes() if self._cache is not None else 0
+        return stats
+
+    def _growth_blocks(self):
+        """Blocks the running requests need to take for their next token."""
+        block_size = self.allocator.block_size
+        return sum(1 for item in self._running if self.allocator.length(id(item)) % block_size == 0)
+
+    def _admit(self):
+        """Block until there is work, and take the requests whose prompts fit in the free blocks."""
+        with self._condition:
+            while not self._pending and not self._running:
+                self._condition.wait()
+
+            admitted, expired = [], []
+            available = self.allocator.free_count() - self._growth_blocks()
+            while self._pending and len(self._running) + len(admitted) < self.max_batch_size:
+                head = self._head()
+                if head.expired():
+                    self._pending.remove(head)
+                    expired.append(head)
+                    continue
+                needed = self.allocator.blocks_for(head.cost - head.max_new_tokens + len(head.generated_ids) + 1)
+                if needed > available:
+                    break
+                self._pending.remove(head)
+                admitted.append(head)
+                available -= needed
+
+        for item in expired:
+            self._cancel(item, "queued", item.max_new_tokens - len(item.generated_ids))
+        return admitted
+
+    def _cache_for(self, model):
+        """The paged cache of the current model; a new model gets a new cache."""
+        if self._cache_model is not None and self._cache_model() is model:
+            return self._cache
+
+        # Cached keys and values of another model are useless: start the running requests over
+        for item in reversed(self._running):
+            self._preempt(item)
+        self._cache = None
+        num_layers, num_kv_heads, head_dim, dtype, device = model.kv_cache_spec()
+        self._cache = PagedKVCache(self.allocator, num_layers, num_kv_heads, head_dim, dtype, device)
+        self._cache_model = weakref.ref(model)
+        logger.info(f"Allocated paged KV cache: {self.allocator.num_blocks} blocks of {self.allocator.block_size} tokens, "
+                    f"{self._cache.nbytes() / 2**20:.1f} MiB")
+        return self._cache
+
+    def _preempt(self, item):
+        """Free a running request's blocks and queue it again in front."""
+        self._running.remove(item)
+        self.allocator.free(id(item))
+        with self._condition:
+            self._pending.insert(0, item)
+        if self.on_preempt is not None:
+            self.on_preempt()
+
+    def _prefill(self, model, cache, item):
+        """Process a request's prompt (and partial response, if preempted) and sample its next token."""
+        self._running.append(item)
+        start = time.perf_counter()
+        token_ids = model.prompt_encoder.encode(item.question) + item.generated_ids
+        logits = model.paged_forward(cache, [id(item)], [token_ids], adapter=item.adapter)
+        item.prefill_seconds += time.perf_counter() - start
+        if item.stop_check is None:
+            item.stop_check = model.stop_checker()
+            item.decode_start = time.perf_counter()
+
+        self._advance(model, [item], model.sample_next_tokens(logits, greedy=item.greedy))
+
+    def _decode(self, model, cache):
+        """Generate one token for every running request, one forward per adapter."""
+        for item in [item for item in self._running if item.expired()]:
+            self._retire(model, item, "cancelled")
+        if not self._running:
+            return
+
+        while len(self._running) > 1 and self._growth_blocks() > self.allocator.free_count():
+            self._preempt(self._running[-1])
+
+        groups = {}
+        for item in self._running:
+            groups.setdefault(item.adapter, []).append(item)
+        for adapter, items in groups.items():
+            logits = model.paged_forward(cache, [id(item) for item in items], [[item.generated_ids[-1]] for item in items], adapter=adapter)
+            self._advance(model, items, model.sample_next_tokens(logits, greedy=[item.greedy for item in items]))
+
+    def _advance(self, model, items, tokens):
+        """Append each request's new token and retire the requests that are done."""
+        for item, token in zip(items, tokens):
+            if token == model.tokenizer.eos_token_id:
+                reason = "eos"
+            else:
+                item.generated_ids.append(token)
+                if item.stop_check(item.generated_ids):
+                    reason = "stop_sequence"
+                elif len(item.generated_ids) >= item.max_new_tokens:
+                    reason = "length"
+                else:
+                    continue
+            self._retire(model, item, reason)
+
+    def _retire(self, model, item, reason):
+        self._running.remove(item)
+        self.allocator.free(id(item))
+        model.report_paged_generation(
+            item.cost - item.max_new_tokens, len(item.generated_ids), item.prefill_seconds,
+            time.perf_counter() - item.decode_start, item.max_new_tokens, reason
+        )
+        if reason == "cancelled":
+            self._cancel(item, "generating", 0)
+        else:
+            self._finish(item, model.decode_response(item.generated_ids))
+
+    def _run(self):
+        while True:
+            admitted = self._admit()
+            try:
+                with self.model_lock:
+                    model = self.get_model()
+                    if model is None:
+                        raise RuntimeError("Model is not loaded")
+
+                    cache = self._cache_for(model)
+                    while admitted:
+                        self._prefill(model, cache, admitted.pop(0))
+                    if self._running:
+                        self._decode(model, cache)
+            except Exception as e:
+                logger.error(f"Error generating on the paged KV cache: {str(e)}")
+                for item in self._running + admitted:
+                    self.allocator.free(id(item))
+                    self._finish(item, error=e)
+                self._running = []
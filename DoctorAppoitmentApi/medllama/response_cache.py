@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+def response_cache_key(*parts):
+    """Stable key for the parts that determine an answer (question, limits, model)."""
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+class ResponseCache(ABC):
+    """Interface of the generated-answer caches.
+
+    A backend stores text values under string keys, drops entries older than
+    ttl_seconds and evicts the least recently used ones to stay within
+    max_bytes of values. get() and put() must be safe to call from several
+    threads; a backend shared between processes (or, later, a network store)
+    implements the same methods, so the API does not depend on where the
+    answers are kept. A backend missing one of the abstract methods cannot be
+    instantiated.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        """The value stored under key, or None."""
+
+    def get_many(self, keys):
+        """Values of several keys, None for each missing one."""
+        return [self.get(key) for key in keys]
+
+    @abstractmethod
+    def put(self, key, value):
+        """Store value under key."""
+
+    def put_many(self, items):
+        """Store several (key, value) pairs."""
+        for key, value in items:
+            self.put(key, value)
+
+    @abstractmethod
+    def clear(self):
+        """Drop every entry."""
+
+    @abstractmethod
+    def stats(self):
+        """Dict with at least "backend", "entries" and "bytes"."""
+
+class MemoryResponseCache(ResponseCache):
+    """LRU cache inside the process; each worker of serve.py has its own."""
+
+    def __init__(self, max_bytes=64 << 20, ttl_seconds=86400, on_evict=None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes: Total UTF-8 size of the values the cache may hold
+            ttl_seconds: Age after which an entry expires
+            on_evict: Called with the reason ("size" or "ttl") and the number of evicted entries
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, stored_at = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self._bytes -= size
+                self._evicted("ttl", 1)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            while self._entries and self._bytes + size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._evicted("size", 1)
+            self._entries[key] = (value, size, time.time())
+            self._bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._entries), "bytes": self._bytes}
+
+    def _evicted(self, reason, count):
+        if self.on_evict is not None:
+            self.on_evict(reason, count)
+
+class SQLiteResponseCache(ResponseCache):
+    """Cache in a SQLite database on local disk, shared by every process that opens the same file.
+
+    The database runs in WAL mode, so readers in all workers proceed while one
+    of them writes. The total size of the values is kept in a one-row table by
+    triggers, so enforcing max_bytes does not scan the table; lookups refresh
+    an entry's last-used time at most every touch_interval seconds to keep
+    hits from turning into writes. Connections are per thread and per process,
+    so the cache may be created before serve.py forks its workers.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            stored_at REAL NOT NULL,
+            used_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at);
+        CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at);
+        CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+        INSERT OR IGNORE INTO totals VALUES (0, 0);
+        CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses
+            BEGIN UPDATE totals SET bytes = bytes + NEW.size; END;
+        CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses
+            BEGIN UPDATE totals SET bytes = bytes - OLD.size; END;
+        CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses
+            BEGIN UPDATE totals SET bytes = bytes - OLD.size + NEW.size; END;
+    """
+
+    def __init__(self, path, max_bytes=256 << 20, ttl_seconds=86400, touch_interval=60.0, busy_timeout=5.0, on_evict=None):
+        """
+        Initialize the cache, creating the database file if needed.
+
+        Args:
+            path: Database file; every process using the same path shares the cache
+            max_bytes: Total UTF-8 size of the values the cache may hold
+            ttl_seconds: Age after which an entry expires
+            touch_interval: Minimum seconds between last-used updates of an entry
+            busy_timeout: Seconds to wait for another process's write to finish
+            on_evict: Called with the reason ("size" or "ttl") and the number of evicted entries
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.touch_interval = touch_interval
+        self.busy_timeout = busy_timeout
+        self.on_evict = on_evict
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(self._SCHEMA)
+
+    def _connection(self):
+        """This thread's connection, opened again in a forked child."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        connection = self._connection()
+        now = time.time()
+        placeholders = ",".join("?" * len(keys))
+        rows = connection.execute(
+            f"SELECT key, value, stored_at, used_at FROM responses WHERE key IN ({placeholders})", list(keys)
+        ).fetchall()
+
+        found, expired, touched = {}, [], []
+        for key, value, stored_at, used_at in rows:
+            if now - stored_at > self.ttl_seconds:
+                expired.append(key)
+                continue
+            found[key] = value
+            if now - used_at >= self.touch_interval:
+                touched.append(key)
+
+        if expired or touched:
+            with self._write(connection):
+                if expired:
+                    connection.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in expired])
+                if touched:
+                    connection.executemany("UPDATE responses SET used_at = ? WHERE key = ?", [(now, key) for key in touched])
+            self._evicted("ttl", len(expired))
+        return [found.get(key) for key in keys]
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        now = time.time()
+        rows = [(key, value, len(value.encode("utf-8")), now, now) for key, value in items]
+        rows = [row for row in rows if row[2] <= self.max_bytes]
+        if not rows:
+            return
+        connection = self._connection()
+        with self._write(connection):
+            # An upsert, unlike INSERT OR REPLACE, fires the triggers keeping the total right
+            connection.executemany(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                "value = excluded.value, size = excluded.size, stored_at = excluded.stored_at, used_at = excluded.used_at",
+                rows
+            )
+            expired = connection.execute("DELETE FROM responses WHERE stored_at < ?", (now - self.ttl_seconds,)).rowcount
+            evicted = 0
+            total = connection.execute("SELECT bytes FROM totals").fetchone()[0]
+            while total > self.max_bytes:
+                # Least recently used first, a few at a time
+                victims = connection.execute(
+                    "SELECT key, size FROM responses ORDER BY used_at LIMIT 32"
+                ).fetchall()
+                if not victims:
+                    break
+                freed = 0
+                for victim_key, size in victims:
+                    connection.execute("DELETE FROM responses WHERE key = ?", (victim_key,))
+                    evicted += 1
+                    freed += size
+                    if total - freed <= self.max_bytes:
+                        break
+                total -= freed
+        self._evicted("ttl", expired)
+        self._evicted("size", evicted)
+
+    def clear(self):
+        connection = self._connection()
+        with self._write(connection):
+            connection.execute("DELETE FROM responses")
+
+    def stats(self):
+        connection = self._connection()
+        entries = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = connection.execute("SELECT bytes FROM totals").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "entries": entries, "bytes": total}
+
+    @staticmethod
+    @contextmanager
+    def _write(connection):
+        """Write transaction taking the database lock up front, so it waits for other writers instead of failing halfway."""
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _evicted(self, reason, count):
+        if count and self.on_evict is not None:
+            self.on_evict(reason, count)
+
+def frequent_questions(log_path, normalize, top_n=32, min_count=2, sources=("medllama",)):
+    """Most frequent questions of an interaction log (medllama_interactions.jsonl).
+
+    The log is read one line at a time and questions are counted by their
+    normalized form; lines that are not valid entries are skipped.
+
+    Args:
+        log_path: JSON-lines log written by MedLLamaIntegration._log_interaction
+        normalize: Maps a question to the form it is cached under
+        top_n: Maximum questions to return
+        min_count: Times a question must have been asked
+        sources: Only count entries answered by these sources
+
+    Returns:
+        list: (question, count, latest logged response) tuples, most frequent first
+    """
+    counts = Counter()
+    latest = {}
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                question = entry["query"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            if not isinstance(question, str) or (sources and entry.get("source") not in sources):
+                continue
+            key = normalize(question)
+            if not key:
+                continue
+            counts[key] += 1
+            latest[key] = (question, entry.get("response"))
+
+    return [
+        (latest[key][0], count, latest[key][1])
+        for key, count in counts.most_common(top_n) if count >= min_count
+    ]
+
+def open_response_cache(spec, max_bytes=None, ttl_seconds=86400, on_evict=None):
+    """Create the cache a spec names: "memory", or "sqlite:PATH" for a file shared between processes.
+
+    Returns None for an empty spec (caching off).
+
+    Raises:
+        ValueError: For an unknown backend
+    """
+    if not spec:
+        return None
+    if spec == "memory":
+        return MemoryResponseCache(max_bytes=max_bytes or 64 << 20, ttl_seconds=ttl_seconds, on_evict=on_evict)
+    if spec.startswith("sqlite:"):
+        return SQLiteResponseCache(spec[len("sqlite:"):], max_bytes=max_bytes or 256 << 20, ttl_seconds=ttl_seconds, on_evict=on_evict)
+    raise ValueError(f"Unknown response cache backend: {spec}")
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Production launcher for the MedLLama API (api.py) with several worker processes.
+
+The model is loaded once in the parent process, which then forks the workers.
+Weight tensors are never written after loading, so their pages stay shared
+copy-on-write between all workers instead of being loaded N times.
+
+The parent owns the listening socket and every worker accepts from it: the
+kernel's accept queue is the front queue, and with single-threaded workers a
+request is only taken by a worker that is idle. Workers that die are re-forked
+from the parent, which still holds the loaded model.
+
+    MEDLLAMA_MODEL_DIR=./model_snapshot python serve.py --workers 4
+    MEDLLAMA_FAKE_MODEL=stub python serve.py --workers 8 --port 5001
+
+The model is configured through the same MEDLLAMA_* environment variables as
+api.py. State changed through the API (/admin/reload, /adapters, /finetune) and
+/metrics are per worker; restart the launcher to change the served model.
+Fork is POSIX-only and CUDA cannot be used in a forked child, so the CUDA
+backend is limited to one worker.
+"""
+
+import os
+import gc
+import sys
+import signal
+import socket
+import logging
+import argparse
+
+import api
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def _run_worker(worker_id, listener, host, port, threads, threaded):
+    """Serve requests from the shared socket until terminated; never returns."""
+    from werkzeug.serving import make_server
+    import torch
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    exit_code = 0
+    try:
+        # Split the cores between workers instead of oversubscribing them
+        if threads:
+            torch.set_num_threads(threads)
+        api.reinitialize_after_fork()
+
+        server = make_server(host, port, api.app, threaded=threaded, fd=listener.fileno())
+        logger.info(f"Worker {worker_id} (pid {os.getpid()}) serving with {torch.get_num_threads()} threads")
+        server.serve_forever()
+    except Exception as e:
+        logger.error(f"Worker {worker_id} failed: {str(e)}")
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
+
+def serve(host="0.0.0.0", port=5001, workers=2, threads=None, threaded=False, backlog=128):
+    """Load the model, fork the workers and supervise them until SIGTERM/SIGINT.
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on
+        workers: Number of worker processes
+        threads: torch intra-op threads per worker (default: cores / workers)
+        threaded: Handle several connections per worker, so that requests
+            can also be batched inside a worker
+        backlog: Length of the shared accept queue
+    """
+    model = api.build_model(api.model_config_from_env(), api.parse_adapters(os.environ.get("MEDLLAMA_ADAPTERS")))
+    # Before forking, so every worker starts with the frequent questions cached
+    api.prewarm_response_cache(model)
+    api.model = model
+    api.model_init_started.set()
+
+    if workers > 1 and api.model._backend() == "cuda":
+        logger.warning("CUDA cannot be shared with forked workers, starting a single worker")
+        workers = 1
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+
+    listener = socket.create_server((host, port), backlog=backlog, reuse_port=False)
+    listener.set_inheritable(True)
+
+    # Keep the loaded objects out of later collections, so the garbage
+    # collector does not write to (and un-share) their pages in the workers
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(worker_id, listener, host, port, threads, threaded)
+        children[pid] = worker_id
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+    logger.info(f"Serving on {host}:{port} with {workers} workers x {threads} threads")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        worker_id = children.pop(pid, None)
+        if worker_id is not None and not stopping:
+            logger.warning(f"Worker {worker_id} (pid {pid}) exited with status {status}, restarting")
+            spawn(worker_id)
+
+    listener.close()
+    logger.info("All workers stopped")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the MedLLama API with several worker processes")
+    parser.add_argument("--host", default="0.0.0.0", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=5001, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=2, help="Number of worker processes")
+    parser.add_argument("--threads", type=int, help="torch threads per worker (default: cores / workers)")
+    parser.add_argument("--threaded", action="store_true", help="Handle several connections per worker")
+    parser.add_argument("--backlog", type=int, default=128, help="Length of the shared accept queue")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    if not hasattr(os, "fork"):
+        logger.error("serve.py needs fork(); use `python api.py` on this platform")
+        sys.exit(1)
+
+    args = parse_args()
+    serve(args.host, args.port, args.workers, args.threads, args.threaded, args.backlog)
@@ -0,0 +1,114 @@
+import time
+import threading
+from collections import OrderedDict
+
+def kv_cache_nbytes(past_key_values):
+    """Memory held by a transformers KV cache (DynamicCache or legacy tuples)."""
+    if past_key_values is None:
+        return 0
+    layers = getattr(past_key_values, "layers", None)
+    if layers is not None:
+        tensors = [tensor for layer in layers for tensor in (layer.keys, layer.values)]
+    else:
+        tensors = [tensor for pair in past_key_values for tensor in pair]
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors if tensor is not None)
+
+class Session:
+    """One conversation: the token ids of the dialogue so far and the model's KV cache of them."""
+
+    def __init__(self, adapter=None):
+        self.adapter = adapter
+        self.token_ids = []
+        self.past_key_values = None
+        self.nbytes = 0
+        self.turns = 0
+        self.last_used = time.monotonic()
+
+class SessionStore:
+    """Conversation sessions bounded by the total size of their KV caches.
+
+    Sessions idle for longer than ttl_seconds expire, and the least recently
+    used ones are evicted when the caches would exceed max_bytes. A session
+    is taken out of the store for the duration of a turn and put back after,
+    so an in-progress turn is never evicted.
+    """
+
+    def __init__(self, max_bytes=1 << 30, ttl_seconds=600, on_evict=None):
+        """
+        Initialize the store.
+
+        Args:
+            max_bytes: Total KV-cache memory the stored sessions may hold
+            ttl_seconds: Idle time after which a session expires
+            on_evict: Called with the reason ("memory" or "ttl") for every evicted session
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def take(self, session_id):
+        """Remove and return a live session, or None if there is none."""
+        with self._lock:
+            self._expire()
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._bytes -= session.nbytes
+            return session
+
+    def put(self, session_id, session, nbytes):
+        """Store a session after a turn, evicting others to stay within max_bytes."""
+        if nbytes > self.max_bytes:
+            # Keep the dialogue but not a cache that could never fit
+            session.past_key_values = None
+            nbytes = 0
+
+        session.nbytes = nbytes
+        session.last_used = time.monotonic()
+        with self._lock:
+            self._expire()
+            previous = self._sessions.pop(session_id, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+
+            while self._sessions and self._bytes + nbytes > self.max_bytes:
+                _, evicted = self._sessions.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._evicted("memory")
+
+            self._sessions[session_id] = session
+            self._bytes += nbytes
+
+    def drop_caches(self):
+        """Forget every KV cache but keep the dialogues, e.g. after the model changed."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.past_key_values = None
+                session.nbytes = 0
+            self._bytes = 0
+
+    def discard(self, session_id):
+        """End a session; return whether it existed."""
+        return self.take(session_id) is not None
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            return {"sessions": len(self._sessions), "bytes": self._bytes}
+
+    def _expire(self):
+        """Drop idle sessions; the oldest are first since put() moves sessions to the end."""
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_used > deadline:
+                break
+            del self._sessions[session_id]
+            self._bytes -= session.nbytes
+            self._evicted("ttl")
+
+    def _evicted(self, reason):
+        if self.on_evict is not None:
+            self.on_evict(reason)
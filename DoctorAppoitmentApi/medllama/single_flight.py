@@ -0,0 +1,54 @@
+import threading
+
+class SingleFlight:
+    """Shares one in-flight result between concurrent identical requests.
+
+    The first request for a key starts the work; requests with the same key
+    that arrive before it finishes get the same Future instead of starting
+    their own, along with the Deadline the work runs under, so they can
+    attach their own deadlines to it. Nothing is kept once the work is done,
+    so this is not a cache.
+    """
+
+    def __init__(self, on_coalesced=None):
+        """
+        Initialize the coalescer.
+
+        Args:
+            on_coalesced: Called with no arguments whenever a request joins one in flight
+        """
+        self.on_coalesced = on_coalesced
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, start, deadline=None):
+        """Join the work in flight for key, or call start() to begin it under deadline.
+
+        Returns:
+            (future, deadline, is_leader): the shared Future, the Deadline the
+            work runs under (the first request's), and whether this request
+            started the work
+        """
+        with self._lock:
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                if self.on_coalesced is not None:
+                    self.on_coalesced()
+                return flight + (False,)
+
+            future = start()
+            self._in_flight[key] = (future, deadline)
+
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future, deadline, True
+
+    def in_flight_count(self):
+        """Number of distinct requests currently running."""
+        with self._lock:
+            return len(self._in_flight)
+
+    def _forget(self, key, future):
+        with self._lock:
+            flight = self._in_flight.get(key)
+            if flight is not None and flight[0] is future:
+                del self._in_flight[key]
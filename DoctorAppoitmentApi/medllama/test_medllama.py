@@ -12,13 +12,21 @@ import json
 import logging
 import argparse
 import time
+import tempfile
 import requests
 from pathlib import Path
+from contextlib import contextmanager
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# MedLLamaIntegration writes its logs to the working directory by default, and
+# an interaction log there is what cache pre-warming reads; keep test runs out of it
+TEST_OUTPUT_DIR = tempfile.mkdtemp(prefix="medllama_test_")
+os.environ.setdefault("MEDLLAMA_INTEGRATION_LOG", os.path.join(TEST_OUTPUT_DIR, "medllama_integration.log"))
+os.environ.setdefault("MEDLLAMA_INTERACTIONS_LOG", os.path.join(TEST_OUTPUT_DIR, "medllama_interactions.jsonl"))
+
 # Sample Arabic medical questions
 SAMPLE_QUESTIONS = [
     "ما هي أعراض ارتفاع ضغط الدم؟",
@@ -28,8 +36,12 @@ SAMPLE_QUESTIONS = [
     "متى يجب زيارة الطبيب إذا كان لدي كحة مستمرة؟"
 ]
 
-def test_direct_model():
-    """Test direct model usage without API."""
+def test_direct_model(fake_model=None):
+    """Test direct model usage without API.
+    
+    With fake_model ("tiny" or "stub") no weights are downloaded, so the
+    serving code paths can be checked offline in seconds.
+    """
     try:
         from medllama_arabic import MedLLamaArabic, MedLLamaConfig
         
@@ -38,7 +50,8 @@ def test_direct_model():
         # Create a config with smaller model for testing
         config = MedLLamaConfig(
             base_model="meta-llama/Llama-2-7b-chat-hf",  # Can be changed to any available model
-            use_4bit=True
+            use_4bit=True,
+            fake_model=fake_model
         )
         
         # Initialize and load model
@@ -157,21 +170,826 @@ def test_integration():
         logger.info("Is the main app running? Try starting it with 'python app.py'")
         return False
 
+def test_fallback_latency(max_overhead_us=500.0):
+    """Test that the first in-process fallback answers without importing or loading anything.
+    
+    The fallback classifier is built once here, the way the Chatbot app builds
+    it, and injected into MedLLamaIntegration. The API URL is unreachable, so
+    every query is answered by the fallback. The first fallback may take at
+    most max_overhead_us longer than a bare call of the classifier; the
+    interaction log is stubbed out so file I/O does not count.
+    """
+    try:
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from medllama_integration import MedLLamaIntegration
+        
+        logger.info("Testing fallback latency...")
+        
+        texts = ["عندي سخونية وصداع", "ألم في المعدة", "كحة مستمرة وصعوبة في التنفس", "طفح جلدي وحكة"]
+        labels = ["إنفلونزا", "مشاكل هضمية", "التهاب رئوي", "حساسية"]
+        vectorizer = TfidfVectorizer()
+        classifier = LogisticRegression().fit(vectorizer.fit_transform(texts), labels)
+        
+        def classify_symptoms(symptoms):
+            return classifier.predict(vectorizer.transform(symptoms)).tolist()
+        
+        integration = MedLLamaIntegration(
+            medllama_api_url="http://127.0.0.1:9",
+            fallback=lambda symptom: classify_symptoms([symptom])[0],
+            batch_fallback=classify_symptoms
+        )
+        integration._log_interaction = lambda *args, **kwargs: None
+        
+        start_time = time.perf_counter()
+        for question in SAMPLE_QUESTIONS:
+            classify_symptoms([question])
+        classifier_us = (time.perf_counter() - start_time) / len(SAMPLE_QUESTIONS) * 1e6
+        
+        latencies = []
+        for question in SAMPLE_QUESTIONS:
+            start_time = time.perf_counter()
+            result = integration.process_query(question, user_id="fallback_test")
+            latencies.append((time.perf_counter() - start_time) * 1e6)
+            if result["source"] != "existing_chatbot":
+                logger.error(f"Expected a fallback response, got source {result['source']}")
+                return False
+        
+        logger.info(
+            f"First fallback: {latencies[0]:.0f} us, mean: {sum(latencies) / len(latencies):.0f} us "
+            f"(classifier alone: {classifier_us:.0f} us)"
+        )
+        if latencies[0] - classifier_us > max_overhead_us:
+            logger.error(
+                f"First fallback took {latencies[0]:.0f} us, more than {max_overhead_us:.0f} us over the "
+                f"classifier's {classifier_us:.0f} us"
+            )
+            return False
+        
+        logger.info("Fallback latency test completed successfully!")
+        return True
+    except Exception as e:
+        logger.error(f"Error testing fallback latency: {str(e)}")
+        logger.exception(e)
+        return False
+
+def test_default_batching():
+    """Test that requests with the default settings are batched, not chunked one at a time.
+    
+    Runs api.py in-process on the offline stub model with the default
+    MEDLLAMA_* configuration and records the batch size of every model call.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    os.environ.setdefault("MEDLLAMA_FAKE_MODEL", "stub")
+    import api
+    
+    logger.info("Testing batching with the default configuration...")
+    try:
+        api.model_init_started.set()
+        api.initialize_model()
+        batch_sizes = []
+        api.model.generation_listeners.append(lambda stats: batch_sizes.append(len(stats["input_tokens"])))
+        client = api.app.test_client()
+        
+        response = client.post("/batch", json={"questions": SAMPLE_QUESTIONS[:3]})
+        if response.status_code != 200 or batch_sizes != [3]:
+            logger.error(f"/batch of 3 ran as model calls of {batch_sizes} (chunk_tokens={api.batcher.chunk_tokens})")
+            return False
+        
+        batch_sizes.clear()
+        with ThreadPoolExecutor(max_workers=len(SAMPLE_QUESTIONS)) as executor:
+            statuses = list(executor.map(lambda question: client.post("/generate", json={"question": question}).status_code, SAMPLE_QUESTIONS))
+        logger.info(f"{len(SAMPLE_QUESTIONS)} concurrent /generate requests ran as model calls of {batch_sizes}")
+        if statuses != [200] * len(SAMPLE_QUESTIONS) or len(batch_sizes) >= len(SAMPLE_QUESTIONS):
+            logger.error(f"Concurrent /generate requests were not batched: {statuses}, {batch_sizes}")
+            return False
+        
+        logger.info("Default batching test passed")
+        return True
+    except Exception as e:
+        logger.error(f"Error testing default batching: {str(e)}")
+        return False
+
+def test_concurrent_init(load_seconds=1.0):
+    """Test that concurrent initialize_model calls load the model once while /health keeps answering.
+    
+    Runs api.py in-process on the offline stub model with build_model slowed
+    down, calls initialize_model from two threads and polls /health meanwhile.
+    """
+    import threading
+    
+    os.environ.setdefault("MEDLLAMA_FAKE_MODEL", "stub")
+    import api
+    
+    logger.info("Testing concurrent model initialization...")
+    build_model = api.build_model
+    builds = []
+    def slow_build_model(*args, **kwargs):
+        builds.append(threading.get_ident())
+        time.sleep(load_seconds)
+        return build_model(*args, **kwargs)
+    
+    try:
+        api.build_model = slow_build_model
+        api.model_init_started.set()
+        threads = [threading.Thread(target=api.initialize_model) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        
+        time.sleep(load_seconds / 4)
+        start_time = time.perf_counter()
+        status = api.app.test_client().get("/health").get_json()["model_status"]
+        health_seconds = time.perf_counter() - start_time
+        for thread in threads:
+            thread.join()
+        
+        logger.info(f"build_model ran {len(builds)} time(s); /health answered {status!r} in {health_seconds * 1000:.1f} ms during the load")
+        if len(builds) != 1 or api.model is None:
+            logger.error(f"Expected one model load, got {len(builds)}")
+            return False
+        if status != "not_loaded" or health_seconds > load_seconds / 2:
+            logger.error("/health waited for the model load")
+            return False
+        
+        logger.info("Concurrent initialization test passed")
+        return True
+    except Exception as e:
+        logger.error(f"Error testing concurrent initialization: {str(e)}")
+        return False
+    finally:
+        api.build_model = build_model
+
+def test_degraded_requests():
+    """Test that the degradation level is passed with each request and that cache hits do not count as load.
+    
+    Runs api.py in-process on the offline stub model with a memory response
+    cache. A generated answer must feed the degrader's latency window and its
+    cached repeat must not; at the greedy level the request must be generated
+    with greedy=True without changing any state of the shared model.
+    """
+    os.environ.setdefault("MEDLLAMA_FAKE_MODEL", "stub")
+    os.environ.setdefault("MEDLLAMA_RESPONSE_CACHE", "memory")
+    import api
+    
+    logger.info("Testing degraded requests...")
+    previous_cooldown = api.degrader.cooldown_seconds
+    try:
+        api.model_init_started.set()
+        api.initialize_model()
+        client = api.app.test_client()
+        
+        samples = len(api.degrader._latencies)
+        client.post("/generate", json={"question": SAMPLE_QUESTIONS[0]})
+        generated_samples = len(api.degrader._latencies) - samples
+        cached = client.post("/generate", json={"question": SAMPLE_QUESTIONS[0]}).get_json()
+        cached_samples = len(api.degrader._latencies) - samples - generated_samples
+        logger.info(f"Latency samples: {generated_samples} for the generated answer, {cached_samples} for the cached one")
+        if not cached.get("cached") or generated_samples != 1 or cached_samples != 0:
+            logger.error("Cached answers must not feed the degradation latency")
+            return False
+        
+        greedy_calls = []
+        generate_response = api.model.generate_response
+        def recording_generate_response(*args, **kwargs):
+            greedy_calls.append(kwargs.get("greedy", False))
+            return generate_response(*args, **kwargs)
+        api.model.generate_response = recording_generate_response
+        model_state = dict(vars(api.model))
+        
+        # Hold the greedy level for the rest of the test
+        api.degrader.cooldown_seconds = 3600
+        api.degrader.index = next(index for index, level in enumerate(api.degrader.levels) if level.greedy)
+        result = client.post("/generate", json={"question": SAMPLE_QUESTIONS[1]}).get_json()
+        changed = [name for name, value in vars(api.model).items() if model_state.get(name) is not value]
+        logger.info(f"At level {result.get('degradation')!r} the model was called with greedy={greedy_calls}")
+        if greedy_calls != [True] or changed:
+            logger.error(f"Expected one greedy call and no model state change, got {greedy_calls}, changed {changed}")
+            return False
+        
+        logger.info("Degraded requests test passed")
+        return True
+    except Exception as e:
+        logger.error(f"Error testing degraded requests: {str(e)}")
+        return False
+    finally:
+        api.degrader.cooldown_seconds = previous_cooldown
+        api.degrader.index = 0
+        if api.model is not None and "generate_response" in vars(api.model):
+            del api.model.generate_response
+
+def test_coalescing(n_requests=4):
+    """Test that identical concurrent /generate requests share one generation.
+    
+    Runs api.py in-process on the offline stub model, slowed down so the
+    requests overlap. They must get the same answer from a single model call,
+    and the generation must run under the first request's deadline with the
+    others attached to it.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    os.environ.setdefault("MEDLLAMA_FAKE_MODEL", "stub")
+    os.environ.setdefault("MEDLLAMA_FAKE_TOKEN_DELAY", "0.005")
+    import api
+    
+    logger.info(f"Testing coalescing of {n_requests} identical requests...")
+    try:
+        api.model_init_started.set()
+        api.initialize_model()
+        calls = []
+        api.model.generation_listeners.append(lambda stats: calls.append(len(stats["input_tokens"])))
+        flights = []
+        submit = api.single_flight.submit
+        def recording_submit(key, start, deadline=None):
+            flights.append(submit(key, start, deadline))
+            return flights[-1]
+        api.single_flight.submit = recording_submit
+        client = api.app.test_client()
+        
+        with ThreadPoolExecutor(max_workers=n_requests) as executor:
+            results = list(executor.map(
+                lambda i: client.post("/generate", json={"question": SAMPLE_QUESTIONS[2], "timeout": 30}).get_json(), range(n_requests)
+            ))
+        
+        leaders = [shared_deadline for _, shared_deadline, leader in flights if leader]
+        shared = {id(shared_deadline) for _, shared_deadline, _ in flights}
+        logger.info(f"{n_requests} requests: {len(calls)} model call(s), {len(leaders)} leader(s)")
+        if len(calls) != 1 or len({result.get("response") for result in results}) != 1:
+            logger.error(f"Expected one generation shared by all requests, got {calls}: {results}")
+            return False
+        if len(leaders) != 1 or shared != {id(leaders[0])} or len(leaders[0]._attached) != n_requests - 1:
+            logger.error("Expected every request to share the leader's deadline, with the others attached")
+            return False
+        
+        logger.info("Coalescing test passed")
+        return True
+    except Exception as e:
+        logger.error(f"Error testing coalescing: {str(e)}")
+        return False
+    finally:
+        if "submit" in vars(api.single_flight):
+            del api.single_flight.submit
+
+def test_chunked_stop_reasons(chunk_tokens=8):
+    """Test that a request generated in chunks records exactly one stop reason.
+    
+    Runs api.py in-process on the offline stub model with a chunk size far
+    below max_new_tokens, so every request takes several chunks.
+    """
+    os.environ.setdefault("MEDLLAMA_FAKE_MODEL", "stub")
+    import api
+    
+    logger.info(f"Testing stop reasons of requests generated {chunk_tokens} tokens at a time...")
+    reasons = ("eos", "stop_sequence", "length", "cancelled")
+    previous_chunk_tokens = None
+    try:
+        api.model_init_started.set()
+        api.initialize_model()
+        previous_chunk_tokens, api.batcher.chunk_tokens = api.batcher.chunk_tokens, chunk_tokens
+        client = api.app.test_client()
+        
+        before = sum(api.metrics.stops.value(reason) for reason in reasons)
+        questions = SAMPLE_QUESTIONS[:3]
+        response = client.post("/batch", json={"questions": questions})
+        stops = sum(api.metrics.stops.value(reason) for reason in reasons) - before
+        if response.status_code != 200 or stops != len(questions):
+            logger.error(f"{len(questions)} chunked requests recorded {stops} stop reasons")
+            return False
+        
+        logger.info("Chunked stop reasons test passed")
+        return True
+    except Exception as e:
+        logger.error(f"Error testing chunked stop reasons: {str(e)}")
+        return False
+    finally:
+        if previous_chunk_tokens is not None:
+            api.batcher.chunk_tokens = previous_chunk_tokens
+
+@contextmanager
+def cold_response_cache():
+    """Start local API nodes with nothing to pre-warm, whatever MEDLLAMA_PREWARM_LOG says.
+    
+    Nodes started inside the block read an empty interaction log, so the
+    first answer to a question is generated rather than cached. The log is
+    removed on exit; start_workers has waited for the nodes to load by then.
+    """
+    fd, log_path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+    previous = os.environ.get("MEDLLAMA_PREWARM_LOG")
+    os.environ["MEDLLAMA_PREWARM_LOG"] = log_path
+    try:
+        yield log_path
+    finally:
+        if previous is None:
+            os.environ.pop("MEDLLAMA_PREWARM_LOG", None)
+        else:
+            os.environ["MEDLLAMA_PREWARM_LOG"] = previous
+        os.remove(log_path)
+
+def test_load_balancing(n_nodes=3, base_port=5021, n_queries=30, balancing="least_outstanding"):
+    """Test MedLLamaIntegration against several local API nodes on the offline stub model.
+    
+    Checks that queries are spread over the nodes, that a conversation stays on one
+    node, and that queries are still answered by MedLLama when a node dies.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from load_test import start_workers
+    from medllama_integration import MedLLamaIntegration
+    
+    logger.info(f"Testing load balancing over {n_nodes} nodes ({balancing})...")
+    processes, urls = [], []
+    try:
+        with cold_response_cache():
+            for index in range(n_nodes):
+                process, url = start_workers(base_port + index, 1, fake_model="stub", token_delay=0.005)
+                processes.append(process)
+                urls.append(url)
+        
+        integration = MedLLamaIntegration(urls, fallback=lambda query: "fallback", balancing=balancing)
+        query = SAMPLE_QUESTIONS[0]
+        
+        with ThreadPoolExecutor(max_workers=n_nodes * 2) as executor:
+            sources = list(executor.map(lambda i: integration.process_query(query)["source"], range(n_queries)))
+        counts = [node["requests"] for node in integration.nodes.stats()]
+        logger.info(f"Requests per node: {counts}")
+        if sources.count("medllama") != n_queries or min(counts) == 0:
+            logger.error(f"Queries were not spread over all nodes: {sources.count('medllama')} answered by MedLLama")
+            return False
+        
+        before = [node["requests"] for node in integration.nodes.stats()]
+        for _ in range(5):
+            integration.process_query(query, conversation_id="affinity_test")
+        used = [after - earlier for after, earlier in zip((node["requests"] for node in integration.nodes.stats()), before)]
+        if sorted(used)[-1] != 5:
+            logger.error(f"A conversation's queries went to several nodes: {used}")
+            return False
+        
+        processes[0].terminate()
+        processes[0].wait()
+        sources = [integration.process_query(query, user_id=f"failover_{i}")["source"] for i in range(n_nodes * 3)]
+        logger.info(f"After stopping {urls[0]}: {integration.nodes.stats()[0]}")
+        if sources.count("medllama") != len(sources):
+            logger.error(f"Queries fell back after a node died: {sources}")
+            return False
+        
+        logger.info("Load balancing test passed")
+        return True
+    
+    except Exception as e:
+        logger.error(f"Error testing load balancing: {str(e)}")
+        return False
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+def test_batch_queries(n_nodes=2, base_port=5031, n_queries=40, chunk_size=8):
+    """Test MedLLamaIntegration.process_queries on local API nodes running the offline stub model.
+    
+    Checks that every result lines up with its query, that only Arabic medical
+    queries reach MedLLama and that the rest take one fallback call, and
+    compares the time against calling process_query for each query.
+    """
+    from load_test import start_workers
+    from medllama_integration import MedLLamaIntegration
+    
+    logger.info(f"Testing batch queries over {n_nodes} nodes...")
+    processes, urls = [], []
+    try:
+        with cold_response_cache():
+            for index in range(n_nodes):
+                process, url = start_workers(base_port + index, 1, fake_model="stub", token_delay=0.005)
+                processes.append(process)
+                urls.append(url)
+        
+        fallback_calls = []
+        def classify_symptoms(symptoms):
+            fallback_calls.append(len(symptoms))
+            return [f"fallback: {symptom}" for symptom in symptoms]
+        
+        integration = MedLLamaIntegration(urls, fallback=lambda symptom: classify_symptoms([symptom])[0], batch_fallback=classify_symptoms)
+        other_queries = ["I have a headache", "مرحبا، كيف حالك؟", "What time is it?"]
+        queries = [
+            SAMPLE_QUESTIONS[index % len(SAMPLE_QUESTIONS)] if index % 4 else other_queries[index % len(other_queries)]
+            for index in range(n_queries)
+        ]
+        expected = ["medllama" if integration._routes_to_medllama(query) else "existing_chatbot" for query in queries]
+        
+        start_time = time.perf_counter()
+        results = integration.process_queries(queries, chunk_size=chunk_size)
+        batch_seconds = time.perf_counter() - start_time
+        
+        if [result["source"] for result in results] != expected:
+            logger.error(f"Unexpected sources: {[result['source'] for result in results]}")
+            return False
+        if fallback_calls != [expected.count("existing_chatbot")]:
+            logger.error(f"Expected one fallback call, got {fallback_calls}")
+            return False
+        for query, result in zip(queries, results):
+            if result["source"] == "existing_chatbot" and result["response"] != f"fallback: {query}":
+                logger.error(f"Result out of order for {query!r}: {result['response']!r}")
+                return False
+        
+        start_time = time.perf_counter()
+        for query in queries:
+            integration.process_query(query)
+        loop_seconds = time.perf_counter() - start_time
+        
+        logger.info(
+            f"{n_queries} queries ({expected.count('medllama')} to MedLLama): process_queries {batch_seconds:.2f}s, "
+            f"process_query loop {loop_seconds:.2f}s"
+        )
+        logger.info("Batch queries test passed")
+        return True
+    
+    except Exception as e:
+        logger.error(f"Error testing batch queries: {str(e)}")
+        return False
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+def test_response_cache(base_port=5041, cache_path=None):
+    """Test that two API nodes on the offline stub model share answers through one SQLite response cache.
+    
+    A question answered by the first node must come back cached, and much
+    faster, from the second one.
+    """
+    from load_test import start_workers
+    
+    cache_path = cache_path or os.path.join(tempfile.mkdtemp(), "responses.db")
+    logger.info(f"Testing the shared response cache at {cache_path}...")
+    processes = []
+    previous = os.environ.get("MEDLLAMA_RESPONSE_CACHE")
+    os.environ["MEDLLAMA_RESPONSE_CACHE"] = f"sqlite:{cache_path}"
+    try:
+        urls = []
+        with cold_response_cache():
+            for index in range(2):
+                process, url = start_workers(base_port + index, 1, fake_model="stub", token_delay=0.005)
+                processes.append(process)
+                urls.append(url)
+        
+        answers = []
+        for url in urls:
+            start_time = time.perf_counter()
+            response = requests.post(f"{url}/generate", json={"question": SAMPLE_QUESTIONS[0]}, timeout=60)
+            response.raise_for_status()
+            answers.append((time.perf_counter() - start_time, response.json()))
+        
+        (generated_seconds, generated), (cached_seconds, cached) = answers
+        logger.info(f"Generated on {urls[0]} in {generated_seconds * 1000:.0f} ms, served from cache on {urls[1]} in {cached_seconds * 1000:.0f} ms")
+        if generated.get("cached") or not cached.get("cached") or cached["response"] != generated["response"]:
+            logger.error(f"The second node did not answer from the shared cache: {cached}")
+            return False
+        
+        health = requests.get(f"{urls[1]}/health", timeout=5).json()
+        logger.info(f"Response cache: {health.get('response_cache')}")
+        logger.info("Response cache test passed")
+        return True
+    
+    except Exception as e:
+        logger.error(f"Error testing the response cache: {str(e)}")
+        return False
+    finally:
+        if previous is None:
+            os.environ.pop("MEDLLAMA_RESPONSE_CACHE", None)
+        else:
+            os.environ["MEDLLAMA_RESPONSE_CACHE"] = previous
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+def test_cache_prewarm(port=5051):
+    """Test that an API node pre-warms its response cache from an interaction log before reporting ready.
+    
+    The log asks the first sample questions several times and the last one
+    once; the frequent ones must be answered from the cache on their very
+    first request, the rare one must not.
+    """
+    from load_test import start_workers
+    
+    directory = tempfile.mkdtemp()
+    log_path = os.path.join(directory, "medllama_interactions.jsonl")
+    frequent, rare = SAMPLE_QUESTIONS[:-1], SAMPLE_QUESTIONS[-1]
+    with open(log_path, "w", encoding="utf-8") as f:
+        for question in frequent * 3 + [rare]:
+            f.write(json.dumps({"query": question, "response": "...", "source": "medllama", "user_id": None}, ensure_ascii=False) + "\n")
+    
+    logger.info(f"Testing response cache pre-warming from {log_path}...")
+    environment = {
+        "MEDLLAMA_RESPONSE_CACHE": f"sqlite:{os.path.join(directory, 'responses.db')}",
+        "MEDLLAMA_PREWARM_LOG": log_path,
+    }
+    previous = {name: os.environ.get(name) for name in environment}
+    os.environ.update(environment)
+    process = None
+    try:
+        process, url = start_workers(port, 1, fake_model="stub", token_delay=0.005)
+        
+        prewarm = requests.get(f"{url}/health", timeout=5).json()["response_cache"]["prewarm"]
+        logger.info(f"Pre-warming: {prewarm}")
+        
+        sources = {}
+        for question in SAMPLE_QUESTIONS:
+            response = requests.post(f"{url}/generate", json={"question": question}, timeout=60)
+            response.raise_for_status()
+            sources[question] = bool(response.json().get("cached"))
+        
+        if prewarm.get("stored") != len(frequent) or not all(sources[question] for question in frequent) or sources[rare]:
+            logger.error(f"Unexpected cache hits on first requests: {sources}")
+            return False
+        
+        logger.info("Cache pre-warming test passed")
+        return True
+    
+    except Exception as e:
+        logger.error(f"Error testing cache pre-warming: {str(e)}")
+        return False
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+def benchmark_backends(model_path, max_new_tokens=32, runs=3):
+    """Compare generation tokens/second of the CPU backend variants on a small local model."""
+    import torch
+    from medllama_arabic import MedLLamaArabic, MedLLamaConfig
+    
+    variants = {
+        "cpu_fp32": dict(cpu_int8=False, cpu_bf16=False),
+        "cpu_bf16": dict(cpu_int8=False, cpu_bf16=True),
+        "cpu_int8": dict(cpu_int8=True),
+        "cpu_int8_compile": dict(cpu_int8=True, cpu_compile=True),
+    }
+    if torch.cuda.is_available():
+        variants["cuda_4bit"] = dict(backend="cuda", use_4bit=True)
+    
+    results = {}
+    for name, overrides in variants.items():
+        settings = dict(base_model=model_path, backend="cpu", use_4bit=False)
+        settings.update(overrides)
+        
+        try:
+            model = MedLLamaArabic(MedLLamaConfig(**settings))
+            model.load_model()
+            
+            prompt = model.config.arabic_prompt_template.format(instruction=SAMPLE_QUESTIONS[0])
+            inputs = model.tokenizer(prompt, return_tensors="pt").to(model.model.device)
+            
+            start_time = time.time()
+            with torch.no_grad():
+                for _ in range(runs):
+                    # Fixed output length so every backend decodes the same number of tokens
+                    model.model.generate(
+                        **inputs,
+                        max_new_tokens=max_new_tokens,
+                        min_new_tokens=max_new_tokens,
+                        do_sample=False,
+                        pad_token_id=model.tokenizer.pad_token_id
+                    )
+            elapsed_time = time.time() - start_time
+            
+            results[name] = runs * max_new_tokens / elapsed_time
+            logger.info(f"{name}: {results[name]:.1f} tokens/second (load {model.load_timings['total']:.2f}s)")
+        except Exception as e:
+            logger.error(f"{name}: benchmark failed: {str(e)}")
+    
+    return results
+
+def benchmark_speculative(model_path, draft_model_path, max_new_tokens=64):
+    """Compare generate_response latency with and without a draft model on identical prompts."""
+    import torch
+    from medllama_arabic import MedLLamaArabic, MedLLamaConfig
+    
+    results = {}
+    for name, draft_model in (("plain", None), ("speculative", draft_model_path)):
+        config = MedLLamaConfig(base_model=model_path, draft_model=draft_model)
+        model = MedLLamaArabic(config)
+        model.load_model()
+        
+        latencies = []
+        for question in SAMPLE_QUESTIONS:
+            torch.manual_seed(0)
+            start_time = time.time()
+            model.generate_response(question, max_new_tokens=max_new_tokens)
+            latencies.append(time.time() - start_time)
+        
+        results[name] = sum(latencies) / len(latencies)
+        logger.info(f"{name}: mean latency {results[name]:.3f} seconds over {len(latencies)} questions")
+        if draft_model:
+            metrics = model.speculative_metrics()
+            logger.info(
+                f"Acceptance rate: {metrics['acceptance_rate']:.2%}, "
+                f"tokens per target forward: {metrics['tokens_per_target_forward']:.2f}"
+            )
+    
+    logger.info(f"Speedup: {results['plain'] / results['speculative']:.2f}x")
+    return results
+
+def test_speculative_counts(max_new_tokens=40):
+    """Test the acceptance counts of assisted generation on offline tiny models.
+    
+    A draft with the target's weights must have every greedy proposal
+    accepted; a draft with other weights must have hardly any accepted.
+    """
+    import torch
+    from medllama_arabic import MedLLamaArabic, MedLLamaConfig, build_tiny_llama
+    
+    logger.info("Testing speculative decoding acceptance counts...")
+    try:
+        model = MedLLamaArabic(MedLLamaConfig(fake_model="tiny", cpu_int8=False, warmup=False))
+        model.load_model()
+        rates = {}
+        for name, seed in (("same weights", 0), ("other weights", 1)):
+            model.draft_model = build_tiny_llama(len(model.tokenizer), seed=seed).eval()
+            model.draft_model.generation_config.num_assistant_tokens = model.config.num_assistant_tokens
+            model.speculative_stats = {key: 0 for key in model.speculative_stats}
+            torch.manual_seed(0)
+            model.generate_response(SAMPLE_QUESTIONS[0], max_new_tokens=max_new_tokens, greedy=True)
+            metrics = model.speculative_metrics()
+            rates[name] = metrics["acceptance_rate"]
+            logger.info(
+                f"Draft with {name}: {metrics['accepted_tokens']} of {metrics['draft_tokens']} proposals accepted, "
+                f"{metrics['target_forwards']} target forwards for {metrics['generated_tokens']} tokens"
+            )
+        
+        if rates["same weights"] != 1.0 or rates["other weights"] > 0.5:
+            logger.error(f"Unexpected acceptance rates: {rates}")
+            return False
+        logger.info("Speculative counts test passed")
+        return True
+    except Exception as e:
+        logger.error(f"Error testing speculative counts: {str(e)}")
+        return False
+
+def benchmark_tokenization(model_path=None, runs=200):
+    """Compare prompt tokenization with and without the PromptEncoder cache.
+    
+    Uses the tokenizer at model_path, or the offline byte-level tokenizer.
+    """
+    from transformers import AutoTokenizer
+    from medllama_arabic import MedLLamaConfig, PromptEncoder, build_byte_tokenizer
+    
+    tokenizer = AutoTokenizer.from_pretrained(model_path, use_fast=True) if model_path else build_byte_tokenizer()
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    tokenizer.padding_side = "left"
+    template = MedLLamaConfig().arabic_prompt_template
+    questions = SAMPLE_QUESTIONS * (runs // len(SAMPLE_QUESTIONS))
+    
+    def per_call(function):
+        start_time = time.perf_counter()
+        function()
+        return (time.perf_counter() - start_time) / len(questions) * 1e6
+    
+    encoder = PromptEncoder(tokenizer, template)
+    uncached_encoder = PromptEncoder(tokenizer, template, max_size=0)
+    results = {
+        "uncached": per_call(lambda: [tokenizer(template.format(instruction=q), return_tensors="pt") for q in questions]),
+        "miss": per_call(lambda: [uncached_encoder.pad([uncached_encoder.encode(q)]) for q in questions]),
+        "cached": per_call(lambda: [encoder.pad([encoder.encode(q)]) for q in questions]),
+        "batch_uncached": per_call(lambda: tokenizer([template.format(instruction=q) for q in questions], return_tensors="pt", padding=True)),
+        "batch_cached": per_call(lambda: encoder.pad(encoder.encode_batch(questions))),
+    }
+    
+    logger.info(f"Template split into cached pieces: {encoder.piecewise}")
+    for name, micros in results.items():
+        logger.info(f"{name}: {micros:.1f} us per prompt")
+    return results
+
+def benchmark_paged_kv(fake_model="tiny", num_blocks=512, block_size=16, n_requests=24):
+    """Compare run-to-completion batching with iteration-level scheduling on a paged KV cache.
+    
+    Requests with a mix of short and long max_new_tokens arrive at once. Reports
+    total time, mean latency of the short requests, and the KV-cache tokens the
+    paged scheduler actually held against a contiguous cache padded to the
+    longest request of the same number of concurrent requests.
+    """
+    import threading
+    from medllama_arabic import MedLLamaArabic, MedLLamaConfig
+    from request_batcher import RequestBatcher, ContinuousBatcher
+    
+    model = MedLLamaArabic(MedLLamaConfig(fake_model=fake_model))
+    model.load_model()
+    lock = threading.Lock()
+    lengths = [8, 32, 128]
+    
+    def run(batcher):
+        start_time = time.perf_counter()
+        submitted = [(batcher.submit(SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)], max_new_tokens=lengths[i % 3]), lengths[i % 3]) for i in range(n_requests)]
+        finished = {}
+        peak = {"running": 0, "tokens": 0}
+        while len(finished) < len(submitted):
+            for index, (future, _) in enumerate(submitted):
+                if index not in finished and future.done():
+                    future.result()
+                    finished[index] = time.perf_counter() - start_time
+            stats = batcher.kv_stats()
+            if stats:
+                peak["running"] = max(peak["running"], stats["running"])
+                peak["tokens"] = max(peak["tokens"], stats["used_blocks"] * stats["block_size"])
+            time.sleep(0.005)
+        short = [finished[index] for index, (_, length) in enumerate(submitted) if length == lengths[0]]
+        return time.perf_counter() - start_time, sum(short) / len(short), peak
+    
+    static_seconds, static_short, _ = run(RequestBatcher(lambda: model, lock))
+    paged = ContinuousBatcher(lambda: model, lock, num_blocks=num_blocks, block_size=block_size)
+    paged_seconds, paged_short, peak = run(paged)
+    
+    longest = max(model.count_prompt_tokens(question) for question in SAMPLE_QUESTIONS) + max(lengths)
+    logger.info(f"Run to completion: {static_seconds:.2f}s total, short requests done after {static_short:.2f}s")
+    logger.info(f"Paged, iteration-level: {paged_seconds:.2f}s total, short requests done after {paged_short:.2f}s")
+    logger.info(
+        f"Peak KV cache: {peak['tokens']} tokens for {peak['running']} running requests "
+        f"(padded contiguous: {peak['running'] * longest} tokens)"
+    )
+    return {"static_seconds": static_seconds, "paged_seconds": paged_seconds, "static_short": static_short, "paged_short": paged_short, **peak}
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Test MedLLama Arabic integration")
     parser.add_argument("--api-only", action="store_true", help="Test only the API, not the direct model")
     parser.add_argument("--model-only", action="store_true", help="Test only the direct model, not the API")
     parser.add_argument("--integration", action="store_true", help="Test integration with main chatbot")
+    parser.add_argument("--fallback", action="store_true", help="Test the in-process fallback latency of MedLLamaIntegration")
+    parser.add_argument("--load-balancing", type=int, nargs="?", const=3, metavar="NODES", help="Test MedLLamaIntegration over several local API nodes and exit")
+    parser.add_argument("--batch-queries", action="store_true", help="Test MedLLamaIntegration.process_queries over local API nodes and exit")
+    parser.add_argument("--response-cache", action="store_true", help="Test the SQLite response cache shared by two local API nodes and exit")
+    parser.add_argument("--cache-prewarm", action="store_true", help="Test pre-warming the response cache from an interaction log and exit")
+    parser.add_argument("--default-batching", action="store_true", help="Test that default requests are batched (in-process stub model) and exit")
+    parser.add_argument("--concurrent-init", action="store_true", help="Test that concurrent model initialization loads once (in-process stub model) and exit")
+    parser.add_argument("--degraded-requests", action="store_true", help="Test per-request degradation and its latency window (in-process stub model) and exit")
+    parser.add_argument("--coalescing", action="store_true", help="Test that identical concurrent requests share one generation (in-process stub model) and exit")
+    parser.add_argument("--speculative-counts", action="store_true", help="Test the acceptance counts of speculative decoding (offline tiny models) and exit")
+    parser.add_argument("--chunked-stops", action="store_true", help="Test the stop reasons recorded for chunked requests (in-process stub model) and exit")
     parser.add_argument("--api-url", default="http://localhost:5001", help="MedLLama API URL")
+    parser.add_argument("--fake-model", choices=["tiny", "stub"], help="Run the direct model test on an offline fake model")
+    parser.add_argument("--benchmark-backends", metavar="MODEL_PATH", help="Benchmark CPU backends on a small local model and exit")
+    parser.add_argument("--benchmark-tokenization", nargs="?", const="", metavar="MODEL_PATH", help="Benchmark cached prompt tokenization (offline tokenizer if no path) and exit")
+    parser.add_argument("--benchmark-paged-kv", action="store_true", help="Benchmark iteration-level scheduling on a paged KV cache (offline tiny model) and exit")
+    parser.add_argument("--benchmark-speculative", nargs=2, metavar=("MODEL_PATH", "DRAFT_MODEL_PATH"), help="Benchmark speculative decoding against plain generation and exit")
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
     
+    if args.benchmark_backends:
+        results = benchmark_backends(args.benchmark_backends)
+        sys.exit(0 if results else 1)
+    
+    if args.benchmark_tokenization is not None:
+        benchmark_tokenization(args.benchmark_tokenization or None)
+        sys.exit(0)
+    
+    if args.benchmark_paged_kv:
+        benchmark_paged_kv()
+        sys.exit(0)
+    
+    if args.benchmark_speculative:
+        benchmark_speculative(*args.benchmark_speculative)
+        sys.exit(0)
+    
+    if args.default_batching:
+        sys.exit(0 if test_default_batching() else 1)
+    
+    if args.chunked_stops:
+        sys.exit(0 if test_chunked_stop_reasons() else 1)
+    
+    if args.concurrent_init:
+        sys.exit(0 if test_concurrent_init() else 1)
+    
+    if args.degraded_requests:
+        sys.exit(0 if test_degraded_requests() else 1)
+    
+    if args.coalescing:
+        sys.exit(0 if test_coalescing() else 1)
+    
+    if args.speculative_counts:
+        sys.exit(0 if test_speculative_counts() else 1)
+    
+    if args.load_balancing:
+        sys.exit(0 if test_load_balancing(args.load_balancing) else 1)
+    
+    if args.batch_queries:
+        sys.exit(0 if test_batch_queries() else 1)
+    
+    if args.response_cache:
+        sys.exit(0 if test_response_cache() else 1)
+    
+    if args.cache_prewarm:
+        sys.exit(0 if test_cache_prewarm() else 1)
+    
     # If no specific test is requested, run all tests
     run_api_test = not args.model_only
     run_model_test = not args.api_only
     run_integration_test = args.integration
+    run_fallback_test = args.fallback
     
     if args.model_only and args.api_only:
         logger.error("Cannot specify both --api-only and --model-only")
@@ -183,6 +1001,7 @@ if __name__ == "__main__":
     logger.info(f"Running direct model test: {run_model_test}")
     logger.info(f"Running API test: {run_api_test}")
     logger.info(f"Running integration test: {run_integration_test}")
+    logger.info(f"Running fallback latency test: {run_fallback_test}")
     logger.info(f"API URL: {args.api_url}")
     logger.info("=====================")
     
@@ -191,7 +1010,7 @@ if __name__ == "__main__":
     
     if run_model_test:
         logger.info("\n=== Testing Direct Model Usage ===\n")
-        model_success = test_direct_model()
+        model_success = test_direct_model(args.fake_model)
         success = success and model_success
     
     if run_api_test:
@@ -204,6 +1023,11 @@ if __name__ == "__main__":
         integration_success = test_integration()
         success = success and integration_success
     
+    if run_fallback_test:
+        logger.info("\n=== Testing Fallback Latency ===\n")
+        fallback_success = test_fallback_latency()
+        success = success and fallback_success
+    
     # Summary
     logger.info("\n=== Test Summary ===\n")
     if success: